@@ -0,0 +1,393 @@
+#!/usr/bin/env python2
+"""Performance benchmarks for the Kalah state and searching methods.
+
+Usage:
+    python2 benchmark.py [name ...]
+
+Without arguments all benchmarks are run. Every benchmark prints its own
+short report to stdout.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+from copy import deepcopy
+from StringIO import StringIO
+from time import time
+
+import methods.state as st
+from methods.state import KalahState
+
+def _opening_state(stones=6):
+    """Returns a state after a couple of opening moves"""
+    state = KalahState(stones)
+    state.move(0, 2)
+    state.move(1, 3)
+    return state
+
+def _perft(state, player, depth):
+    """Counts nodes of the full searching tree (with extra moves chains)"""
+    if depth==0 or state.is_finished(player):
+        return 1
+    nodes = 1
+    for neighbor in state.iter_all_neighbors(player):
+        nodes += _perft(neighbor.state, (player+1) % 2, depth-1)
+    return nodes
+
+def _perft_in_place(state, player, depth):
+    """The same as _perft but makes and takes back moves in place"""
+    if depth==0 or state.is_finished(player):
+        return 1
+    nodes = 1
+    for holes in state.play_all_moves(player):
+        nodes += _perft_in_place(state, (player+1) % 2, depth-1)
+    return nodes
+
+def bench_copy(repeat=100000):
+    """Compares KalahState.copy with a generic deepcopy of the state"""
+    state = _opening_state()
+    start = time()
+    for i in xrange(repeat):
+        state.copy()
+    copy_time = time() - start
+    start = time()
+    for i in xrange(repeat/10):
+        deepcopy(state)
+    deepcopy_time = (time() - start) * 10
+    print "copy:     %.2f us per state" % (copy_time / repeat * 1e6)
+    print "deepcopy: %.2f us per state" % (deepcopy_time / repeat * 1e6)
+    print "speedup:  %.1fx" % (deepcopy_time / copy_time)
+
+def bench_nodes(depth=5):
+    """Measures nodes per second of a full-width tree expansion"""
+    for stones in (3, 6):
+        for title, perft in [('copy', _perft), ('in place', _perft_in_place)]:
+            state = _opening_state(stones)
+            start = time()
+            nodes = perft(state, 0, depth)
+            elapsed = time() - start
+            print "%d stones, depth %d, %s: %d nodes in %.2fs, %.0f nodes/sec" % \
+                (stones, depth, title, nodes, elapsed, nodes / elapsed)
+
+def bench_sowing(repeat=100000):
+    """Measures a time of making and taking back one move for small and big
+    amounts of stones in a hole"""
+    for stones in (4, 15, 30):
+        state = KalahState(0)
+        state.set_board([[stones]*6, [6]*6], [0, 0])
+        start = time()
+        for i in xrange(repeat):
+            state.undo_move(state.do_move(0, 3))
+        elapsed = time() - start
+        print "%d stones: %.2f us per move" % (stones, elapsed / repeat * 1e6)
+
+def bench_chains():
+    """Measures the expansion of a position with long extra moves chains"""
+    state = KalahState(0)
+    state.set_board([[6, 5, 4, 3, 2, 1], [4]*6], [0, 0])
+    chains, stack = 0, [state]
+    while stack:
+        for neighbor in stack.pop().get_neighbors(0):
+            if neighbor['result']==st.MoveEndsInPlayersKalah:
+                stack.append(neighbor['state'])
+            else:
+                chains += 1
+    start = time()
+    neighbors = state.get_all_neighbors(0)
+    elapsed = time() - start
+    start = time()
+    first = next(state.iter_all_neighbors(0))
+    first_elapsed = time() - start
+    print "%d chains merged to %d neighbors (max depth %d) in %.1f ms" % \
+        (chains, len(neighbors), max(x['depth'] for x in neighbors), elapsed*1e3)
+    print "first neighbor in %.3f ms" % (first_elapsed*1e3)
+
+def _quiet_move(method, state):
+    """Calls method.make_move without its printing and returns the time"""
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        start = time()
+        method.make_move(state)
+        return time() - start
+    finally:
+        sys.stdout = stdout
+
+def bench_depth(time_limit=5.0, stones=6):
+    """Compares the depth that MinMaxMethod reaches in a fixed time with and
+    without alpha-beta pruning"""
+    from methods.minmax import MinMaxMethod
+    state = _opening_state(stones)
+    for title, in_place, alpha_beta in [('minimax', False, False), 
+                                        ('in place', True, False),
+                                        ('alpha-beta', False, True)]:
+        method = MinMaxMethod(0)
+        method._in_place_search, method._alpha_beta = in_place, alpha_beta
+        level, times = 0, []
+        while level<20:
+            method._ai_level = level + 1
+            elapsed = _quiet_move(method, state)
+            if elapsed>time_limit:
+                break
+            level += 1
+            times.append("%.2f" % elapsed)
+        print "%s: level %d in %.0fs (%s)" % (title, level, time_limit, 
+                                              ", ".join(times))
+
+def _position_suite(count=8, stones=6, seed=2015, plies=2):
+    """Returns a list of (state, player) pairs after some pseudorandom
+    moves from the start (plies and up to six more); they are the same for
+    every run"""
+    suite = []
+    for index in range(count):
+        state, player = KalahState(stones), 0
+        for ply in range(plies + index % 4 * 2):
+            neighbors = state.get_all_neighbors(player)
+            if not neighbors:
+                break
+            seed = (seed*1103515245 + 12345) % (1<<31)
+            state, player = neighbors[seed % len(neighbors)].state, (player+1) % 2
+        if not state.is_finished(player):
+            suite.append((state, player))
+    return suite
+
+def _search_suite(suite, level, **attributes):
+    """Searches the positions of the suite with CleverBot's iterative
+    deepening up to the level; the attributes are set to every method
+
+    Returns:
+        (nodes, re-searches, time, cutoffs, first move cutoffs, nodes of
+        the helpers of Lazy SMP, decided positions, score bound cutoffs)
+    """
+    from methods.CleverBot import CleverBotMethod
+    nodes = researches = cutoffs = first_cutoffs = helper_nodes = 0
+    decided = bound_cutoffs = 0
+    start = time()
+    for state, player in suite:
+        method = CleverBotMethod(player)
+        for name, value in attributes.items():
+            setattr(method, name, value)
+        method.start_timer(3600)
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            for depth in range(2, level+1):
+                method.set_level(depth)
+                method._minimax(state)
+        finally:
+            sys.stdout = stdout
+        nodes += method._nodes
+        researches += method._researches
+        cutoffs += method._ordering.cutoffs
+        first_cutoffs += method._ordering.first_cutoffs
+        helper_nodes += sum(method._helper_nodes)
+        decided += method._decided
+        bound_cutoffs += method._bound_cutoffs
+        # stops the worker processes of the parallel search
+        method.reset()
+    return nodes, researches, time() - start, cutoffs, first_cutoffs, helper_nodes, \
+        decided, bound_cutoffs
+
+def bench_search(level=5):
+    """Compares nodes of CleverBot's root search drivers (plain alpha-beta,
+    PVS with aspiration windows and MTD(f)) for a fixed position suite;
+    each position is searched with iterative deepening up to the level"""
+    suite = _position_suite()
+    for search in ('alphabeta', 'pvs', 'mtdf'):
+        nodes, researches, elapsed = _search_suite(suite, level, _search=search)[:3]
+        print "%s: %d nodes, %d re-searches in %.2fs (%d positions, level %d)" % \
+            (search, nodes, researches, elapsed, len(suite), level)
+
+def bench_ordering(level=5):
+    """Compares CleverBot's search with and without the killer moves and
+    history heuristics (see methods/ordering.py) for a fixed position suite"""
+    suite = _position_suite()
+    for title, ordering in [('hole order', False), ('killers+history', True)]:
+        for search in ('alphabeta', 'pvs'):
+            result = _search_suite(suite, level, _search=search, _move_ordering=ordering)
+            nodes, elapsed, cutoffs, first = result[0], result[2], result[3], result[4]
+            report = "%s, %s: %d nodes in %.2fs" % (title, search, nodes, elapsed)
+            if cutoffs:
+                report += ", %.0f%% of %d cutoffs on the first move" % \
+                    (100.0 * first / cutoffs, cutoffs)
+            print report
+
+def bench_parallel(level=5):
+    """Measures the speedup of CleverBot's parallel search (root splitting,
+    Lazy SMP and young brothers wait) for different numbers of worker processes on a fixed
+    position suite"""
+    from multiprocessing import cpu_count
+    suite = _position_suite()
+    serial = None
+    for smp in ('root', 'lazy', 'ybwc'):
+        for workers in sorted(set([1, 2, 4, cpu_count()])):
+            if smp!='root' and workers==1:
+                continue
+            result = _search_suite(suite, level, _workers=workers, _smp=smp)
+            nodes, elapsed, helper_nodes = result[0], result[2], result[5]
+            if serial is None:
+                serial = elapsed
+            report = "%s, %d workers: %d nodes in %.2fs, speedup %.2fx (%d cores)" % \
+                (smp, workers, nodes, elapsed, serial / elapsed, cpu_count())
+            if helper_nodes:
+                report += ", %d nodes in the main search" % (nodes - helper_nodes)
+            print report
+
+def _search_move(method, state, level):
+    """Returns the move of CleverBot's iterative deepening up to the level
+    (without the time limit and the printing)"""
+    method.start_timer(3600)
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        for depth in range(2, level+1):
+            method.set_level(depth)
+            best_state = method._minimax(state)
+    finally:
+        sys.stdout = stdout
+    return best_state.holes[0]
+
+def _play_game(state, player, methods, levels, times):
+    """Plays the game from the state with the methods for both players;
+    the time of each move is added to times[player]
+
+    Returns:
+        Kalahs difference at the end (player 0 minus player 1)
+    """
+    state = state.copy()
+    while not state.is_finished(player):
+        start = time()
+        hole = _search_move(methods[player], state, levels[player])
+        times[player].append(time() - start)
+        if state.move(player, hole)!=st.MoveEndsInPlayersKalah:
+            player = (player+1) % 2
+    state.end_game()
+    return state.player_kalah(0) - state.player_kalah(1)
+
+def bench_bounds(level=8):
+    """Compares CleverBot's search with and without the score bounds of
+    the stores (see CleverBotMethod._bounded) on endgame positions"""
+    suite = _position_suite(16, stones=4, plies=24)
+    for search in ('alphabeta', 'mtdf'):
+        for title, bounds in [('no bounds', False), ('bounds', True)]:
+            result = _search_suite(suite, level, _search=search, _score_bounds=bounds)
+            nodes, elapsed, decided, bound_cutoffs = result[0], result[2], result[6], result[7]
+            report = "%s, %s: %d nodes in %.2fs" % (search, title, nodes, elapsed)
+            if bounds:
+                report += ", %d decided positions, %d window cutoffs (%.1f%% of nodes)" % \
+                    (decided, bound_cutoffs, 100.0 * (decided + bound_cutoffs) / nodes)
+            print report
+
+def bench_quiescence(level=3):
+    """Plays CleverBot with the quiescence search against CleverBot one
+    level deeper without it from the positions of the suite (both sides
+    of each position)"""
+    from methods.CleverBot import CleverBotMethod
+    suite = _position_suite()
+    score, times = [0, 0, 0], [[], []]
+    for state, player in suite:
+        for side in [0, 1]:
+            methods = [CleverBotMethod(0), CleverBotMethod(1)]
+            methods[(side+1) % 2]._quiescence_depth = 0
+            levels = [level, level]
+            levels[(side+1) % 2] += 1
+            move_times = [[], []]
+            result = _play_game(state, player, methods, levels, move_times)
+            result = result if side==0 else -result
+            score[0 if result>0 else 1 if result==0 else 2] += 1
+            times[0] += move_times[side]
+            times[1] += move_times[(side+1) % 2]
+    print "level %d with quiescence vs level %d without it: %d wins, %d draws, %d losses" % \
+        (level, level+1, score[0], score[1], score[2])
+    for title, moves in [("with quiescence", times[0]), ("without it", times[1])]:
+        print "%s: %.3fs per move (%d moves)" % (title, sum(moves) / len(moves), len(moves))
+
+def _random_playouts(suite, seconds=3.0):
+    """Returns playouts per second of random games played one by one with
+    KalahState objects from the positions of the suite"""
+    from random import Random
+    generator = Random(2015)
+    playouts, start = 0, time()
+    while time() - start < seconds:
+        for state, player in suite:
+            state = state.copy()
+            while not state.is_finished(player):
+                holes = [hole for hole, stones in
+                         enumerate(state.player_holes(player)) if stones]
+                if state.move(player, generator.choice(holes))!=st.MoveEndsInPlayersKalah:
+                    player = (player+1) % 2
+            playouts += 1
+    return playouts / (time() - start)
+
+def bench_mcts(level=4, seconds=1.0):
+    """Measures the playouts per second of MCTSMethod with different batches
+    of NumPy boards, then plays it against CleverBot of the level from the
+    positions of the suite; MCTS gets the average time of CleverBot's moves
+    so far for each move"""
+    from methods.CleverBot import CleverBotMethod
+    from methods.mcts import MCTSMethod
+    suite = _position_suite()
+    print "KalahState one by one: %.0f playouts/sec" % _random_playouts(suite)
+    for batch_size, leaf_playouts in [(64, 1), (64, 4)]:
+        playouts = elapsed = 0
+        for state, player in suite:
+            method = MCTSMethod(player)
+            method._batch_size, method._leaf_playouts = batch_size, leaf_playouts
+            method.set_run_time_limit(seconds)
+            _quiet_move(method, state)
+            playouts += method._playouts
+            elapsed += method._search_time
+        print "batches of %d leaves x %d playouts: %.0f playouts/sec" % \
+            (batch_size, leaf_playouts, playouts / elapsed)
+
+    score, times = [0, 0, 0], [[], []]
+    for state, player in suite:
+        for side in [0, 1]:
+            methods = [None, None]
+            methods[side] = MCTSMethod(side)
+            methods[(side+1) % 2] = CleverBotMethod((side+1) % 2)
+            game, turn = state.copy(), player
+            while not game.is_finished(turn):
+                start = time()
+                if turn==side:
+                    methods[turn].set_run_time_limit(sum(times[1]) / len(times[1]) if times[1] else 0.5)
+                    stdout, sys.stdout = sys.stdout, StringIO()
+                    try:
+                        hole = methods[turn].make_move(game)
+                    finally:
+                        sys.stdout = stdout
+                else:
+                    hole = _search_move(methods[turn], game, level)
+                times[0 if turn==side else 1].append(time() - start)
+                if game.move(turn, hole)!=st.MoveEndsInPlayersKalah:
+                    turn = (turn+1) % 2
+            game.end_game()
+            result = game.player_kalah(side) - game.player_kalah((side+1) % 2)
+            score[0 if result>0 else 1 if result==0 else 2] += 1
+    print "MCTS vs CleverBot level %d: %d wins, %d draws, %d losses" % \
+        (level, score[0], score[1], score[2])
+    for title, moves in [("MCTS", times[0]), ("CleverBot", times[1])]:
+        print "%s: %.3fs per move (%d moves)" % (title, sum(moves) / len(moves), len(moves))
+
+BENCHMARKS = [('copy', bench_copy), ('nodes', bench_nodes), 
+              ('sowing', bench_sowing), ('chains', bench_chains),
+              ('depth', bench_depth), ('search', bench_search),
+              ('ordering', bench_ordering), ('bounds', bench_bounds),
+              ('quiescence', bench_quiescence),
+              ('parallel', bench_parallel), ('mcts', bench_mcts)]
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or [name for name, func in BENCHMARKS]
+    for name, func in BENCHMARKS:
+        if name in names:
+            print "== %s ==" % name
+            func()
+            sys.stdout.flush()
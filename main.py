@@ -3,11 +3,15 @@ from main_window import Ui_kalah_window
 from options_dialog import Ui_kalah_options
 
 import methods.state as st
+from methods.encoding import pack, unpack
+from methods.ponder import Ponderer
 
 import sys
+import atexit
 import inspect
 import time
 import os
+import signal
 from os.path import isfile, join
 from importlib import import_module
 from multiprocessing import Process, Pipe
@@ -15,42 +19,198 @@ from PyQt4 import QtCore, QtGui
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-class AsyncRunProcess(Process):
-    """Class that implements methods running in a separate process"""
-    def __init__(self, obj, state, conn):
+class EngineProcess(Process):
+    """Process that keeps a method instance of an AI player during the game
+
+    The method object lives as long as the process, so its caches survive
+    between moves. Commands are received through the pipe:
+        ("move", request, position, time_limit): makes a move for the
+            position (packed by encoding.pack for the method's player) and
+            sends back ("finish", request, hole); if time_limit is None
+            then the method's own running time limit is used
+        ("new_game",), ("end_game",), ("reset",): call the method's hooks
+        ("quit",): stops the process
+    The process closes its copies of the GUI ends of the pipes (gui_conns),
+    so it gets EOF and quits when the GUI has gone, even without "quit".
+    In the ponder mode the replies to the opponent's possible moves are
+    searched by the method object itself while the opponent thinks (see
+    methods/ponder.py); the hit rate and the saved time are printed at the
+    end of each game.
+    """
+    def __init__(self, method_class, player, ai_level, conn, ponder=False, gui_conns=()):
         Process.__init__(self)
-        self.obj = obj
-        self.state = state.copy()
+        self.method_class = method_class
+        self.player = player
+        self.ai_level = ai_level
         self.conn = conn
-#        print "Calculation process initialized"
+        self.ponder = ponder
+        self.gui_conns = gui_conns
+
     def run(self):
-        result = self.obj.make_move(self.state)
-        print result
-        sys.stdout.flush()
-        self.conn.send(("finish",result))
+        for conn in self.gui_conns:
+            conn.close()
+        # the GUI stops a busy engine with terminate(); the exit runs the
+        # finally clause below, so the pondering is stopped too
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        obj = self.method_class(self.player, self.ai_level)
+        default_time_limit = obj._run_time_limit
+        ponderer = None
+        if self.ponder:
+            ponderer = Ponderer(obj)
+        try:
+            self.serve(obj, default_time_limit, ponderer)
+        finally:
+            if ponderer:
+                ponderer.stop()
+
+    def serve(self, obj, default_time_limit, ponderer):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except EOFError:
+                break
+            if msg[0]=="move":
+                request, position, time_limit = msg[1:]
+                if time_limit is None:
+                    time_limit = default_time_limit
+                state = unpack(position, self.player)
+                result = ponderer.take(position) if ponderer else None
+                if result is None:
+                    obj.set_run_time_limit(time_limit)
+                    result = obj.make_move(state)
+                else:
+                    print "Pondered move"
+                print result
+                sys.stdout.flush()
+                self.conn.send(("finish", request, result))
+                if ponderer:
+                    ponderer.start(state, result, time_limit)
+            elif msg[0]=="new_game":
+                if ponderer:
+                    ponderer.stop()
+                    ponderer.reset_stats()
+                obj.new_game()
+            elif msg[0]=="end_game":
+                if ponderer:
+                    ponderer.stop()
+                    print ponderer.stats()
+                    sys.stdout.flush()
+                obj.end_game()
+            elif msg[0]=="reset":
+                if ponderer:
+                    ponderer.stop()
+                obj.reset()
+            elif msg[0]=="quit":
+                break
+
+class Engine(object):
+    """Controls an EngineProcess of one AI player from the GUI"""
+    # the engines that are not stopped yet; each new engine process closes
+    # the GUI ends of their pipes, so no engine keeps another one waiting
+    running = []
+
+    def __init__(self, method_class, player, ai_level, ponder=False):
+        self.method_class = method_class
+        self.player = player
+        self.ai_level = ai_level
+        self.ponder = ponder
+        self.busy = False
+        self.request = 0
+        self.conn, child_conn = Pipe()
+        Engine.running.append(self)
+        self.process = EngineProcess(method_class, player, ai_level, child_conn, ponder,
+                                     [engine.conn for engine in Engine.running])
+        self.process.start()
+        # only the engine writes to its end, so a dead engine gives EOF here
+        child_conn.close()
+
+    def name(self):
+        return self.method_class._name
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def new_game(self):
+        self.conn.send(("new_game",))
+
+    def end_game(self):
+        self.conn.send(("end_game",))
+
+    def reset(self):
+        self.conn.send(("reset",))
+
+    def request_move(self, state, time_limit):
+        """Sends the position to the engine and returns the request number"""
+        self.request += 1
+        self.busy = True
+        self.conn.send(("move", self.request, pack(state, self.player), time_limit))
+        return self.request
+
+    def reply(self, request):
+        """Returns the engine's hole for the request or None if there is no
+        answer yet; raises EOFError if the engine has stopped"""
+        while self.conn.poll():
+            msg, reply_request, result = self.conn.recv()
+            if reply_request==request:
+                self.busy = False
+                return result
+        return None
+
+    def stop(self):
+        self.busy = False
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        if self in Engine.running:
+            Engine.running.remove(self)
+
+    @staticmethod
+    def stop_all():
+        """Stops the engines that are still running; it is called at the
+        exit, before multiprocessing joins the engine processes"""
+        for engine in list(Engine.running):
+            engine.stop()
 
 class AsyncRun(QtCore.QObject):
-    """Class that runs method instance for a problem asynchronously"""
+    """Class that waits for the engine's move asynchronously
+
+    If the engine does not answer in reply_time seconds (e.g. its method
+    does not keep the time limit), the engine is stopped and the first
+    possible hole is played, so the player does not lose on time."""
     stop = False
-    def __init__(self, obj, state):
+    def __init__(self, engine, state, time_limit, reply_time=None):
         QtCore.QObject.__init__(self)
-        self.obj = obj
-        self.state = state
+        self.engine = engine
+        self.reply_time = reply_time
+        holes = state.player_holes(engine.player)
+        self.fallback = min(hole for hole, stones in enumerate(holes) if stones)
+        # the position is sent right away, so the game can go on changing
+        # its state
+        self.request = engine.request_move(state, time_limit)
     def run(self):
-        print self.obj.name() + " thinks..."
-        parent_conn, child_conn = Pipe()
-        self.process = AsyncRunProcess(self.obj, self.state, child_conn)
-        self.process.start()
+        print self.engine.name() + " thinks..."
         sys.stdout.flush()
-        while not self.stop and not parent_conn.poll():
-            time.sleep(0.1)
+        request = self.request
+        result = None
+        start = time.time()
+        try:
+            while not self.stop:
+                result = self.engine.reply(request)
+                if result is not None:
+                    break
+                if self.reply_time is not None and time.time() - start>self.reply_time:
+                    print "No answer in time, the hole %d is played" % self.fallback
+                    self.engine.stop()
+                    result = self.fallback
+                    break
+                time.sleep(0.1)
+        except (EOFError, IOError):
+            # the engine was stopped
+            result = None
         if self.stop:
-            self.process.terminate()
-            self.process.join()
-        elif parent_conn.poll():
-            msg, result = parent_conn.recv()
+            self.engine.stop()
+        elif result is not None:
             print "Calculation finished"
-            self.process.join()
             self.emit(QtCore.SIGNAL("success"), result)
         self.emit(QtCore.SIGNAL("finished"))
 
@@ -134,6 +294,21 @@ class BoardScene(QtGui.QGraphicsScene):
         if redraw:
             self.draw()
 
+    def begin_replay(self):
+        self.old_state = self.state.copy()
+
+    def replay_event(self, pit, delta):
+        """Applies one event of a move's trace to the displayed state and 
+        redraws only the changed pit; returns (player, hole) of the pit"""
+        player, hole = self.state.pit_location(pit)
+        self.state.apply_event(pit, delta)
+        if hole>=0:
+            self._set_hole(player, hole)
+        else:
+            self._set_kalah(player)
+        self.old_state.apply_event(pit, delta)
+        return player, hole
+
     def _draw_hole(self, player, hole, number, prev_number):
         rect = self.holes[player][hole]['rect']
         if self.holes[player][hole]['items']:
@@ -369,7 +544,8 @@ class MainWindow(QtGui.QMainWindow):
                "ai_level_1":3, "ai_level_2":3,
                "timer_on":True, "time_per_move":60,
                "show_moves":False,
-               "show_moves_time_interval":0.1}
+               "show_moves_time_interval":0.1,
+               "ponder":False}
     ai_methods = {}
     method_path = "methods"
 
@@ -385,6 +561,7 @@ class MainWindow(QtGui.QMainWindow):
 
     ai_run_thread = None
     ai_run_object = None
+    engines = [None, None]
 
 #    board_scene_holes = [[],[]]
 #    board_kalahs = [None, None]
@@ -458,6 +635,8 @@ class MainWindow(QtGui.QMainWindow):
         dialog.ui.time_per_move.setEnabled(self.options["timer_on"])
         dialog.ui.time_per_move.setValue(self.options['time_per_move'])
 
+        dialog.ui.ponder.setCheckState(self.options["ponder"] and QtCore.Qt.Checked or QtCore.Qt.Unchecked)
+
         dialog.ui.show_moves.setCheckState(self.options["show_moves"] and QtCore.Qt.Checked or QtCore.Qt.Unchecked)
 
         if dialog.exec_():
@@ -469,6 +648,7 @@ class MainWindow(QtGui.QMainWindow):
             self.options["ai_level_2"] = dialog.ui.ai_level_2.value()
             self.options["timer_on"] = dialog.ui.timer_on.checkState()==QtCore.Qt.Checked
             self.options["time_per_move"] = dialog.ui.time_per_move.value()
+            self.options["ponder"] = dialog.ui.ponder.checkState()==QtCore.Qt.Checked
             self.options["show_moves"] = dialog.ui.show_moves.checkState()==QtCore.Qt.Checked
             self.process_options()
             return True
@@ -492,7 +672,31 @@ class MainWindow(QtGui.QMainWindow):
             self.ai_players[1] = self.options["player_2"]
             self.ai_levels[1] = self.options["ai_level_2"]
 
+    def engine(self, player):
+        """Returns the engine of the AI player; it is started again if the
+        options have changed or it is still busy with an old position"""
+        ai_player = self.ai_players[player]
+        method_class = self.ai_methods[ai_player]['class']
+        # an AI opponent searches on its own time, so the time is not idle
+        ponder = self.options["ponder"] and not self.ai_players[(player+1) % 2]
+        engine = self.engines[player]
+        if engine and (engine.method_class is not method_class or engine.busy or
+                engine.ai_level!=self.ai_levels[player] or
+                engine.ponder!=ponder or not engine.is_alive()):
+            engine.stop()
+            engine = None
+        if not engine:
+            engine = self.engines[player] = Engine(method_class, player, self.ai_levels[player],
+                                                   ponder)
+        return engine
+
     def new_game(self):
+        for player in [0, 1]:
+            if self.ai_players[player]:
+                self.engine(player).new_game()
+            elif self.engines[player]:
+                self.engines[player].stop()
+                self.engines[player] = None
         self.active_player = 0
         self.is_animating = False
         self.move_result = st.MoveEnds
@@ -542,6 +746,9 @@ class MainWindow(QtGui.QMainWindow):
 
             self.move_result = st.MoveEnds
             self.display_active_player()
+            for engine in self.engines:
+                if engine and not engine.busy:
+                    engine.reset()
             if self.ai_players[self.active_player]:
                 self.board_scene.block_mouse()
                 self.ai_moves()
@@ -563,6 +770,9 @@ class MainWindow(QtGui.QMainWindow):
             self.ui.time_left.hide()
             self.board_scene.hole_clicked.disconnect()
             score = self.current_state.end_game()
+            for engine in self.engines:
+                if engine and not engine.busy:
+                    engine.end_game()
             if score[0]>score[1]:
                 msg = "Game over. Player 1 wins!"
             elif score[0]<score[1]:
@@ -637,7 +847,7 @@ class MainWindow(QtGui.QMainWindow):
             self.moves.append({'state':self.current_state.copy(), 'player':self.active_player})
             self.ui.undo.setEnabled(True)
 
-        self.move_result = self.current_state.move(player, hole)
+        self.move_result = self.current_state.move(player, hole, trace=self.options["show_moves"])
         if self.move_result==st.WrongMove:
             QtGui.QMessageBox(QtGui.QMessageBox.Warning, "Warning", "Wrong move. Try another!", QtGui.QMessageBox.Ok, self).exec_()
             return
@@ -648,20 +858,19 @@ class MainWindow(QtGui.QMainWindow):
 
                 def animate_move():
                     if self.prev_move:
-                        if self.prev_move['hole']>=0:
-                            self.board_scene.deactivate_hole(self.prev_move['player'], self.prev_move['hole'])
-                        if self.prev_move['kalah']:
-                            self.board_scene.deactivate_kalah(self.prev_move['player'])
+                        prev_player, prev_hole = self.prev_move
+                        if prev_hole>=0:
+                            self.board_scene.deactivate_hole(prev_player, prev_hole)
+                        else:
+                            self.board_scene.deactivate_kalah(prev_player)
                     if self.animated_moves:
-                        move = self.animated_moves.pop(0)
-                        if move['hole']>=0:
-                            self.board_scene.activate_hole(move['player'], move['hole'])
-                        if move['kalah']:
-                            self.board_scene.activate_kalah(move['player'])
-                        self.prev_move = move
-
-                        self.display_board(move['state'])
-#                        print move['state'].to_string()
+                        pit, delta = self.animated_moves.pop(0)
+                        move_player, move_hole = self.board_scene.replay_event(pit, delta)
+                        if move_hole>=0:
+                            self.board_scene.activate_hole(move_player, move_hole)
+                        else:
+                            self.board_scene.activate_kalah(move_player)
+                        self.prev_move = move_player, move_hole
                     else:
                         self.animated_timer.stop()
                         self.end_animation()
@@ -669,6 +878,7 @@ class MainWindow(QtGui.QMainWindow):
                         self.move_finished()
 
                 self.prev_move = None
+                self.board_scene.begin_replay()
                 self.animated_timer = QtCore.QTimer()
                 self.animated_timer.timeout.connect(animate_move)
                 self.animated_timer.start(self.options["show_moves_time_interval"]*1000)
@@ -723,15 +933,21 @@ class MainWindow(QtGui.QMainWindow):
             self.board_scene.unblock_mouse()
 
     def ai_moves(self):
-        ai_player = self.ai_players[self.active_player]
-        obj = self.ai_methods[ai_player]['class'](self.active_player, self.ai_levels[self.active_player])
+        engine = self.engine(self.active_player)
+        time_limit = reply_time = None
         if self.game_with_timer:
+            # the clock of the move runs out a second later (the options
+            # of the older versions can have a timer of 0 or 1 second, so
+            # the engine gets at least a second anyway)
+            reply_time = max(self.options["time_per_move"]-1, 1)
+            # the engine answers before the fallback move of AsyncRun is
+            # played, so its tables are not lost with the engine process
             if self.options["time_per_move"]>10:
-                obj.set_run_time_limit(self.options["time_per_move"]-2)
+                time_limit = self.options["time_per_move"]-2
             else:
-                obj.set_run_time_limit(self.options["time_per_move"])
+                time_limit = reply_time-0.5
 
-        self.ai_run_object = AsyncRun(obj, self.current_state)
+        self.ai_run_object = AsyncRun(engine, self.current_state, time_limit, reply_time)
         self.ai_run_thread = QtCore.QThread()
         QtCore.QObject.connect(self.ai_run_thread, QtCore.SIGNAL("started()"), self.ai_run_object.run, QtCore.Qt.DirectConnection);
         QtCore.QObject.connect(self.ai_run_thread, QtCore.SIGNAL("finished()"), self.ai_run_object.deleteLater, QtCore.Qt.DirectConnection);
@@ -742,6 +958,12 @@ class MainWindow(QtGui.QMainWindow):
         self.ai_run_object.moveToThread(self.ai_run_thread)
         self.ai_run_thread.start()
 
+    def closeEvent(self, event):
+        for engine in self.engines:
+            if engine:
+                engine.stop()
+        event.accept()
+
     def process_ai_move(self, hole):
         self.ai_run_thread.wait()
         del self.ai_run_thread
@@ -754,6 +976,9 @@ class MainWindow(QtGui.QMainWindow):
 
 if __name__ == "__main__":
     sys.path.append(join(sys.path[0], 'methods'))
+    # it runs before the exit-time join of multiprocessing (the handlers
+    # run in the reverse order), also when the window was not closed
+    atexit.register(Engine.stop_all)
     app = QtGui.QApplication(sys.argv)
     myapp = MainWindow()
     myapp.show()
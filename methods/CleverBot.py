@@ -1,13 +1,32 @@
 #!/usr/bin/env python2
 from __future__ import print_function
+import gc
 import sys
-from time import time
+from itertools import chain
+from time import sleep, time
+from multiprocessing import Pool, Process, RawValue, Value
 if __name__ == "__main__":
     from method import Method
+    from encoding import pack, pack_holes, unpack
+    from state import KalahMove
+    from cache import NeighborCache
+    from jobs import JobBoard, JobDone
+    from timeman import TimeManager, StopDecided, StopDepth, StopKnown, StopTimeout
+    from ordering import MoveOrdering
+    from tt import TranspositionTable, SharedTranspositionTable
+    from tt import BoundExact, BoundLower, BoundUpper
 else:
     from methods.method import Method
+    from methods.encoding import pack, pack_holes, unpack
+    from methods.cache import NeighborCache
+    from methods.jobs import JobBoard, JobDone
+    from methods.timeman import TimeManager, StopDecided, StopDepth, StopKnown, StopTimeout
+    from methods.ordering import MoveOrdering
+    from methods.tt import TranspositionTable, SharedTranspositionTable
+    from methods.tt import BoundExact, BoundLower, BoundUpper
+    from methods.state import KalahMove
 
-precomputed = lambda state: {
+_precomputed_table = {
  ((5,5,5,5,5,5),(5,5,5,5,5,5)): 1  # p1 start
 ,((5,0,6,6,6,6),(5,5,5,5,5,5)):3   # p1 continue
 ,((6,6,5,5,5,5),(5,0,0,7,7,7)):0   # defense for p2 after move of p1
@@ -1566,15 +1585,244 @@ precomputed = lambda state: {
 ,((8,5,3,0,0,0),(0,0,4,3,0,7,6)):1
 ,((8,5,3,0,0,1),(0,0,4,3,0,7,6)):5
 ,((9,1,5,2,1,0),(0,0,4,0,1,0,10)):0
-}.get(state, None)
+}
+
+# Precomputed moves keyed by the canonical encoding of the holes (see
+# encoding.pack_holes). Entries with 7-element tuples can never match a 
+# position, so they are skipped
+precomputed = dict((bytes(bytearray(my_holes + opp_holes)), hole)
+    for (my_holes, opp_holes), hole in _precomputed_table.items()
+    if len(my_holes) == 6 and len(opp_holes) == 6)
+
+# A bound of a value is flipped when the value is negated
+_flipped_bound = {BoundExact: BoundExact, BoundLower: BoundUpper,
+                  BoundUpper: BoundLower}
+
+# Searching method of a worker process of the parallel search (see
+# CleverBotMethod._parallel_root, _lazy_root and _split); it lives as long as the
+# worker, so its caches are kept between the searches
+_worker = None
+
+# Attributes of the method that are copied to the workers
+_worker_attributes = ('_in_place_search', '_search', '_aspiration_window',
+                      '_move_ordering', '_quiescence_depth', '_score_bounds')
+
+def _init_worker(method_class, player, attributes, bound, stop, table):
+    global _worker
+    _worker = method_class(player)
+    for name, value in attributes.items():
+        setattr(_worker, name, value)
+    _worker._workers = 1
+    _worker._bound = bound
+    _worker._stop = stop
+    if table is not None:
+        _worker._tt = table
+
+def _search_root_move(task):
+    # Searches one root move in a worker process. The best value of the
+    # root found so far by all workers is the alpha of the search, and the
+    # result raises it for the next moves; when it is already not less than
+    # beta the root is cut and the move is skipped. Returns (index, value,
+    # alpha, nodes); the value is None on timeout
+    index, data, max_depth, beta, deadline = task
+    method = _worker
+    method._max_depth = max_depth
+    method._set_deadline(deadline)
+    method._nodes = 0
+    alpha = method._bound.value
+    if alpha >= beta:
+        return index, -float('inf'), alpha, 0
+    value = method._min_value(unpack(data), 1, alpha, beta)
+    if value is not None:
+        with method._bound.get_lock():
+            if value > method._bound.value:
+                method._bound.value = value
+    return index, value, alpha, method._nodes
+
+def _search_lazy(task):
+    # Searches the root in a helper process of Lazy SMP until the main
+    # search is finished; the helper starts from its own root move (index)
+    # and the odd helpers search one level deeper. Returns (index, nodes)
+    index, data, max_depth, alpha, beta, deadline = task
+    method = _worker
+    method._max_depth = max_depth + index % 2
+    method._root_shift = index
+    method._set_deadline(deadline)
+    method._nodes = 0
+    method._root(unpack(data), alpha, beta)
+    return index, method._nodes
+
+def _steal_jobs(method_class, player, attributes, board, table):
+    # Main loop of a worker process of the young brothers wait search: the
+    # worker steals the jobs of the board (see jobs.JobBoard) and searches
+    # them; the nodes of a job can be split again by the worker
+    _init_worker(method_class, player, attributes, None, None, table)
+    method = _worker
+    method._board = board
+    while not board.is_quit():
+        slot = board.steal()
+        if slot is None:
+            sleep(0.001)
+            continue
+        data, job_player, depth, max_depth, alpha, beta, deadline = board.job(slot)
+        method._max_depth = max_depth
+        method._set_deadline(deadline)
+        method._job, method._nodes = slot, 0
+        value = method._alpha_beta(unpack(data), job_player, depth, alpha, beta)
+        method._job = -1
+        board.finish(slot, value, method._nodes)
 
 class CleverBotMethod(Method):
     _name = "CleverBot"
     _short_name = "CleverBot"
+    # walk the tree with KalahState.play_all_moves instead of copying states
+    _in_place_search = False
+    # size of the neighbors cache in MB; 0 turns the cache off
+    _cache_size = 64
+    # size of the transposition table in MB; 0 turns the table off
+    _tt_size = 16
+    # file to keep the deep results of the transposition table between
+    # games (see tt.TranspositionTable.save); None turns it off
+    _tt_file = None
+    # only the results of the searches of this depth or deeper are saved
+    _tt_file_min_draft = 5
+    # root search driver: 'alphabeta', 'pvs' (principal variation search
+    # with aspiration windows) or 'mtdf'; pvs and mtdf start from the
+    # score of the previous depth
+    _search = 'alphabeta'
+    # half width of the aspiration window of pvs
+    _aspiration_window = 4
+    # order the moves by killer moves and history scores (see
+    # ordering.MoveOrdering); the in place search keeps the order of holes,
+    # but the cutoffs are counted in all modes
+    _move_ordering = True
+    # maximum plies of the quiescence search below the nominal depth: only
+    # captures and extra moves chains are searched there; 0 turns it off
+    _quiescence_depth = 2
+    # the stores bound the final score (see _bounded): the decided positions
+    # get their exact values and the windows out of reach are cut
+    _score_bounds = True
+    # value of a won game; the utilities of the positions are far from it
+    _win_value = 1000
+    # number of processes of the parallel search; 1 searches only in this
+    # process
+    _workers = 1
+    # parallel search: 'root' splits the root moves between the workers
+    # (see _parallel_root), 'lazy' is Lazy SMP: all the workers search the
+    # same position with a shared transposition table (see _lazy_root),
+    # 'ybwc' splits the nodes of the tree with the young brothers wait
+    # concept (see _split)
+    _smp = 'root'
+    # the ybwc search splits only the nodes with this remaining depth or
+    # deeper, the smaller subtrees are not worth the jobs
+    _split_draft = 3
+    # seconds past the deadline that a ybwc search waits for the jobs that
+    # are stolen by the other workers (they stop at the same deadline)
+    # before it gives them up
+    _job_grace = 0.1
+    # seconds of a usual move; the time manager (see timeman.TimeManager)
+    # stops the iterative deepening earlier or extends it up to the time
+    # limit of the move
+    _move_time = 5
 
     def __init__(self, player_num, ai_level=4):
         super(CleverBotMethod, self).__init__(player_num, ai_level)
         self.set_level(ai_level)
+        self._cache = NeighborCache(self._cache_size) if self._cache_size else None
+        self._tt = TranspositionTable(self._tt_size) if self._tt_size else None
+        if self._tt is not None and self._tt_file:
+            self._tt.load(self._tt_file, self._name)
+        self._ordering = MoveOrdering()
+        self._pool = self._bound = self._stop = self._helpers_stop = None
+        self._root_shift = 0
+        self._helper_nodes = []
+        self._board, self._stealers, self._job = None, [], -1
+        self._timeman = TimeManager()
+        self._deadline = float('inf')
+        self._score = None
+        self._nodes = self._researches = 0
+        self._decided = self._bound_cutoffs = 0
+
+    def reset(self):
+        if self._cache is not None:
+            self._cache.clear()
+        self._ordering.clear()
+        if self._tt is not None:
+            self._tt.clear()
+        self._close_pool()
+        super(CleverBotMethod, self).reset()
+
+    def _worker_pool(self):
+        # The workers are started with the first parallel search and kept
+        # until reset, so they keep their transposition tables. For Lazy
+        # SMP this process is one of the workers and the table is moved to
+        # shared memory before the helpers are forked
+        if self._pool is None:
+            self._bound = Value('d', -float('inf'))
+            self._helpers_stop = RawValue('b', 0)
+            table, processes = None, self._workers
+            if self._smp == 'lazy':
+                table, processes = self._shared_tt(), self._workers - 1
+            attributes = dict((name, getattr(self, name)) for name in _worker_attributes)
+            self._pool = Pool(processes, _init_worker,
+                              (self.__class__, self._player, attributes, self._bound,
+                               self._helpers_stop, table))
+        return self._pool
+
+    def _job_board(self):
+        # The same for the young brothers wait search: this process is one
+        # of the workers, the rest only steal the jobs. A board that was
+        # given up (a worker died, see _jobs_abandoned) is made again with
+        # new workers; the slots of the jobs that were given up after the
+        # deadline are freed before each search
+        if self._board is not None and self._board.is_quit():
+            self._close_board()
+        if self._board is not None:
+            self._board.sweep()
+        if self._board is None:
+            table = self._shared_tt()
+            self._board = JobBoard()
+            attributes = dict((name, getattr(self, name)) for name in _worker_attributes)
+            for index in range(1, self._workers):
+                process = Process(target=_steal_jobs,
+                                  args=(self.__class__, self._player, attributes,
+                                        self._board, table))
+                process.daemon = True
+                process.start()
+                self._stealers.append(process)
+        return self._board
+
+    def _shared_tt(self):
+        # moves the transposition table to shared memory
+        if not isinstance(self._tt, SharedTranspositionTable):
+            self._tt = SharedTranspositionTable(self._tt_size or 16)
+            if self._tt_file:
+                self._tt.load(self._tt_file, self._name)
+        return self._tt
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = self._bound = self._helpers_stop = None
+        self._close_board()
+
+    def _close_board(self):
+        if self._board is not None:
+            self._board.quit()
+            for process in self._stealers:
+                process.terminate()
+                process.join()
+            self._board, self._stealers = None, []
+
+    def end_game(self):
+        if self._tt is not None and self._tt_file:
+            self._tt.save(self._tt_file, self._name, self._tt_file_min_draft)
+
+    def _neighbors(self, state, player):
+        if self._cache is None:
+            return state.iter_all_neighbors(player)
+        return self._cache.get_all_neighbors(state, player)
 
     def set_level(self, ai_level):
         self._max_depth = ai_level + 2
@@ -1589,6 +1837,7 @@ class CleverBotMethod(Method):
         utility = [0,0]
         for player in (self._player,self._other_player()):
             oth =  self._player if player == self._other_player() else self._other_player()
+            oth_holes = state.player_holes(oth)
             u = utility[player] = 4 * state.player_kalah(player)
             for index, stones in enumerate(state.player_holes(player)):
                 u += min(stones, 6 - index)
@@ -1597,49 +1846,232 @@ class CleverBotMethod(Method):
                 if stones + index >= 13:
                     u += min(stones + index - 12, 6)
                 if not stones:
-                    u += state.player_holes(oth)[5 - index]
+                    u += oth_holes[5 - index]
 
 
         return utility[self._player] - utility[self._other_player()]
 
-    def _max_value(self, state, depth=1):
-        if depth == self._max_depth - 3 and self._test_timeout():
+    def _max_value(self, state, depth=1, alpha=-float('inf'), beta=float('inf')):
+        return self._alpha_beta(state, self._player, depth, alpha, beta)
+
+    def _min_value(self, state, depth=1, alpha=-float('inf'), beta=float('inf')):
+        return self._alpha_beta(state, self._other_player(), depth, alpha, beta)
+
+    def _alpha_beta(self, state, player, depth, alpha, beta):
+        # Values are for self._player, but the transposition table keeps
+        # them for the player who moves (sign flips them and their bounds)
+        if self._test_timeout():
             return None # for recursive timeouts
-        if self._terminal_test(state, self._player, depth):
+        self._nodes += 1
+        if self._score_bounds:
+            value = self._bounded(state, player, alpha, beta)
+            if value is not None:
+                return value
+        if self._terminal_test(state, player, depth):
+            if self._quiescence_depth and not state.is_finished(player):
+                return self._quiescence(state, player, 0, alpha, beta)
             return self._utility(state)
-        value = -float('inf')
-        neighbors = state.get_all_neighbors(self._player)
-        for new_state in neighbors:
-            rec_val = self._min_value(new_state['state'], depth + 1)
-            if rec_val is None: return None # for timeouts
-            value = max(value, rec_val)
+        sign = 1 if player == self._player else -1
+        key = state.key(player)
+        draft = self._max_depth - depth
+        best_move = 0
+        if self._tt is not None:
+            entry = self._tt.probe(key, draft)
+            if entry is not None:
+                tt_draft, bound, value, best_move = entry
+                if tt_draft >= draft:
+                    value *= sign
+                    if sign < 0:
+                        bound = _flipped_bound[bound]
+                    if (bound == BoundExact or
+                            bound == BoundLower and value >= beta or
+                            bound == BoundUpper and value <= alpha):
+                        return value
+
+        next_player = (player + 1) % 2
+        search = self._max_value if next_player == self._player else self._min_value
+        orig_alpha, orig_beta = alpha, beta
+        value, move = -sign * float('inf'), 0
+        children = self._children(state, player, depth, best_move)
+        try:
+            moves = enumerate(children)
+            for index, (child, new_state) in moves:
+                if self._search == 'pvs' and move and beta - alpha > 1:
+                    # Principal variation search: the first move is
+                    # expected to be the best, so the others are only
+                    # checked with a null window and searched again if
+                    # they are better
+                    if sign > 0:
+                        rec_val = search(child, depth + 1, alpha, alpha + 1)
+                    else:
+                        rec_val = search(child, depth + 1, beta - 1, beta)
+                    if rec_val is not None and alpha < rec_val < beta:
+                        rec_val = search(child, depth + 1, alpha, beta)
+                else:
+                    rec_val = search(child, depth + 1, alpha, beta)
+                if rec_val is None: return None # for timeouts
+                if sign * rec_val > sign * value:
+                    value, move = rec_val, child.key(next_player)
+                    if sign > 0: alpha = max(alpha, value)
+                    else: beta = min(beta, value)
+                    if alpha >= beta:
+                        self._cutoff(player, depth, new_state, index, draft)
+                        break
+                if self._board is not None and draft >= self._split_draft:
+                    result = self._split(moves, player, depth, draft, alpha, beta,
+                                         value, move)
+                    if result is None: return None # for timeouts
+                    value, move = result[:2]
+                    break
+        finally:
+            children.close()
+
+        self._store(key, draft, value, orig_alpha, orig_beta, sign, move)
         return value
 
-    def _min_value(self, state, depth=1):
-        if depth == self._max_depth - 3 and self._test_timeout():
-            return None # for recursive timeouts
-        if self._terminal_test(state, self._other_player(), depth):
-            return self._utility(state)
-        value = float('inf')
-        neighbors = state.get_all_neighbors(self._other_player())
-        for new_state in neighbors:
-            rec_val = self._max_value(new_state['state'], depth + 1)
-            if rec_val is None: return None  # for timeouts
-            value = min(value, rec_val)
+    def _quiescence(self, state, player, qdepth, alpha, beta):
+        # A capture or an extra move can change the utility a lot, so the
+        # positions where they are possible are not estimated at once: only
+        # these moves are searched further. The player can also stand pat,
+        # i.e. keep the utility of the position if the moves are worse
+        if self._score_bounds:
+            value = self._bounded(state, player, alpha, beta)
+            if value is not None:
+                return value
+        value = self._utility(state)
+        if qdepth >= self._quiescence_depth or state.is_finished(player):
+            return value
+        sign = 1 if player == self._player else -1
+        if sign > 0: alpha = max(alpha, value)
+        else: beta = min(beta, value)
+        if alpha >= beta:
+            return value
+        next_player = (player + 1) % 2
+        for new_state in self._neighbors(state, player):
+            if new_state.depth == 1 and not new_state.captured:
+                continue
+            self._nodes += 1
+            if self._test_timeout():
+                return None # long extra moves chains have hundreds of neighbors
+            rec_val = self._quiescence(new_state.state, next_player, qdepth + 1,
+                                       alpha, beta)
+            if rec_val is None: return None # for timeouts
+            if sign * rec_val > sign * value:
+                value = rec_val
+                if sign > 0: alpha = max(alpha, value)
+                else: beta = min(beta, value)
+                if alpha >= beta: break
         return value
 
+    def _bounded(self, state, player, alpha, beta):
+        # The seeds never leave the stores, and the seeds that are left on
+        # the board go to the stores at the end, so the final store of each
+        # player is between the store now and the store plus the seeds on
+        # the board. A store with more than half of all the seeds decides
+        # the game, and a finished game is decided by the stores with the
+        # seeds of the own sides. The exact value of a decided position is
+        # returned; a position that can not reach the window returns its
+        # bound (the player who can not win any more is worth less than a
+        # win, and vice versa). Otherwise None, the position is searched
+        me = self._player
+        mine, other = state.player_kalah(me), state.player_kalah(1 - me)
+        my_seeds, other_seeds = state.player_seeds(me), state.player_seeds(1 - me)
+        seeds = my_seeds + other_seeds
+        total = mine + other + seeds
+        if not (my_seeds if player == me else other_seeds):
+            # the game is finished
+            mine += my_seeds
+            other += other_seeds
+            seeds = 0
+        if 2 * mine > total:
+            self._decided += 1
+            return self._win_value
+        if 2 * other > total:
+            self._decided += 1
+            return -self._win_value
+        if not seeds:
+            self._decided += 1
+            return 0 # a draw
+        if alpha >= self._win_value - 1 and 2 * (mine + seeds) <= total:
+            self._bound_cutoffs += 1
+            return self._win_value - 1
+        if beta <= 1 - self._win_value and 2 * (other + seeds) <= total:
+            self._bound_cutoffs += 1
+            return 1 - self._win_value
+        return None
+
+    def _store(self, key, draft, value, alpha, beta, sign, move):
+        if self._tt is not None:
+            if value <= alpha:
+                bound = BoundUpper
+            elif value >= beta:
+                bound = BoundLower
+            else:
+                bound = BoundExact
+            if sign < 0:
+                bound = _flipped_bound[bound]
+            self._tt.store(key, draft, bound, sign * value, move)
+
+    def _cutoff(self, player, depth, new_state, index, draft):
+        holes = new_state if self._in_place_search else new_state.holes
+        self._ordering.cutoff(player, depth, holes, index, draft)
+
+    def _children(self, state, player, depth, best_move):
+        # yields (child state, neighbor record); in the in place search the
+        # child is the state itself and the record is a tuple of holes
+        if self._in_place_search:
+            moves = state.play_all_moves(player)
+            try:
+                for holes in moves:
+                    yield state, holes
+            finally:
+                moves.close()
+        else:
+            neighbors = self._neighbors(state, player)
+            for new_state in self._ordered(neighbors, player, depth, best_move):
+                yield new_state.state, new_state
+
+    def _ordered(self, neighbors, player, depth, best_move):
+        # the best move from the transposition table goes first, then the
+        # killers and the history (see ordering.MoveOrdering); the list can
+        # come from the neighbors cache, so it is not changed
+        if self._move_ordering:
+            neighbors = self._ordering.order(neighbors, player, depth)
+        if depth == 0 and self._root_shift:
+            neighbors = list(neighbors)
+            shift = self._root_shift % len(neighbors)
+            neighbors = neighbors[shift:] + neighbors[:shift]
+        if best_move:
+            neighbors = list(neighbors)
+            for index, new_state in enumerate(neighbors):
+                if new_state.state.key(new_state.player) == best_move:
+                    if index:
+                        neighbors = [new_state] + neighbors[:index] + neighbors[index+1:]
+                    break
+        return neighbors
+
     def make_move(self, state):
-        self._start_time = time()
-        print("Input state:", state.to_string())
+        # A full collection of the cyclic garbage collector walks all the
+        # objects of the caches (more than 0.1s) and it can come at any
+        # node, past the deadline, so it is off during the search; the
+        # search makes no reference cycles
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._make_move(state)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def _make_move(self, state):
+        self._timeman.start(self._run_time_limit, self._move_time)
+        self._set_deadline(self._timeman.deadline)
+        self._log("Input state:", state.to_string())
 
-        # States
-        my_state = tuple(state.player_holes(self._player))
-        opp_state = tuple(state.player_holes(self._other_player()))
-        state_tup = (my_state, opp_state)
         # Try precomputed value
-        precomp = precomputed(state_tup)
+        precomp = precomputed.get(pack_holes(state, self._player))
         if precomp is not None:
-            print('Using precomputed move')
+            self._log('Using precomputed move')
             return precomp
 
         #  # Log data
@@ -1650,45 +2082,398 @@ class CleverBotMethod(Method):
         #      logfile.write('\n')
 
         # Minimax algorithm
-        best_state = None
-        for level in range(2, 100):
-            if self._test_timeout(): break
+        # A position from the table file (or from the previous moves) is
+        # not searched again up to the depth that is already known; if
+        # that depth is not less than the AI level, the known move is
+        # played at once
+        self._score = None
+        self._nodes = self._researches = 0
+        self._decided = self._bound_cutoffs = 0
+        self._ordering.new_search()
+        self._ordering.reset_stats()
+        self._helper_nodes = []
+        if self._board is not None:
+            self._board.reset_stats()
+        best_state, start_level = self._known_move(state)
+        self._best_move = best_state
+        if best_state is not None and start_level > self._ai_level:
+            self._timeman.stop(StopKnown)
+        for level in range(start_level, 100):
+            if best_state is not None and not self._timeman.next_iteration():
+                break
             self.set_level(level)
-            print('Depth {} in {:.1f}s '.format(level, time() - self._start_time), end='')
-            sys.stdout.flush()
+            self._log('Depth {} in {:.1f}s '.format(level, time() - self._start_time), end='')
+            if self._tt is not None:
+                self._tt.reset_stats()
             new_state = self._minimax(state)
-            if new_state is None: break
-            best_state = new_state
+            if self._tt is not None:
+                self._log('(tt: {:.0f}% hits) '.format(self._tt.hit_rate() * 100), end='')
+            if new_state is None:
+                # the root keeps a move of the unfinished depth only if it
+                # is better than the best move of the previous depth
+                self._timeman.stop(StopTimeout)
+                if self._best_move is not best_state:
+                    self._log('(partial depth {}) '.format(level), end='')
+                    best_state = self._best_move
+                break
+            best_state = self._best_move = new_state
+            self._timeman.iteration(level, self._nodes, self._score, best_state.holes)
+            # an extended budget moves the deadline of the next depths
+            self._deadline = self._timeman.deadline
+            if abs(self._score) >= self._win_value:
+                # the stores decide the game below the best move, a deeper
+                # search can not change its value
+                self._timeman.stop(StopDecided)
+                break
+        else:
+            self._timeman.stop(StopDepth)
+        if best_state is None:
+            # the deadline came before the first depth was searched
+            best_state = next(iter(self._neighbors(state, self._player)))
+
+        self._log('Result in: ' + str(time() - self._start_time) + 's',
+              '({} nodes, {} re-searches)'.format(self._nodes, self._researches))
+        self._log(self._timeman.report())
+        if self._cache is not None:
+            self._log(self._cache.stats())
+        self._log(self._ordering.stats())
+        if self._score_bounds:
+            self._log(self.bounds_stats())
+        if self._helper_nodes:
+            self._log('nodes per worker: main {}, helpers {}'.format(
+                self._nodes - sum(self._helper_nodes),
+                ', '.join(str(nodes) for nodes in self._helper_nodes)))
+        if self._board is not None:
+            self._log(self._board.stats())
+        self._log(self._utility(best_state.state), best_state.state.to_string())
+        return best_state.holes[0]
 
-        print('Result in: ' + str(time() - self._start_time) + 's')
-        print(self._utility(best_state['state']), best_state['state'].to_string())
-        return best_state['hole'][0]
+    def bounds_stats(self):
+        """Returns a short human readable report of the score bounds"""
+        rate = 100.0 * (self._decided + self._bound_cutoffs) / self._nodes if self._nodes else 0.0
+        return 'bounds: {} decided positions, {} window cutoffs ({:.1f}% of nodes)'.format(
+            self._decided, self._bound_cutoffs, rate)
+
+    def _known_move(self, state):
+        if self._tt is not None:
+            entry = self._tt.probe(state.key(self._player))
+            if entry is not None and entry[1] == BoundExact:
+                for new_state in self._neighbors(state, self._player):
+                    if new_state.state.key(self._other_player()) == entry[3]:
+                        self._log('Known move of depth {} '.format(entry[0] - 2), end='')
+                        self._score = entry[2]
+                        return new_state, max(2, entry[0] - 1)
+        return None, 2
 
     def _minimax(self, state):
-        neighbors = state.get_all_neighbors(self._player)
-        best_value, best_state = -float('inf'), None
-        for new_state in neighbors:
-            value = self._min_value(new_state['state'])
-            if value is None: return None # for timeouts
-            if best_value < value :
-                best_value, best_state = value, new_state
-        return  best_state
+        # Runs the search of the current depth with the root driver (see
+        # _search) and returns the best neighbor or None on timeout
+        guess = self._score
+        if self._search == 'mtdf' and guess is not None:
+            result = self._mtdf(state, guess)
+        elif self._search == 'pvs' and guess is not None:
+            result = self._aspiration(state, guess)
+        else:
+            result = self._root(state.copy(), -float('inf'), float('inf'))
+        if result is None: return None # for timeouts
+        self._score, best_state = result
+        return best_state
+
+    def _aspiration(self, state, guess):
+        # The score is expected to be near the previous one, so the search
+        # starts with a narrow window; when the score is out of the window
+        # the search is repeated with the window opened on that side
+        alpha, beta = guess - self._aspiration_window, guess + self._aspiration_window
+        while True:
+            result = self._root(state.copy(), alpha, beta)
+            if result is None: return None # for timeouts
+            value, best_state = result
+            if value <= alpha:
+                alpha = -float('inf')
+            elif value >= beta:
+                beta = float('inf')
+            else:
+                return result
+            self._researches += 1
+
+    def _mtdf(self, state, guess):
+        # MTD(f): a sequence of null window searches that move the bounds
+        # of the score to each other starting from the guess; the results
+        # of the previous searches come from the transposition table
+        lower, upper = -float('inf'), float('inf')
+        value, best_state = guess, None
+        while lower < upper:
+            beta = max(value, lower + 1)
+            result = self._root(state.copy(), beta - 1, beta)
+            if result is None: return None # for timeouts
+            value, new_state = result
+            if value < beta:
+                upper = value
+            else:
+                lower = value
+                best_state = new_state
+            if best_state is None:
+                best_state = new_state
+            self._researches += 1
+        self._researches -= 1
+        return value, best_state
+
+    def _root(self, state, alpha, beta):
+        if self._workers > 1 and self._smp == 'lazy':
+            return self._lazy_root(state, alpha, beta)
+        return self._search_root(state, alpha, beta)
+
+    def _lazy_root(self, state, alpha, beta):
+        # Lazy SMP: the helpers search the same position with the same
+        # window, but at different depths and from different root moves.
+        # Their results only get to the shared transposition table, where
+        # the main search finds them; when the main search is finished
+        # the helpers are stopped
+        pool = self._worker_pool()
+        data = pack(state, 0)
+        helpers = [pool.apply_async(_search_lazy, ((index, data, self._max_depth,
+                                                    alpha, beta, self._deadline),))
+                   for index in range(1, self._workers)]
+        try:
+            return self._search_root(state, alpha, beta)
+        finally:
+            self._helpers_stop.value = 1
+            while len(self._helper_nodes) < len(helpers):
+                self._helper_nodes.append(0)
+            for helper in helpers:
+                index, nodes = helper.get()
+                self._helper_nodes[index - 1] += nodes
+                self._nodes += nodes
+            self._helpers_stop.value = 0
+
+    def _search_root(self, state, alpha, beta):
+        # Alpha-beta search of the root: returns (value, best neighbor) or
+        # None on timeout. The value is only a bound if it is out of the
+        # window (alpha, beta)
+        key = state.key(self._player)
+        best_move = 0
+        if self._tt is not None:
+            entry = self._tt.probe(key)
+            if entry is not None:
+                best_move = entry[3]
+        if self._workers > 1 and self._smp == 'root':
+            result = self._parallel_root(state, alpha, beta, best_move)
+            if result is not None:
+                value, best_state = result
+                self._store(key, self._max_depth, value, alpha, beta, 1,
+                            best_state.state.key(self._other_player()))
+            return result
+        if self._workers > 1 and self._smp == 'ybwc':
+            self._job_board()
+        orig_alpha = alpha
+        best_value, best_state, move = -float('inf'), None, 0
+        pv_first = False
+        children = self._children(state, self._player, 0, best_move)
+        try:
+            moves = enumerate(children)
+            for index, (child, new_state) in moves:
+                if self._search == 'pvs' and best_state is not None:
+                    value = self._min_value(child, 1, alpha, alpha + 1)
+                    if value is not None and alpha < value < beta:
+                        value = self._min_value(child, 1, alpha, beta)
+                else:
+                    value = self._min_value(child, 1, alpha, beta)
+                if value is None: return None # for timeouts
+                if best_value < value :
+                    if self._in_place_search:
+                        new_state = KalahMove(state.copy(), state.last_move_result,
+                                              new_state, self._other_player())
+                    improved = value > alpha
+                    best_value, best_state = value, new_state
+                    move = child.key(self._other_player())
+                    alpha = max(alpha, value)
+                    if not index:
+                        pv_first = move == best_move
+                    elif pv_first and improved:
+                        # the move beats the best move of the previous depth
+                        # (it is searched first), so it is the anytime result
+                        # even if this depth is not finished
+                        self._best_move = best_state
+                    if alpha >= beta: break
+                if self._board is not None:
+                    result = self._split(moves, self._player, 0, self._max_depth,
+                                         alpha, beta, best_value, move)
+                    if result is None: return None # for timeouts
+                    best_value, move, new_state, child = result
+                    if new_state is not None:
+                        if self._in_place_search:
+                            new_state = KalahMove(child, child.last_move_result,
+                                                  new_state, self._other_player())
+                        best_state = new_state
+                    break
+        finally:
+            children.close()
+        self._store(key, self._max_depth, best_value, orig_alpha, beta, 1, move)
+        return best_value, best_state
+
+    def _parallel_root(self, state, alpha, beta, best_move):
+        # The first root move is expected to be the best, so it is searched
+        # alone to get a good alpha; then the rest of the root moves are
+        # searched by the worker processes at once, in the order of the
+        # serial search. The workers share the best value found so far, so
+        # the later moves are searched with a better alpha. A move that is
+        # not better than its alpha returns only an upper bound, so an
+        # exact value wins a tie
+        neighbors = self._ordered(self._neighbors(state, self._player),
+                                  self._player, 0, best_move)
+        pool = self._worker_pool()
+        self._bound.value = alpha
+        tasks = [(index, pack(new_state.state, 0), self._max_depth, beta,
+                  self._deadline) for index, new_state in enumerate(neighbors)]
+        best, timeout = None, False
+        results = [pool.apply(_search_root_move, (tasks[0],))]
+        results = chain(results, pool.imap_unordered(_search_root_move, tasks[1:]))
+        for index, value, move_alpha, nodes in results:
+            self._nodes += nodes
+            if value is None:
+                timeout = True
+                continue
+            rank = (value, value > move_alpha, -index)
+            if best is None or rank > best:
+                best = rank
+        if timeout or best is None: return None # for timeouts
+        return best[0], neighbors[-best[2]]
+
+    def _split(self, moves, player, depth, draft, alpha, beta, value, move):
+        # Young brothers wait: the first child of the node is searched, so
+        # the rest of the children (moves) are published on the job board
+        # for the other workers. This process searches the jobs that are
+        # not stolen yet, then it waits for the stolen ones; each result
+        # narrows the window of the free jobs, and a cutoff cancels them.
+        # Returns (value, move, neighbor record, child) of the best child
+        # (the record and the child are None if the first child is the
+        # best) or None on timeout or when the job of this node is cancelled
+        board = self._board
+        sign = 1 if player == self._player else -1
+        next_player = (player + 1) % 2
+        search = self._max_value if next_player == self._player else self._min_value
+        jobs = []
+        for index, (child, new_state) in moves:
+            if self._in_place_search:
+                child = child.copy()
+            slot = board.publish(self._job, pack(child, 0), next_player, depth + 1,
+                                 self._max_depth, alpha, beta, self._deadline)
+            jobs.append((slot, index, child, new_state))
+        best_state = best_child = None
+        parent, stopped = self._job, False
+        try:
+            while jobs:
+                if board.cancelled(parent):
+                    stopped = True
+                    break
+                for job in jobs:
+                    slot = job[0]
+                    if slot < 0 or board.take(slot):
+                        # the board was full or the job is not stolen
+                        self._job = slot if slot >= 0 else parent
+                        try:
+                            rec_val = search(job[2], depth + 1, alpha, beta)
+                        finally:
+                            self._job = parent
+                            if slot >= 0:
+                                board.release(slot)
+                        break
+                    if board.status(slot) == JobDone:
+                        rec_val, nodes = board.collect(slot)
+                        self._nodes += nodes
+                        if rec_val is not None:
+                            # the board keeps the values as doubles
+                            rec_val = int(rec_val)
+                        break
+                else:
+                    # all the jobs are searched by the other workers
+                    if self._jobs_abandoned():
+                        stopped = True
+                        break
+                    if parent >= 0: board.block(parent)
+                    sleep(0.0005)
+                    if parent >= 0: board.block(parent, False)
+                    continue
+                jobs.remove(job)
+                if rec_val is None:
+                    stopped = True
+                    break
+                if sign * rec_val > sign * value:
+                    slot, index, child, new_state = job
+                    value, move = rec_val, child.key(next_player)
+                    best_state, best_child = new_state, child
+                    if sign > 0: alpha = max(alpha, value)
+                    else: beta = min(beta, value)
+                    if alpha >= beta:
+                        self._cutoff(player, depth, new_state, index, draft)
+                        break
+                    for job in jobs:
+                        if job[0] >= 0:
+                            board.set_window(job[0], alpha, beta)
+        finally:
+            self._cancel_jobs(jobs)
+        if stopped: return None # for timeouts
+        return value, move, best_state, best_child
+
+    def _cancel_jobs(self, jobs):
+        # cancels the jobs that are not searched yet and waits for the
+        # stolen ones, so their slots are freed; the slots of the jobs that
+        # are given up (see _jobs_abandoned) are freed by the next search
+        board = self._board
+        slots = [job[0] for job in jobs if job[0] >= 0 and not board.cancel(job[0])]
+        while slots and not self._jobs_abandoned():
+            for slot in list(slots):
+                if board.status(slot) == JobDone:
+                    self._nodes += board.collect(slot)[1]
+                    slots.remove(slot)
+            if slots:
+                sleep(0.0005)
+
+    def _jobs_abandoned(self):
+        # Checks if the stolen jobs are not waited for any more: the
+        # deadline has passed by _job_grace (a worker that holds a job
+        # stops at the same deadline, so it is stuck or dead), the board is
+        # given up, or a worker of this process has died with its jobs. In
+        # the last case the board is given up, so the other workers stop
+        # waiting too and the next search makes new workers
+        if self._board.is_quit() or time() > self._deadline + self._job_grace:
+            return True
+        for process in self._stealers:
+            if not process.is_alive():
+                print('A worker of the parallel search has died')
+                self._board.quit()
+                return True
+        return False
+
+    def _set_deadline(self, deadline):
+        # starts the clock of a search that stops at the deadline (a
+        # negative time limit of start_timer means the default one)
+        self.start_timer(max(0.0, deadline - time()))
 
     def _test_timeout(self):
-        allowed_time = 5
-        allowed_without_risk = allowed_time * 0.9
-        if time() - self._start_time > allowed_without_risk:
-            print('No more time...')
+        # it is called at every node, so the shared flags and the clock are
+        # looked at only once in a number of nodes (the number is calibrated
+        # by Method.is_deadline_reached)
+        if self._clock_countdown > 1:
+            self._clock_countdown -= 1
+            return False
+        if self._stop is not None and self._stop.value:
+            return True # the main search of Lazy SMP is finished
+        if self._board is not None and self._board.cancelled(self._job):
+            return True # the job of the ybwc search is not needed
+        timed_out = self._timed_out
+        if self.is_deadline_reached():
+            if not timed_out:
+                self._log('No more time...')
             return True
         return False
 
 if __name__ == "__main__":
     from state import KalahState
     state = KalahState(6)
-    state._kalahs = [0, 0]
     all_holes = map(int, sys.argv[1:])
     assert(len(all_holes) == 12)
-    state._holes = [all_holes[6:], all_holes[:6]]
+    state.set_board([all_holes[6:], all_holes[:6]], [0, 0])
     method = CleverBotMethod(1, 3)
     print(method.make_move(state))
 
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""Vectorized Kalah boards: many games are moved at once with NumPy.
+
+KalahBatch keeps N boards in one (N, 2*holes_num+2) integer array with the
+same layout of cells as KalahState: player 0's holes, his/her kalah,
+player 1's holes and his/her kalah. Every call of move makes one move in
+each row (the hole is chosen per row) with the sowing, capture, extra move
+and game end rules, so it replaces N calls of KalahState.move. It is meant
+for rollouts, generation of data sets and evaluation of many positions.
+
+Sowing is made with the same tables as in KalahState (see
+state._sowing_tables): a row with n stones in the hole adds n // len(ring)
+to every cell of the ring and one more stone to the first n % len(ring)
+cells.
+
+NumPy is needed only by this module, so it is imported here and not in the
+rest of the package.
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import methods.state as st
+
+# Board tables for each amount of holes (see _batch_tables function)
+_batch_tables_cache = {}
+
+def _batch_tables(holes_num):
+    """Returns NumPy versions of the sowing tables for the board size
+
+    Returns:
+        (rings, opposite): rings[player, hole] is the ring of cells for
+        sowing from the hole (see state._sowing_tables); opposite[pit] is
+        the hole opposite to pit (for kalahs it is the kalah itself)
+    """
+    tables = _batch_tables_cache.get(holes_num)
+    if tables is None:
+        sowing = st._sowing_tables(holes_num)
+        rings = np.array([[ring for ring, prefixes in sowing[player]]
+                          for player in [0,1]], dtype=np.intp)
+        opposite = np.arange(2*holes_num+2, dtype=np.intp)
+        for pit in range(holes_num):
+            opposite[pit] = 2*holes_num - pit
+            opposite[2*holes_num - pit] = pit
+        tables = _batch_tables_cache[holes_num] = (rings, opposite)
+    return tables
+
+class KalahBatch(object):
+    """A batch of Kalah boards
+
+    Attributes:
+        boards: (N, 2*holes_num+2) integer array of boards
+        players: (N,) array with the number of player who moves in each row
+        finished: (N,) boolean array; True for the rows where the game is
+            finished, i.e. the player to move has no stones
+        _holes_num: amount of holes for each player
+        _rings, _opposite: board tables (see _batch_tables function)
+    """
+
+    def __init__(self, boards, players=0, holes_num=6):
+        """Inits a batch of boards
+
+        Args:
+            boards: anything that can be converted to an (N, 2*holes_num+2)
+                integer array (e.g. a list of KalahState.cells())
+            players: number of player who moves in each row; one number for
+                all rows or a sequence with a number for each row
+            holes_num: amount of holes for each player
+        """
+        if np is None:
+            raise ImportError("NumPy is needed for the batch boards")
+        self._holes_num = holes_num
+        self._rings, self._opposite = _batch_tables(holes_num)
+        self.boards = np.array(boards, dtype=np.int32).reshape(-1, 2*holes_num+2)
+        self.players = np.empty(len(self.boards), dtype=np.int8)
+        self.players[:] = players
+        self.finished = self._side_seeds()==0
+
+    @classmethod
+    def from_states(cls, states, players=0):
+        """Makes a batch from a list of KalahState objects"""
+        holes_num = states[0].holes_num()
+        return cls([state.cells() for state in states], players, holes_num)
+
+    @classmethod
+    def repeat(cls, state, count, player=0):
+        """Makes a batch of count copies of one KalahState"""
+        return cls([state.cells()]*count, player, state.holes_num())
+
+    def __len__(self):
+        """Returns amount of boards in the batch"""
+        return len(self.boards)
+
+    def holes_num(self):
+        """Returns amount of holes for each player"""
+        return self._holes_num
+
+    def to_state(self, index):
+        """Returns a KalahState with the board of the row"""
+        state = st.KalahState(0, self._holes_num)
+        state.set_cells(self.boards[index].tolist())
+        return state
+
+    def _side_seeds(self, rows=None):
+        """Returns amounts of stones in the holes of the players to move
+
+        Args:
+            rows: indexes of rows; all rows if None
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        own = self.players[rows].astype(np.intp)*(self._holes_num+1)
+        cells = own[:, None] + np.arange(self._holes_num)[None, :]
+        return self.boards[rows[:, None], cells].sum(axis=1)
+
+    def player_holes(self):
+        """Returns an (N, holes_num) array of holes of the players to move"""
+        holes_num = self._holes_num
+        index = (self.players[:, None]*(holes_num+1) +
+                 np.arange(holes_num)[None, :])
+        return self.boards[np.arange(len(self))[:, None], index]
+
+    def legal_moves(self):
+        """Returns an (N, holes_num) boolean mask of the possible moves"""
+        return (self.player_holes()>0) & ~self.finished[:, None]
+
+    def random_moves(self, random_state=None):
+        """Chooses a random possible move for each row
+
+        Args:
+            random_state: numpy.random.RandomState to use; the global NumPy
+                generator is used if None
+
+        Returns:
+            (N,) array of holes; -1 for the finished rows
+        """
+        if random_state is None:
+            random_state = np.random
+        legal = self.legal_moves()
+        counts = legal.sum(axis=1)
+        choice = (random_state.random_sample(len(self))*counts).astype(np.intp)
+        holes = (np.cumsum(legal, axis=1) <= choice[:, None]).sum(axis=1)
+        holes[counts==0] = -1
+        return holes
+
+    def scores(self):
+        """Returns an (N, 2) array of kalahs of both players"""
+        holes_num = self._holes_num
+        return self.boards[:, [holes_num, 2*holes_num+1]]
+
+    def move(self, holes, sweep=True):
+        """Makes a move in each row
+
+        Rows where the move is wrong (the hole is out of range or empty, or
+        the game is already finished) are not changed. After the move the
+        player to move is updated: it stays the same after a move that ends
+        in the player's kalah.
+
+        Args:
+            holes: (N,) array of holes for the players to move
+            sweep: if True then all onboard stones of the rows where the
+                game is finished after the move are moved to the kalahs
+                (see end_games)
+
+        Returns:
+            (N,) array of results; the same values as KalahState.move
+            returns (see the constants in state.py)
+        """
+        holes_num = self._holes_num
+        boards = self.boards
+        players = self.players.astype(np.intp)
+        holes = np.asarray(holes, dtype=np.intp)
+        results = np.empty(len(self), dtype=np.int8)
+        results[:] = st.WrongMove
+
+        valid = (holes>=0) & (holes<holes_num) & ~self.finished
+        rows = np.flatnonzero(valid)
+        own = players[rows]*(holes_num+1)
+        source = own + holes[rows]
+        stones = boards[rows, source]
+        moved = stones>0
+        rows, own, source, stones = rows[moved], own[moved], source[moved], stones[moved]
+        if not len(rows):
+            return results
+        player = players[rows]
+        kalah = own + holes_num
+
+        #
+        # Sowing: each cell of the ring gets laps stones and the first rest
+        # cells of the ring get one stone more
+        #
+        rings = self._rings[player, holes[rows]]
+        laps, rest = np.divmod(stones, rings.shape[1])
+        boards[rows, source] = 0
+        boards[rows[:, None], rings] += laps[:, None] + \
+            (np.arange(rings.shape[1])[None, :] < rest[:, None])
+        last = rings[np.arange(len(rows)), (stones-1) % rings.shape[1]]
+
+        #
+        # Capture when the last stone is put to the player's empty hole
+        #
+        opposite = self._opposite[last]
+        capture = ((last>=own) & (last<kalah) & (boards[rows, last]==1) &
+                   (boards[rows, opposite]>0))
+        if capture.any():
+            crows, clast, copp = rows[capture], last[capture], opposite[capture]
+            boards[crows, kalah[capture]] += boards[crows, copp] + 1
+            boards[crows, clast] = 0
+            boards[crows, copp] = 0
+
+        #
+        # A move that ends in the player's kalah gives an extra move if the
+        # player has stones
+        #
+        own_seeds = boards[rows[:, None], own[:, None] + np.arange(holes_num)].sum(axis=1)
+        extra = (last==kalah) & (own_seeds>0)
+        results[rows] = np.where(extra, st.MoveEndsInPlayersKalah, st.MoveEnds)
+        self.players[rows] = np.where(extra, player, 1 - player)
+
+        ended = rows[self._side_seeds(rows)==0]
+        if len(ended):
+            self.finished[ended] = True
+            if sweep:
+                self.end_games(ended)
+        return results
+
+    def end_games(self, rows=None):
+        """Moves all onboard stones of the rows to the kalahs (like
+        KalahState.end_game does)
+
+        Args:
+            rows: indexes of rows; all finished rows if None
+        """
+        if rows is None:
+            rows = np.flatnonzero(self.finished)
+        holes_num = self._holes_num
+        boards = self.boards
+        for player in [0,1]:
+            own = player*(holes_num+1)
+            boards[rows, own+holes_num] += boards[rows, own:own+holes_num].sum(axis=1)
+            boards[rows, own:own+holes_num] = 0
+
+    def play_random(self, random_state=None, max_moves=1000):
+        """Plays random moves in all rows until all games are finished
+
+        Returns:
+            (N,) array of kalahs differences (player 0 minus player 1)
+        """
+        for i in xrange(max_moves):
+            if self.finished.all():
+                break
+            self.move(self.random_moves(random_state))
+        scores = self.scores()
+        return scores[:, 0] - scores[:, 1]
+
+#
+# Cross-check of the batch boards with KalahState on random games
+#
+if __name__ == "__main__":
+    from time import time
+
+    generator = np.random.RandomState(2015)
+    for stones, holes_num in [(1, 6), (3, 6), (4, 6), (6, 6), (12, 6), (4, 3)]:
+        count = 500
+        states = [st.KalahState(stones, holes_num) for i in range(count)]
+        batch = KalahBatch.repeat(states[0], count)
+        players = [0]*count
+        finished = [False]*count
+        while not batch.finished.all():
+            holes = batch.random_moves(generator)
+            #
+            # Spoil some moves to check that wrong moves are not made
+            #
+            spoil = generator.random_sample(count)<0.05
+            holes[spoil] = generator.randint(-1, holes_num+1, spoil.sum())
+            results = batch.move(holes)
+            for index, state in enumerate(states):
+                if finished[index]:
+                    assert results[index]==st.WrongMove
+                    continue
+                player = players[index]
+                result = state.move(player, int(holes[index]))
+                assert result==results[index], (result, results[index])
+                if result!=st.WrongMove and result!=st.MoveEndsInPlayersKalah:
+                    players[index] = player = (player+1) % 2
+                if state.is_finished(player):
+                    state.end_game()
+                    finished[index] = True
+                assert batch.players[index]==players[index]
+                assert batch.finished[index]==finished[index]
+                assert batch.boards[index].tolist()==state.cells()
+
+    count = 10000
+    batch = KalahBatch.repeat(st.KalahState(6), count)
+    start = time()
+    moves = 0
+    while not batch.finished.all():
+        moves += (~batch.finished).sum()
+        batch.move(batch.random_moves(generator))
+    elapsed = time() - start
+    print "%d random games, %d moves in %.2fs: %.0f moves/sec" % \
+        (count, moves, elapsed, moves/elapsed)
+    print "Batch boards: OK"
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""Memory bounded cache of the generated neighbors.
+
+The searching methods with iterative deepening walk the upper part of the
+searching tree again and again: each next depth expands the same positions
+as the previous one plus one more level. NeighborCache keeps the results of
+KalahState.get_all_neighbors for the recently expanded positions, so the
+repeated levels mostly take the neighbors from the cache.
+
+Positions are looked up by their Zobrist key together with the side to move
+(see KalahState.key). The least recently used positions are dropped when
+the cache grows over its size limit, which is given in megabytes.
+
+The cached neighbors are shared between all the lookups, so their states
+must not be changed by a caller.
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+from collections import OrderedDict
+
+#
+# Approximate memory cost of one cache entry without its neighbors (a slot
+# of the ordered dictionary, the key and the list) and of one neighbor (the
+# move record with its state) for each board size
+#
+_EntrySize = 200
+_neighbor_sizes = {}
+
+def _neighbor_size(neighbor):
+    """Returns approximate amount of bytes used by a neighbor record"""
+    state = neighbor.state
+    holes_num = state.holes_num()
+    if holes_num not in _neighbor_sizes:
+        _neighbor_sizes[holes_num] = sys.getsizeof(neighbor) + \
+            sys.getsizeof(state) + sys.getsizeof(state._board) + \
+            sys.getsizeof(state._seeds) + sys.getsizeof(neighbor.holes) + \
+            sys.getsizeof(state._hash)
+    return _neighbor_sizes[holes_num]
+
+class NeighborCache(object):
+    """LRU cache of the neighbors of positions
+
+    Attributes:
+        hits: amount of lookups answered from the cache
+        misses: amount of lookups that needed to generate the neighbors
+        evictions: amount of positions dropped to fit the size limit
+        _size_limit: maximum size of the cache in bytes
+        _size: current approximate size of the cache in bytes
+        _entries: ordered dictionary from a position key to a pair of the
+            neighbors list and its size; the oldest used entry goes first
+    """
+
+    def __init__(self, size_mb=64):
+        """Inits an empty cache
+
+        Args:
+            size_mb: maximum size of the cache in megabytes
+        """
+        self._size_limit = int(size_mb * 1024 * 1024)
+        self.clear()
+
+    def clear(self):
+        """Drops all the cached positions and resets the counters"""
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        """Returns amount of cached positions"""
+        return len(self._entries)
+
+    def size(self):
+        """Returns approximate size of the cache in bytes"""
+        return self._size
+
+    def size_limit(self):
+        """Returns maximum size of the cache in bytes"""
+        return self._size_limit
+
+    def get_all_neighbors(self, state, player):
+        """The same as state.get_all_neighbors(player), but cached
+
+        Args:
+            state: position to expand
+            player: number of player who moves in the position (0 or 1)
+
+        Returns:
+            List of the neighbors (KalahMove records); it must not be
+            changed
+        """
+        key = state.key(player)
+        entries = self._entries
+        entry = entries.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            entries[key] = entry
+            return entry[0]
+
+        self.misses += 1
+        neighbors = state.get_all_neighbors(player)
+        size = _EntrySize
+        if neighbors:
+            size += len(neighbors) * _neighbor_size(neighbors[0])
+        if size > self._size_limit:
+            return neighbors
+        entries[key] = (neighbors, size)
+        self._size += size
+        while self._size > self._size_limit:
+            self._size -= entries.popitem(last=False)[1][1]
+            self.evictions += 1
+        return neighbors
+
+    def hit_rate(self):
+        """Returns a part of lookups answered from the cache (from 0 to 1)"""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        """Returns a short human readable report of the cache usage"""
+        return "cache: %d hits, %d misses (%.0f%%), %d positions, %.1f MB" % \
+            (self.hits, self.misses, self.hit_rate() * 100, len(self),
+             self._size / 1024.0 / 1024.0)
+
+#
+# Checks that cached neighbors are the same as generated ones and that the
+# size limit works
+#
+if __name__ == "__main__":
+    from state import KalahState
+
+    def walk(cache, state, player, depth):
+        if depth==0 or state.is_finished(player):
+            return
+        neighbors = cache.get_all_neighbors(state, player)
+        expected = state.get_all_neighbors(player)
+        assert [(x.holes, x.state.cells()) for x in neighbors] == \
+            [(x.holes, x.state.cells()) for x in expected]
+        for neighbor in neighbors:
+            walk(cache, neighbor.state, (player+1) % 2, depth-1)
+
+    state = KalahState(4)
+    state.move(0, 2)
+    cache = NeighborCache()
+    for depth in range(1, 5):
+        walk(cache, state, 1, depth)
+    print cache.stats()
+    assert cache.hits and cache.misses and not cache.evictions
+
+    small = NeighborCache(0.05)
+    for depth in range(1, 5):
+        walk(small, state, 1, depth)
+    print small.stats()
+    assert small.evictions and small.size() <= small.size_limit()
+    assert small.hit_rate() < cache.hit_rate()
+    print "Neighbor cache: OK"
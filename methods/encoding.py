@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""Canonical encoding of the Kalah positions.
+
+A position is always encoded as it is seen by the player who moves: his/her
+holes and kalah go first, then opponent's holes and kalah (see 
+KalahState.cells). So the same position has the same code for both players
+and the code does not need a separate side to move.
+
+There are two kinds of codes:
+    pack/unpack: a fixed-width byte string with one byte per board cell. 
+        It is a compact key for dictionaries, files and pipes between 
+        processes.
+    rank/unrank: a perfect ranking of all positions with the same total 
+        amount of stones, i.e. a number from 0 to positions_count()-1. It 
+        is an index for the lookup tables and databases.
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from methods.state import KalahState
+
+def pack(state, player):
+    """Returns a byte string with the position as seen by the player
+    
+    Args:
+        state: a KalahState
+        player: number of player who moves in the position (0 or 1)
+    """
+    cells = state.cells(player)
+    if max(cells)>255:
+        raise ValueError("Too many stones in a cell to pack the position")
+    return bytes(bytearray(cells))
+    
+def pack_holes(state, player):
+    """The same as pack, but only holes (without kalahs) are encoded"""
+    holes = state.player_holes(player) + state.player_holes((player+1) % 2)
+    if max(holes)>255:
+        raise ValueError("Too many stones in a hole to pack the position")
+    return bytes(bytearray(holes))
+    
+def unpack(data, player=0):
+    """Returns a KalahState from the byte string made by pack
+    
+    Args:
+        data: a result of pack
+        player: number of player who moves in the returned state
+    """
+    state = KalahState(0, len(data)//2 - 1)
+    state.set_cells(list(bytearray(data)), player)
+    return state
+    
+_binomials = {}
+
+def _binomial(n, k):
+    """Returns a binomial coefficient C(n, k)"""
+    if k<0 or k>n:
+        return 0
+    value = _binomials.get((n, k))
+    if value is None:
+        value = 1
+        for i in range(min(k, n-k)):
+            value = value * (n-i) // (i+1)
+        _binomials[n, k] = value
+    return value
+    
+def _compositions(stones, cells):
+    """Returns a number of ways to put stones into cells"""
+    if stones<0:
+        return 0
+    return _binomial(stones+cells-1, cells-1)
+    
+def positions_count(stones, holes_num=6):
+    """Returns a number of positions with the total amount of stones"""
+    return _compositions(stones, 2*holes_num+2)
+    
+def rank(state, player):
+    """Returns an index of the position among all positions with the same 
+    total amount of stones (from 0 to positions_count()-1)
+    
+    Positions are ordered by the first cell, then by the second one and so
+    on (cells are taken as seen by the player, see pack).
+    
+    Args:
+        state: a KalahState
+        player: number of player who moves in the position (0 or 1)
+    """
+    cells = state.cells(player)
+    stones = sum(cells)
+    index = 0
+    for i in range(len(cells)-1):
+        # positions that have less stones in the cell i are before this one
+        rest = len(cells) - i
+        index += _compositions(stones, rest) - _compositions(stones-cells[i], rest)
+        stones -= cells[i]
+    return index
+    
+def unrank(index, stones, holes_num=6, player=0):
+    """Returns a KalahState by its index made by rank
+    
+    Args:
+        index: a result of rank
+        stones: total amount of stones of the position
+        holes_num: number of holes
+        player: number of player who moves in the returned state
+    """
+    size = 2*holes_num + 2
+    if index<0 or index>=positions_count(stones, holes_num):
+        raise ValueError("Wrong position index")
+    cells = []
+    for i in range(size-1):
+        count = 0
+        while True:
+            skipped = _compositions(stones-count, size-i-1)
+            if index<skipped:
+                break
+            index -= skipped
+            count += 1
+        cells.append(count)
+        stones -= count
+    cells.append(stones)
+    state = KalahState(0, holes_num)
+    state.set_cells(cells, player)
+    return state
+    
+#
+# Round trip tests of the encodings. Execute this module to run them
+#
+if __name__ == "__main__":
+    from methods.state import MoveEndsInPlayersKalah
+    
+    # All positions of a small board are ranked one-to-one
+    for stones in range(6):
+        indexes = set()
+        count = positions_count(stones, 2)
+        for index in range(count):
+            state = unrank(index, stones, 2)
+            assert rank(state, 0)==index
+            indexes.add(pack(state, 0))
+        assert len(indexes)==count
+        
+    # Positions of random games
+    seed, positions = 1, 0
+    for game in range(500):
+        state = KalahState(game % 6 + 1)
+        stones = 12*(game % 6 + 1)
+        player = 0
+        while not state.is_finished(player):
+            data = pack(state, player)
+            assert len(data)==14
+            for new_player in [0, 1]:
+                new_state = unpack(data, new_player)
+                assert pack(new_state, new_player)==data
+                index = rank(new_state, new_player)
+                assert index==rank(state, player)<positions_count(stones)
+                assert unrank(index, stones, 6, new_player).cells(new_player)==state.cells(player)
+            assert unpack(data, player).key(player)==state.key(player)
+            holes = [x for x in range(6) if state.player_holes(player)[x]]
+            seed = (seed*1103515245 + 12345) % (1<<31)
+            state.move(player, holes[seed % len(holes)])
+            if state.last_move_result!=MoveEndsInPlayersKalah:
+                player = (player+1) % 2
+            positions += 1
+    print "Encoding: OK, %d positions" % positions
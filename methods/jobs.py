@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""Job board of the parallel search with the young brothers wait concept.
+
+A searching process that reaches a node deep enough searches the first
+child of the node by itself (the young brothers wait for their eldest
+brother, so the window of the search is known). Then the younger siblings
+are published on the board as jobs; idle processes steal them, and the
+owner of the node searches the ones that are left. The design follows the
+job stealing of the Kalah solver (generator/parallel.c), but the jobs are
+kept in shared memory instead of messages between hosts.
+
+Every job is in one of the states:
+    JobEmpty: the slot is not used
+    JobFree: the job is published and waits for a process
+    JobTaken: a process searches the job
+    JobBlocked: the process of the job waits for the stolen jobs of its
+        own nodes
+    JobDone: the result is ready for the owner
+    JobCancelled: the owner does not need the result (e.g. a sibling
+        caused a cutoff); the process of the job stops as soon as it sees
+        that the job or any of its parent jobs is cancelled, and the job
+        is done without a result
+Only the owner of a job frees its slot (after the job is done), so a slot
+is never reused while the owner waits for it.
+A job knows its parent job (the job that the owner was searching when it
+published the job, -1 for the root search), so cancelling of one job
+stops all the jobs below it.
+
+The board is made before the workers are forked and it is shared by them
+(multiprocessing shared arrays); state changes are made under one lock.
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from multiprocessing import Lock, RawArray, RawValue
+
+JobEmpty = 0
+JobFree = 1
+JobTaken = 2
+JobBlocked = 3
+JobDone = 4
+JobCancelled = 5
+
+# Maximum size of a packed position of a job (see encoding.pack)
+MaxPositionSize = 32
+
+class JobBoard(object):
+    """Fixed amount of job slots in shared memory
+
+    Attributes:
+        _lock: lock of the state changes
+        _status, _parent: state and parent job of each slot
+        _positions, _sizes: packed positions of the jobs and their sizes
+        _players, _depths, _max_depths: player who moves in the position,
+            depth of the position in the searching tree and the depth limit
+        _alphas, _betas, _deadlines: window and deadline of the search
+        _values, _nodes: results of the finished jobs (NaN value if the
+            search was stopped by the timeout)
+        _counters: published, stolen and cancelled jobs
+        _quit: it is set to stop the workers
+    """
+
+    def __init__(self, size=256):
+        """Inits an empty board
+
+        Args:
+            size: maximum amount of jobs at once
+        """
+        self._lock = Lock()
+        self._status = RawArray('b', size)
+        self._parent = RawArray('i', size)
+        self._positions = RawArray('c', size * MaxPositionSize)
+        self._sizes = RawArray('b', size)
+        self._players = RawArray('b', size)
+        self._depths = RawArray('i', size)
+        self._max_depths = RawArray('i', size)
+        self._alphas = RawArray('d', size)
+        self._betas = RawArray('d', size)
+        self._deadlines = RawArray('d', size)
+        self._values = RawArray('d', size)
+        self._nodes = RawArray('l', size)
+        self._counters = RawArray('l', 3)
+        self._quit = RawValue('b', 0)
+
+    def __len__(self):
+        """Returns amount of slots"""
+        return len(self._status)
+
+    def publish(self, parent, position, player, depth, max_depth, alpha, beta,
+                deadline):
+        """Publishes a job
+
+        Args:
+            parent: job that the owner searches now (-1 for the root search)
+            position: the position packed by encoding.pack for player 0
+            player: number of player who moves in the position
+            depth: depth of the position in the searching tree
+            max_depth: depth limit of the search
+            alpha, beta: window of the search
+            deadline: time when the search is stopped by the timeout
+
+        Returns:
+            The slot of the job or -1 if the board is full
+        """
+        with self._lock:
+            status = self._status
+            for slot in xrange(len(status)):
+                if status[slot]==JobEmpty:
+                    break
+            else:
+                return -1
+            offset = slot * MaxPositionSize
+            self._positions[offset:offset + len(position)] = position
+            self._sizes[slot] = len(position)
+            self._parent[slot] = parent
+            self._players[slot] = player
+            self._depths[slot] = depth
+            self._max_depths[slot] = max_depth
+            self._alphas[slot] = alpha
+            self._betas[slot] = beta
+            self._deadlines[slot] = deadline
+            self._nodes[slot] = 0
+            status[slot] = JobFree
+            self._counters[0] += 1
+            return slot
+
+    def job(self, slot):
+        """Returns the job of the slot as a tuple (position, player, depth,
+        max depth, alpha, beta, deadline)"""
+        offset = slot * MaxPositionSize
+        return (self._positions[offset:offset + self._sizes[slot]],
+                self._players[slot], self._depths[slot], self._max_depths[slot],
+                self._alphas[slot], self._betas[slot], self._deadlines[slot])
+
+    def status(self, slot):
+        """Returns the state of the slot"""
+        return self._status[slot]
+
+    def take(self, slot):
+        """Takes the free job of the slot; returns False if it is not free"""
+        with self._lock:
+            if self._status[slot]!=JobFree:
+                return False
+            self._status[slot] = JobTaken
+            return True
+
+    def steal(self):
+        """Takes the free job that is the nearest to the root (it has the
+        biggest subtree)
+
+        Returns:
+            The slot of the job or None if there are no free jobs
+        """
+        with self._lock:
+            status, depths = self._status, self._depths
+            best = None
+            for slot in xrange(len(status)):
+                if status[slot]==JobFree and (best is None or depths[slot]<depths[best]):
+                    best = slot
+            if best is not None:
+                status[best] = JobTaken
+                self._counters[1] += 1
+            return best
+
+    def set_window(self, slot, alpha, beta):
+        """Narrows the window of the job if it is still free"""
+        with self._lock:
+            if self._status[slot]==JobFree:
+                self._alphas[slot] = alpha
+                self._betas[slot] = beta
+
+    def block(self, slot, blocked=True):
+        """Marks the taken job as blocked (or taken again if blocked is
+        False); a cancelled job stays cancelled"""
+        with self._lock:
+            if self._status[slot] in (JobTaken, JobBlocked):
+                self._status[slot] = JobBlocked if blocked else JobTaken
+
+    def finish(self, slot, value, nodes):
+        """Puts the result of the taken job
+
+        Args:
+            slot: slot of the job
+            value: value of the position or None if the search was stopped
+            nodes: amount of the searched nodes
+        """
+        with self._lock:
+            if self._status[slot]==JobCancelled:
+                value = None
+            self._values[slot] = float('nan') if value is None else value
+            self._nodes[slot] = nodes
+            self._status[slot] = JobDone
+
+    def collect(self, slot):
+        """Returns the result of the finished job as a tuple (value, nodes)
+        and frees the slot; the value is None if the search was stopped"""
+        value, nodes = self._values[slot], self._nodes[slot]
+        self._status[slot] = JobEmpty
+        return (None if value!=value else value), nodes
+
+    def release(self, slot):
+        """Frees the slot of the job that is taken by its owner"""
+        self._status[slot] = JobEmpty
+
+    def cancel(self, slot):
+        """Cancels the job
+
+        Returns:
+            True if the slot is already empty (the job was not taken yet),
+            False if the owner has to wait until the job is done and
+            collect it
+        """
+        with self._lock:
+            status = self._status[slot]
+            if status==JobFree:
+                self._status[slot] = JobEmpty
+            elif status in (JobTaken, JobBlocked):
+                self._status[slot] = JobCancelled
+                self._counters[2] += 1
+            return self._status[slot]==JobEmpty
+
+    def sweep(self):
+        """Frees the slots of the finished jobs that are not collected (their
+        owners have given them up); it is called between the searches"""
+        with self._lock:
+            status = self._status
+            for slot in xrange(len(status)):
+                if status[slot]==JobDone:
+                    status[slot] = JobEmpty
+
+    def cancelled(self, job):
+        """Checks if the job or any of its parent jobs is cancelled"""
+        status, parent = self._status, self._parent
+        while job>=0:
+            if status[job]==JobCancelled:
+                return True
+            job = parent[job]
+        return False
+
+    def quit(self):
+        """Tells the workers to stop"""
+        self._quit.value = 1
+
+    def is_quit(self):
+        """Checks if the workers have to stop"""
+        return self._quit.value!=0
+
+    def reset_stats(self):
+        """Resets the counters"""
+        self._counters[:] = [0, 0, 0]
+
+    def stats(self):
+        """Returns a short human readable report of the jobs"""
+        return "jobs: %d published, %d stolen, %d cancelled" % tuple(self._counters)
+
+#
+# Checks of the job states
+#
+if __name__ == "__main__":
+    board = JobBoard(3)
+    root = board.publish(-1, b'\x01\x02', 0, 1, 5, -1.0, 1.0, 0.0)
+    child = board.publish(root, b'\x03' * 14, 1, 2, 5, -2.0, 2.0, 0.0)
+    other = board.publish(-1, b'\x04', 0, 1, 5, 0.0, 0.0, 0.0)
+    assert board.publish(-1, b'', 0, 1, 5, 0.0, 0.0, 0.0) == -1
+    assert board.job(child) == (b'\x03' * 14, 1, 2, 5, -2.0, 2.0, 0.0)
+
+    # the nearest to the root job is stolen first
+    assert board.steal() == root and not board.take(root)
+    assert board.steal() == other
+    board.set_window(child, -1.0, 1.0)
+    assert board.job(child)[4:6] == (-1.0, 1.0)
+    assert board.take(child) and board.steal() is None
+    board.set_window(child, 0.0, 0.0)
+    assert board.job(child)[4:6] == (-1.0, 1.0)
+
+    # a cancelled parent job cancels its children
+    assert not board.cancelled(child)
+    board.block(root)
+    assert board.status(root) == JobBlocked
+    assert not board.cancel(root)
+    assert board.cancelled(child) and not board.cancelled(other)
+    board.block(root, False)
+    assert board.status(root) == JobCancelled
+    board.finish(root, 5, 100)
+    assert board.status(root) == JobDone
+    assert board.collect(root) == (None, 100)
+
+    # results
+    board.finish(child, None, 10)
+    assert board.collect(child) == (None, 10)
+    board.finish(other, -3, 7)
+    assert not board.cancel(other)
+    assert board.collect(other) == (-3, 7)
+    assert [board.status(slot) for slot in range(len(board))] == [JobEmpty] * 3
+
+    # a finished job that is given up by its owner is freed by the sweep,
+    # a taken one is not
+    done = board.publish(-1, b'\x05', 0, 1, 5, 0.0, 0.0, 0.0)
+    taken = board.publish(-1, b'\x06', 0, 1, 5, 0.0, 0.0, 0.0)
+    assert board.steal() == done and board.steal() == taken
+    board.finish(done, 1, 1)
+    board.sweep()
+    assert board.status(done) == JobEmpty and board.status(taken) == JobTaken
+    print board.stats()
+    print "Job board: OK"
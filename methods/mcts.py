@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""Monte Carlo tree search method for playing Kalah.
+
+The method does not need a utility function: a position is estimated by
+random games (playouts) played from it to the end. The tree of the searched
+positions grows one node per descent, and every node keeps the number of
+the descents through it and the score of the player who moved to it (1
+for a win, 0.5 for a draw). A playout goes down the tree by UCT (upper confidence bound
+for trees): a child is chosen by its average score plus a bonus that is
+big for the rarely visited children, so the good moves are searched more
+but no move is forgotten.
+
+The moves of the tree are whole extra moves chains (see
+KalahState.iter_all_neighbors), so every level of the tree changes the
+player. A position can have dozens of chains, so they are not all added at
+once (progressive widening): a node with n descents has at most
+_widening * n ** _widening_exponent children, and the chains are added in
+the order of a cheap guess (long chains and captures first).
+
+One random game with KalahState objects costs more in the Python overhead
+than in the moves themselves, so the playouts are made in batches: the
+leaves of _batch_size descents are collected (each descent adds a virtual
+loss to its path, so the next descents go elsewhere) and all their games
+are played at once on NumPy boards (see batch.KalahBatch). The time of a
+batch hardly depends on the number of boards, so every leaf gets
+_leaf_playouts games and the average of their scores.
+
+The nodes live in a pool of a fixed size (NodePool). When the pool is full
+the tree stops growing; after each move the part of the tree that can not
+be reached from the new position any more is given back to the pool, and
+the rest of the tree is kept for the next move.
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from math import log, sqrt
+from time import time
+
+from methods.method import Method
+from methods.batch import KalahBatch, np
+
+class NodePool(object):
+    """Fixed amount of tree nodes
+
+    A node is a number; its fields are kept in parallel lists. The freed
+    nodes are reused by the next allocations.
+
+    Attributes:
+        states: position of each node (KalahState)
+        players: number of player who moves in the position
+        holes: the extra moves chain that leads to the node from its parent
+        parents: parent node (-1 for the root)
+        children: list of the expanded children
+        untried: list of the neighbors (KalahMove records) that are not
+            expanded yet; None until the node is expanded first
+        visits: number of the descents through the node (with the virtual
+            losses of the unfinished ones)
+        scores: sum of the scores of the descents for the player who moved
+            to the node
+        _free: list of free nodes
+    """
+
+    def __init__(self, size):
+        """Inits an empty pool for size nodes"""
+        self.states = [None] * size
+        self.players = [0] * size
+        self.holes = [None] * size
+        self.parents = [-1] * size
+        self.children = [None] * size
+        self.untried = [None] * size
+        self.visits = [0] * size
+        self.scores = [0.0] * size
+        self._free = range(size - 1, -1, -1)
+
+    def __len__(self):
+        """Returns amount of nodes in use"""
+        return len(self.states) - len(self._free)
+
+    def new(self, state, player, holes=(), parent=-1):
+        """Allocates a node
+
+        Returns:
+            The node or -1 if the pool is full
+        """
+        if not self._free:
+            return -1
+        node = self._free.pop()
+        self.states[node] = state
+        self.players[node] = player
+        self.holes[node] = holes
+        self.parents[node] = parent
+        self.children[node] = []
+        self.untried[node] = None
+        self.visits[node] = 0
+        self.scores[node] = 0.0
+        return node
+
+    def release(self, node, keep=-1):
+        """Gives the subtree of the node back to the pool
+
+        Args:
+            node: root of the subtree
+            keep: a node of the subtree that is kept with its own subtree
+        """
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node == keep:
+                self.parents[node] = -1
+                continue
+            stack.extend(self.children[node])
+            self.states[node] = self.children[node] = self.untried[node] = None
+            self._free.append(node)
+
+    def clear(self):
+        """Frees all nodes"""
+        size = len(self.states)
+        self.__init__(size)
+
+class MCTSMethod(Method):
+    """Monte Carlo tree search with UCT and batched playouts
+
+    Attributes:
+        _playouts_per_level: the search of one move is stopped after
+            _playouts_per_level * 2 ** ai_level playouts
+        _batch_size: amount of leaves whose playouts are played at once
+        _leaf_playouts: amount of playouts of each leaf
+        _exploration: the constant of the UCT bonus
+        _widening, _widening_exponent: progressive widening (see above)
+        _tree_size: maximum amount of tree nodes
+        _seed: seed of the random generator of the playouts
+        _pool: the nodes (NodePool); created at the first move
+        _root: the root node; it is kept between the moves
+        _plan: dictionary from the keys of the positions of the chosen
+            extra moves chain to the holes of the chain
+        _playouts, _search_time: playouts and seconds of the last move
+        Please refer to method.py for details
+    """
+    _name = "MCTS"
+    _short_name = "MCTS"
+    _disabled = np is None
+    _playouts_per_level = 1000
+    _batch_size = 64
+    _leaf_playouts = 4
+    _exploration = 0.7
+    _widening = 2.0
+    _widening_exponent = 0.5
+    _tree_size = 200000
+    _seed = 2015
+
+    def __init__(self, player_num, ai_level=4, run_time_limit=60):
+        """Inits MCTSMethod object
+
+        Args:
+            Please refer Method class description for details
+        """
+        super(MCTSMethod, self).__init__(player_num, ai_level, run_time_limit)
+        self._random = np.random.RandomState(self._seed)
+        self._pool = None
+        self._root = -1
+        self._plan = {}
+        self._playouts = 0
+        self._search_time = 0.0
+
+    def new_game(self):
+        """Drops the tree of the previous game"""
+        if self._pool is not None:
+            self._pool.clear()
+        self._root = -1
+        self._plan = {}
+
+    def make_move(self, state):
+        """Makes a decision of the player's next move
+
+        Args:
+            state: current board state
+
+        Returns:
+            Player's hole number which defines a player's next move
+        """
+        self.start_timer(self._run_time_limit)
+        start = self._start_time
+        self._log("Input state:", state.to_string())
+        key = state.key(self._player)
+        if key in self._plan:
+            # the next move of the chain chosen before
+            return self._plan.pop(key)
+        root = self._reuse_root(state)
+        self._playouts = self._search(root)
+        self._search_time = time() - start
+        pool = self._pool
+        best = max(pool.children[root], key=lambda child: pool.visits[child])
+        holes = pool.holes[best]
+        self._plan = {}
+        chain_state = state.copy()
+        for index, hole in enumerate(holes[:-1]):
+            chain_state.move(self._player, hole)
+            self._plan[chain_state.key(self._player)] = holes[index + 1]
+        self._log(self.stats())
+        self._log("%.3f of %d playouts" % (pool.scores[best] / pool.visits[best],
+                                           pool.visits[best]), holes)
+        return holes[0]
+
+    def stats(self):
+        """Returns a short human readable report of the last search"""
+        return "MCTS: %d playouts in %.2fs, %.0f playouts/sec, %d nodes" % \
+            (self._playouts, self._search_time,
+             self._playouts / max(self._search_time, 1e-6), len(self._pool))
+
+    def _reuse_root(self, state):
+        """Returns the root node of the state; the subtree of the state is
+        kept if the state is in the tree (two moves below the old root),
+        the rest of the tree is released"""
+        if self._pool is None:
+            self._pool = NodePool(self._tree_size)
+        pool = self._pool
+        key = state.key(self._player)
+        new_root = -1
+        if self._root >= 0:
+            for child in pool.children[self._root]:
+                for grandchild in pool.children[child]:
+                    if (pool.players[grandchild] == self._player and
+                            pool.states[grandchild].key(self._player) == key):
+                        new_root = grandchild
+            pool.release(self._root, new_root)
+        if new_root < 0:
+            new_root = pool.new(state.copy(), self._player)
+        self._root = new_root
+        return new_root
+
+    def _search(self, root):
+        """Runs the playouts from the root until the deadline of the move
+        (see Method.is_deadline_reached) or the playouts limit; returns
+        amount of the playouts; one batch is played anyway, so the root has
+        a child to choose"""
+        pool = self._pool
+        max_playouts = self._playouts_per_level * 2 ** self._ai_level
+        playouts = 0
+        while not playouts or (playouts < max_playouts and
+                               not self.is_deadline_reached()):
+            leaves = [self._select(root) for i in xrange(self._batch_size)]
+            for node, score in zip(leaves, self._playout_scores(leaves)):
+                self._backup(node, score)
+            playouts += len(leaves) * self._leaf_playouts
+            if len(pool.children[root]) == 1 and not pool.untried[root]:
+                break # the only move
+        return playouts
+
+    def _select(self, node):
+        """Goes down the tree from the node by UCT and adds a new leaf; the
+        virtual loss is added to the visits of the path
+
+        Returns:
+            The leaf node
+        """
+        pool = self._pool
+        visits, scores, children = pool.visits, pool.scores, pool.children
+        exploration = self._exploration
+        while True:
+            visits[node] += 1
+            state, player = pool.states[node], pool.players[node]
+            if state.is_finished(player):
+                return node
+            untried = pool.untried[node]
+            if untried is None:
+                untried = pool.untried[node] = self._ordered_neighbors(state, player)
+            if untried and (not children[node] or len(children[node]) <
+                            self._widening * visits[node] ** self._widening_exponent):
+                neighbor = untried[-1]
+                child = pool.new(neighbor.state, neighbor.player, neighbor.holes, node)
+                if child >= 0:
+                    untried.pop()
+                    children[node].append(child)
+                    visits[child] += 1
+                    return child
+                if not children[node]:
+                    return node # the pool is full
+            bonus = exploration * sqrt(log(visits[node]))
+            node = max(children[node], key=lambda child:
+                       scores[child] / visits[child] + bonus / sqrt(visits[child]))
+
+    def _ordered_neighbors(self, state, player):
+        """Returns the neighbors of the state in the reversed order of
+        expanding: long extra moves chains and big captures last"""
+        return sorted(state.iter_all_neighbors(player),
+                      key=lambda neighbor: (neighbor.depth, neighbor.captured))
+
+    def _playout_scores(self, leaves):
+        """Plays _leaf_playouts random games from each leaf at once
+
+        Returns:
+            A list of average scores of player 0 for the leaves (a score of
+            a game is 1, 0.5 or 0)
+        """
+        pool, count = self._pool, self._leaf_playouts
+        batch = KalahBatch.from_states([pool.states[node] for node in leaves],
+                                       [pool.players[node] for node in leaves])
+        batch = KalahBatch(np.repeat(batch.boards, count, axis=0),
+                           np.repeat(batch.players, count), batch.holes_num())
+        batch.end_games()
+        differences = batch.play_random(self._random).reshape(-1, count)
+        return ((np.sign(differences) + 1) * 0.5).mean(axis=1).tolist()
+
+    def _backup(self, node, score):
+        """Adds the score of player 0 to the path from the node to the root
+        (the visits are already counted by _select)"""
+        pool = self._pool
+        parents, players, scores = pool.parents, pool.players, pool.scores
+        while node >= 0:
+            parent = parents[node]
+            if parent >= 0:
+                scores[node] += score if players[parent] == 0 else 1 - score
+            node = parent
+
+#
+# Checks of the node pool and a short game of MCTS against a random player
+#
+if __name__ == "__main__":
+    import sys
+    from StringIO import StringIO
+    from methods.state import KalahState, MoveEndsInPlayersKalah
+
+    pool = NodePool(4)
+    root = pool.new(KalahState(4), 0)
+    children = [pool.new(KalahState(4), 1, (hole,), root) for hole in range(3)]
+    pool.children[root] = children
+    assert pool.new(KalahState(4), 0) == -1
+    pool.release(root, children[1])
+    assert len(pool) == 1 and pool.parents[children[1]] == -1
+
+    # an obvious capture: player 0 takes 10 stones from the hole 1
+    state = KalahState(0)
+    state.set_board([[0, 0, 1, 1, 0, 0], [0, 0, 0, 10, 1, 1]], [10, 10])
+    method = MCTSMethod(0, 3)
+    stdout, sys.stdout = sys.stdout, StringIO()
+    hole = method.make_move(state)
+    sys.stdout = stdout
+    assert hole == 3, hole
+    print method.stats()
+
+    # the tree is kept when the game goes on
+    generator = np.random.RandomState(1)
+    state, player = KalahState(4), 0
+    method = MCTSMethod(0, 1)
+    kept = []
+    while not state.is_finished(player):
+        if player == 0:
+            stdout, sys.stdout = sys.stdout, StringIO()
+            hole = method.make_move(state)
+            sys.stdout = stdout
+            descents = method._playouts // method._leaf_playouts
+            kept.append(method._pool.visits[method._root] - descents)
+        else:
+            holes = [hole for hole, stones in enumerate(state.player_holes(1)) if stones]
+            hole = holes[generator.randint(len(holes))]
+        if state.move(player, hole) != MoveEndsInPlayersKalah:
+            player = (player + 1) % 2
+    assert max(kept) > 0
+    state.end_game()
+    print "MCTS against random:", state.player_kalah(0), state.player_kalah(1)
+    print "MCTS: OK"
@@ -24,7 +24,32 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from PyQt4.QtCore import QElapsedTimer
+import sys
+from time import time
+
+class _ElapsedTimer(object):
+    """The part of QElapsedTimer that the methods used to call on 
+    self._running_timer before the Method kept the clock itself; it is 
+    kept for the methods that still call it"""
+    
+    def __init__(self, start_time=None):
+        self._start_time = time() if start_time is None else start_time
+        
+    def start(self):
+        self._start_time = time()
+        
+    def restart(self):
+        """Restarts the timer and returns the milliseconds before it"""
+        elapsed = self.elapsed()
+        self.start()
+        return elapsed
+        
+    def elapsed(self):
+        """Returns the milliseconds since the start"""
+        return int((time() - self._start_time)*1000)
+        
+    def hasExpired(self, timeout):
+        return self.elapsed()>timeout
 
 class Method(object):
     """Base class for gameplay methods
@@ -37,8 +62,23 @@ class Method(object):
         _player: number of player which uses this method (0 or 1)
         _disabled: if True then method will not be active in GUI
         _ai_level: level of the AI experience (from 1 to 5)
-        _running_timer: QElapsedTimer object that is used to check if the 
-            method has run out of the time limit
+        _start_time, _deadline: when the search of the move was started 
+            and when it has to stop (see start_timer)
+        _timed_out: if the deadline was reached during the search; the 
+            values that were searched since then are not complete
+        _best_move: the best move found so far at the root of the search 
+            (None if there is no move yet); a method that sets it can give 
+            a move at any moment
+        _clock_interval, _clock_countdown, _clock_checked: amount of calls
+            of is_deadline_reached between two looks at the clock, calls
+            left to the next look and the time of the last look
+        _stop_requested: if the searches have to stop at their next look
+            at the clock (see stop_search)
+        _quiet: if the reports of the searches are not printed (see 
+            set_quiet)
+        _running_timer: the clock of the move as a QElapsedTimer-like 
+            object (see _ElapsedTimer); only for the old methods, the new 
+            ones use is_time_expired and is_deadline_reached
     """
     
     _name = "Unknown"
@@ -47,7 +87,19 @@ class Method(object):
     _player = 1
     _disabled = False
     _ai_level = 1
+    _start_time = _deadline = _clock_checked = 0.0
+    _clock_interval = _clock_countdown = 1
+    _timed_out = False
+    _stop_requested = False
+    _best_move = None
     _running_timer = None
+    _quiet = False
+    # is_deadline_reached looks at the clock about once in this amount of
+    # seconds (a slow node, e.g. with long extra moves chains, can delay it
+    # by a few ms more)
+    _clock_period = 0.0002
+    # ...but not rarer than once in this amount of calls
+    _max_clock_interval = 100000
     
     def __init__(self, player_num, ai_level=1, run_time_limit=60):
         """Inits a method with player number and AI level
@@ -77,15 +129,72 @@ class Method(object):
         """Sets running time limit"""
         self._run_time_limit = run_time_limit
         
+    def set_quiet(self, quiet):
+        """Turns the reports of the searches off (e.g. for the searches 
+        made in advance, see ponder.py) or back on"""
+        self._quiet = quiet
+        
+    def _log(self, *values, **options):
+        """Prints the report values as the print function does (with its 
+        end option) unless the method is quiet"""
+        if not self._quiet:
+            sys.stdout.write(" ".join(str(value) for value in values) + 
+                             options.get("end", "\n"))
+            sys.stdout.flush()
+        
     def set_player(self, player_num):
         """Sets a player number (0 or 1)"""
         self._player = player_num
         
+    def new_game(self):
+        """Prepares the method for a new game
+        
+        The game keeps one method object for each AI player during the 
+        whole game (and for the next games with the same options), so the
+        method can keep what it learns (e.g. caches of positions) from move
+        to move. This function is called before the first move of each
+        game; a method can drop here the data of the previous game.
+        """
+        pass
+        
+    def end_game(self):
+        """It is called when the game is finished; a method can save here
+        what it has learned during the game"""
+        pass
+        
+    def reset(self):
+        """Drops everything that the method has learned, as if it was just
+        created
+        
+        It is called when the game goes back (e.g. a move is undone).
+        """
+        self.new_game()
+        
+    def start_timer(self, time_limit=-1):
+        """Starts the clock of the search of a move
+        
+        It is called by self.make_move function; a method that does not 
+        call it has to start the clock by itself.
+        
+        Args:
+            time_limit: seconds that the search can take; the running time 
+                limit by default
+        """
+        if time_limit<0:
+            time_limit = self._run_time_limit
+        self._start_time = self._clock_checked = time()
+        self._deadline = self._start_time + time_limit
+        self._clock_interval = self._clock_countdown = 1
+        self._timed_out = False
+        self._best_move = None
+        self._running_timer = _ElapsedTimer(self._start_time)
+        
     def is_time_expired(self, time_limit=-1):
         """Checks if the method is running out of time limit
         
-        It uses QElapsedTimer object (self._running_timer) to check the
-        elapsed time. Timer starts in self.make_move function
+        It looks at the clock at every call, so it is too slow for the 
+        nodes of a search (see is_deadline_reached). The clock starts in 
+        self.make_move function
         
         Args:
             time_limit: in seconds
@@ -95,17 +204,68 @@ class Method(object):
         """
         if time_limit<0:
             time_limit = self._run_time_limit
-        return self._running_timer.hasExpired(time_limit*1000)
+        return time() - self._start_time>=time_limit
+        
+    def is_deadline_reached(self):
+        """Checks if the search has to stop; it is cheap enough to be 
+        called at every node
+        
+        Looking at the clock costs more than a node of a simple search, so 
+        the clock is looked at only once in a number of calls. The number 
+        is calibrated at each look, so the looks are about _clock_period 
+        seconds apart (the first calls look at once and the number grows 
+        at most twice a look, so a slow node does not miss the deadline). 
+        Once the deadline is reached, all the next calls return True and 
+        self._timed_out is set.
+        
+        Returns:
+            True/False whether the deadline is reached
+        """
+        if self._timed_out:
+            return True
+        self._clock_countdown -= 1
+        if self._clock_countdown>0:
+            return False
+        now = time()
+        if now>=self._deadline or self._stop_requested:
+            self._timed_out = True
+            return True
+        spent = now - self._clock_checked
+        interval = self._clock_interval*2
+        if spent>0:
+            interval = min(interval, int(self._clock_interval*self._clock_period/spent))
+        self._clock_interval = self._clock_countdown = \
+            max(1, min(interval, self._max_clock_interval))
+        self._clock_checked = now
+        return False
+        
+    def stop_search(self, stop=True):
+        """Makes the search that runs in another thread (e.g. the pondering,
+        see ponder.py) stop at its next look at the clock, as if its
+        deadline was reached; the next searches stop at once too until
+        stop_search(False) is called"""
+        self._stop_requested = stop
+        
+    def best_move(self):
+        """Returns the best move found so far by the search (None if the 
+        method does not keep it or there is no move yet)"""
+        return self._best_move
         
     def make_move(self, state):
         """Makes a decision of the player's next move (abstract)
         
+        A method has to return its move before the running time limit. The 
+        simplest way to do it is an anytime search: it calls 
+        is_deadline_reached at every node, keeps the best move found so far 
+        at the root in self._best_move and returns it when the deadline is 
+        reached (the values of the moves that were not searched to the end 
+        are not used).
+        
         Args:
             state: current board state
         
         Returns:
             Player's hole number which defines a player's next move
         """
-        self._running_timer = QElapsedTimer()
-        self._running_timer.start()
+        self.start_timer()
         return -1
\ No newline at end of file
@@ -102,12 +102,47 @@ class MinMaxMethod(Method):
         _utility function.
         
         In the code below we call this player - Max, an opponent - Min.
+        
+        Alpha-beta pruning. Max already has a move with value alpha somewhere
+        above in the tree and Min has a move with value beta. When a node of
+        Max gets a value that is not less than beta, Min will never let the
+        game go to this node, so the rest of its neighbors are not expanded
+        (and vice versa for Min and alpha). The value of the whole tree is 
+        the same as without pruning, but much less nodes are expanded, 
+        especially when the best moves are tried first. So the moves are 
+        ordered: extra moves chains first, then captures, then the rest.
+        
+        Score bounds. The seeds never leave the kalahs, so the utility of 
+        every leaf below a node differs from the utility of the node by at 
+        most the amount of seeds that are left in the holes. When all these
+        seeds can not bring the value into the (alpha, beta) window, the 
+        node is cut with the bound that can be reached (see _bounded). It 
+        holds only for the utility of this class (the kalah difference), so
+        the cut is not made in a subclass that overrides _utility.
     
     Attributes:
+        _in_place_search: if True then the searching tree is walked by 
+            making and taking back moves on one state (see 
+            KalahState.play_all_moves) instead of copying a state for each 
+            neighbor; results are the same, but it is faster
+        _alpha_beta: if True then alpha-beta pruning is used; the value of
+            the best move is the same, but it is found much faster. The 
+            moves have to be ordered before they are made, so 
+            _in_place_search is not used in this mode
+        _score_bounds: if True then the alpha-beta search cuts the nodes 
+            by the score bounds of the kalahs (only with the _utility of 
+            this class)
+        _cut_bounds: if the score bounds are used in the current search
+        _bound_cutoffs: amount of the nodes cut by the score bounds
         Please refer to method.py for details    
     """
     _name = "Min-max"
     _short_name = "Min-max"
+    _in_place_search = False
+    _alpha_beta = False
+    _score_bounds = True
+    _cut_bounds = False
+    _bound_cutoffs = 0
     
     def __init__(self, player_num, ai_level=1, run_time_limit=60):
         """Inits MinMaxMethod object
@@ -136,7 +171,8 @@ class MinMaxMethod(Method):
         when:
             1) it has a state where the game stopped OR
             2) its depth is greater then depth limit OR
-            3) time is expiring
+            3) time is expiring (is_deadline_reached looks at the clock only 
+               once in a number of nodes, so it is cheap at every node)
         In one of these cases we return True, otherwise - False.
         
         TODO: Propose and implement your own criteria of when the expanding
@@ -149,7 +185,7 @@ class MinMaxMethod(Method):
         Returns:
             True/False: finished or not
         """
-        if depth>=self._ai_level or state.is_finished(player) or self.is_time_expired():
+        if depth>=self._ai_level or state.is_finished(player) or self.is_deadline_reached():
             return True
         return False
     
@@ -178,12 +214,52 @@ class MinMaxMethod(Method):
 
         return state.player_kalah(self._player) - state.player_kalah(self._other_player())
     
-    def _max_value(self, state, depth=1):
+    def _ordered_neighbors(self, state, player):
+        """Returns all neighbors of the state in the order of alpha-beta 
+        search: extra moves chains first, then captures, then the rest (the
+        order of holes is kept inside each group)
+        
+        Args:
+            state: specific state
+            player: active player's number for the specified state
+        """
+        return sorted(state.iter_all_neighbors(player), 
+            key=lambda neighbor: 0 if neighbor.depth>1 else 1 if neighbor.captured else 2)
+    
+    def _bounded(self, state, alpha, beta):
+        """Cuts the node of the alpha-beta search by the score bounds
+        
+        The utility of any leaf below the state is between the utility of 
+        the state minus and plus the seeds left in the holes (they can only 
+        go to the kalahs). If the highest reachable value is not above 
+        alpha (or the lowest one is not below beta), the node can not 
+        change the result and that bound is its value.
+        
+        Args:
+            state: specific state
+            alpha, beta: the window of the alpha-beta search
+        
+        Returns:
+            The bound or None if the node has to be searched
+        """
+        value = self._utility(state)
+        seeds = state.player_seeds(0) + state.player_seeds(1)
+        if value+seeds<=alpha:
+            self._bound_cutoffs += 1
+            return value+seeds
+        if value-seeds>=beta:
+            self._bound_cutoffs += 1
+            return value-seeds
+        return None
+    
+    def _max_value(self, state, depth=1, alpha=-float('inf'), beta=float('inf')):
         """Part of Minimax algorithm for the MAX player
         
         Args:
             state: specific state
             depth: depth of the state in a searching tree
+            alpha, beta: the best values that MAX and MIN already have 
+                above in the searching tree (only for the alpha-beta mode)
             
         Returns:
             Heuristic function value for this state. If this state is a 
@@ -205,8 +281,23 @@ class MinMaxMethod(Method):
         # bigest heuristic value. Recall that you take into account your
         # opponent move so to check the result of _min_value of the neighbor
         #
-        neighbors = state.get_all_neighbors(self._player)
         value = -float('inf')
+        if self._alpha_beta:
+            if self._cut_bounds:
+                bound = self._bounded(state, alpha, beta)
+                if bound is not None:
+                    return bound
+            for new_state in self._ordered_neighbors(state, self._player):
+                value = max(value, self._min_value(new_state.state, depth, alpha, beta))
+                if value>=beta:
+                    return value
+                alpha = max(alpha, value)
+            return value
+        if self._in_place_search:
+            for holes in state.play_all_moves(self._player):
+                value = max(value, self._min_value(state, depth))
+            return value
+        neighbors = state.iter_all_neighbors(self._player)
         for new_state in neighbors:
             value = max(value, self._min_value(new_state['state'], depth))
             
@@ -215,12 +306,14 @@ class MinMaxMethod(Method):
         #
         return value
             
-    def _min_value(self, state, depth=1):
+    def _min_value(self, state, depth=1, alpha=-float('inf'), beta=float('inf')):
         """Part of Minimax algorithm for the MIN player
         
         Args:
             state: specific state
             depth: depth of the state in a searching tree
+            alpha, beta: the best values that MAX and MIN already have 
+                above in the searching tree (only for the alpha-beta mode)
             
         Returns:
             Heuristic function value for this state. If this state is a 
@@ -243,8 +336,23 @@ class MinMaxMethod(Method):
         # opponent move so you take into account your own answer and should
         # check the result of _max_value of each neighbor
         #
-        neighbors = state.get_all_neighbors(self._other_player())
         value = float('inf')
+        if self._alpha_beta:
+            if self._cut_bounds:
+                bound = self._bounded(state, alpha, beta)
+                if bound is not None:
+                    return bound
+            for new_state in self._ordered_neighbors(state, self._other_player()):
+                value = min(value, self._max_value(new_state.state, depth+1, alpha, beta))
+                if value<=alpha:
+                    return value
+                beta = min(beta, value)
+            return value
+        if self._in_place_search:
+            for holes in state.play_all_moves(self._other_player()):
+                value = min(value, self._max_value(state, depth+1))
+            return value
+        neighbors = state.iter_all_neighbors(self._other_player())
         for new_state in neighbors:
             value = min(value, self._max_value(new_state['state'], depth+1))
             
@@ -268,8 +376,15 @@ class MinMaxMethod(Method):
             Player's hole number which defines a player's next move
         """
         super(MinMaxMethod, self).make_move(state)
-        print "Input state:", state.to_string()
+        self._log("Input state:", state.to_string())
+        self._cut_bounds = self._score_bounds and \
+            type(self)._utility.__func__ is MinMaxMethod._utility.__func__
         
+        if self._alpha_beta:
+            return self._make_move_alpha_beta(state)
+        if self._in_place_search:
+            return self._make_move_in_place(state.copy())
+            
         #
         # Generate all possible neighbors for the state, i.e. check all 
         # possible moves of the player at the moment and for any possible move
@@ -287,30 +402,203 @@ class MinMaxMethod(Method):
             return neighbors[0]['hole'][0]
             
         #
-        # Among all neighbors find the one that has maximum value and return it
+        # Among all neighbors find the one that has maximum value and return it.
+        # The search is anytime: when the deadline comes, the value of the 
+        # neighbor that is being searched is not complete, so it is dropped 
+        # and the best neighbor found so far is returned (the first one if 
+        # no neighbor is searched yet)
         #
+        if neighbors:
+            self._best_move = neighbors[0]['hole'][0]
         for new_state in neighbors:
             value = self._min_value(new_state['state'])
+            if self._timed_out:
+                self._log("No more time...")
+                break
             if best_value < value :
                 best_value, best_state = value, new_state
+                self._best_move = new_state['hole'][0]
                 
         if best_state:
-            print best_value, best_state['state'].to_string()
-            return best_state['hole'][0]
+            self._log(best_value, best_state['state'].to_string())
+        if self._best_move is not None:
+            return self._best_move
             
         # 
         # In case of wrong moves return -1
         #
         return -1
         
+    def _make_move_in_place(self, state):
+        """The same as make_move but for the in place search
+        
+        Args:
+            state: current board state; it is changed during the search, but 
+                it is restored at the end
+        
+        Returns:
+            Player's hole number which defines a player's next move
+        """
+        moves = list(state.play_all_moves(self._player))
+        if len(moves)==1:
+            return moves[0][0]
+            
+        best_value, best_holes = -float('inf'), None
+        if moves:
+            self._best_move = moves[0][0]
+        moves = state.play_all_moves(self._player)
+        try:
+            for holes in moves:
+                value = self._min_value(state)
+                if self._timed_out:
+                    self._log("No more time...")
+                    break
+                if best_value < value :
+                    best_value, best_holes = value, holes
+                    self._best_move = holes[0]
+        finally:
+            moves.close()
+                
+        if best_holes:
+            self._log(best_value, best_holes)
+        if self._best_move is not None:
+            return self._best_move
+        return -1
+        
+    def _make_move_alpha_beta(self, state):
+        """The same as make_move but with alpha-beta pruning
+        
+        The best value found so far is the alpha for the rest of the moves.
+        
+        Args:
+            state: current board state
+        
+        Returns:
+            Player's hole number which defines a player's next move
+        """
+        neighbors = self._ordered_neighbors(state, self._player)
+        if len(neighbors)==1:
+            return neighbors[0].holes[0]
+            
+        best_value, best_state = -float('inf'), None
+        if neighbors:
+            self._best_move = neighbors[0].holes[0]
+        for new_state in neighbors:
+            value = self._min_value(new_state.state, 1, best_value)
+            if self._timed_out:
+                self._log("No more time...")
+                break
+            if best_value < value :
+                best_value, best_state = value, new_state
+                self._best_move = new_state.holes[0]
+                
+        if best_state:
+            self._log(best_value, best_state.state.to_string())
+        if self._best_move is not None:
+            return self._best_move
+        return -1
+        
 #
 # You can test method while changing the board state below and simply executing 
 # this module 
 #
 if __name__ == "__main__":
-    from state import KalahState
+    from state import KalahState, MoveEndsInPlayersKalah
     state = KalahState(0)
-    state._kalahs = [6,4]
-    state._holes = [[1, 4, 0, 0, 0, 0], [0, 0, 0, 0, 3, 1]]
+    state.set_board([[1, 4, 0, 0, 0, 0], [0, 0, 0, 0, 3, 1]], [6,4])
     method = MinMaxMethod(1, 1)
-    print method.make_move(state)
\ No newline at end of file
+    print method.make_move(state)
+    
+    #
+    # The in place search must give the same moves as the copying one
+    #
+    for stones, level in [(3, 3), (4, 3), (6, 2)]:
+        state = KalahState(stones)
+        state.move(0, 1)
+        for player in [0, 1]:
+            method = MinMaxMethod(player, level)
+            hole = method.make_move(state)
+            method._in_place_search = True
+            assert method.make_move(state)==hole
+    print "In place search: OK"
+    
+    #
+    # Alpha-beta search must give the same values as the full one
+    #
+    for stones, level in [(3, 3), (4, 3), (6, 2)]:
+        state = KalahState(stones)
+        state.move(0, 1)
+        for player in [0, 1]:
+            method = MinMaxMethod(player, level)
+            method.make_move(state)
+            value = method._max_value(state)
+            method._alpha_beta = True
+            method.make_move(state)
+            assert method._max_value(state)==value
+    print "Alpha-beta search: OK"
+    
+    #
+    # The score bounds give the same values in the endgame positions, where
+    # they cut nodes
+    #
+    cutoffs = 0
+    for game in range(6):
+        state, player = KalahState(4), 0
+        for ply in range(30):
+            holes = [hole for hole, stones in enumerate(state.player_holes(player)) if stones]
+            if not holes:
+                break
+            hole = holes[(ply*7 + game*3) % len(holes)]
+            if state.move(player, hole)!=MoveEndsInPlayersKalah:
+                player = (player+1) % 2
+        if state.is_finished(player):
+            continue
+        method = MinMaxMethod(player, 3, 1000)
+        method.make_move(state)
+        value = method._max_value(state)
+        method._alpha_beta = True
+        method.make_move(state)
+        assert method._max_value(state)==value
+        cutoffs += method._bound_cutoffs
+    assert cutoffs>0
+    
+    #
+    # A subclass with its own utility is not cut by the bounds of the kalah
+    # difference
+    #
+    class HolesMinMax(MinMaxMethod):
+        def _utility(self, state):
+            return 3*MinMaxMethod._utility(self, state) + \
+                state.player_seeds(self._player)
+    for game in range(6):
+        state, player = KalahState(4), 0
+        for ply in range(30):
+            holes = [hole for hole, stones in enumerate(state.player_holes(player)) if stones]
+            if not holes:
+                break
+            hole = holes[(ply*5 + game) % len(holes)]
+            if state.move(player, hole)!=MoveEndsInPlayersKalah:
+                player = (player+1) % 2
+        if state.is_finished(player):
+            continue
+        method = HolesMinMax(player, 3, 1000)
+        method.make_move(state)
+        value = method._max_value(state)
+        method._alpha_beta = True
+        method.make_move(state)
+        assert method._max_value(state)==value and not method._bound_cutoffs
+    print "Score bounds: OK"
+    
+    #
+    # The anytime search gives a legal move right after the deadline
+    #
+    from time import time
+    state = KalahState(6)
+    for in_place, alpha_beta in [(False, False), (True, False), (False, True)]:
+        method = MinMaxMethod(0, 5, 0.1)
+        method._in_place_search, method._alpha_beta = in_place, alpha_beta
+        start = time()
+        hole = method.make_move(state)
+        assert time() - start < method._run_time_limit + 0.05
+        assert method._timed_out and state.player_holes(0)[hole]
+    print "Anytime search: OK"
\ No newline at end of file
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""Killer moves and history heuristics for ordering of the searched moves.
+
+Alpha-beta search cuts the most when the best move of a position is tried
+first, and with six holes on a side the order of the moves decides almost
+everything. A move that refuted one position often refutes its siblings
+too, so MoveOrdering remembers such moves:
+    killer moves: two last moves that caused a cutoff at each ply (depth
+        of the position in the searching tree); a move is a tuple of holes
+        (with the extra moves chain), so it can be tried in any position
+    history: a score for each player and the first hole of a move; every
+        cutoff adds the square of the remaining depth to it, so the moves
+        that refute deep subtrees count more
+
+The moves of a position are sorted by them: the killers of the ply go
+first, then the rest by their history scores (the order of the neighbors
+is kept for equal scores). The heuristics are kept between the searches of
+iterative deepening; at the next move the killers are dropped and the
+history scores are halved, so the old moves weigh less.
+
+The cutoffs are counted, so the part of the cutoffs made by the first
+tried move shows how good the ordering is.
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+class MoveOrdering(object):
+    """Killer moves and history scores of a searching method
+
+    Attributes:
+        cutoffs: amount of positions where the search was cut
+        first_cutoffs: amount of the cutoffs made by the first tried move
+        _killers: list of [killer, killer] pairs for each ply; the newest
+            killer goes first, None for an empty slot
+        _history: dictionary from (player, first hole) to the score
+    """
+
+    def __init__(self):
+        """Inits empty heuristics"""
+        self.clear()
+
+    def clear(self):
+        """Drops the killers, the history and the counters"""
+        self._killers = []
+        self._history = {}
+        self.reset_stats()
+
+    def new_search(self):
+        """Prepares the heuristics for the search of the next move: the
+        killers are dropped and the history scores are halved"""
+        self._killers = []
+        for key, score in self._history.items():
+            if score > 1:
+                self._history[key] = score // 2
+            else:
+                del self._history[key]
+
+    def reset_stats(self):
+        """Resets the cutoff counters"""
+        self.cutoffs = self.first_cutoffs = 0
+
+    def killers(self, ply):
+        """Returns the pair of killer moves of the ply"""
+        killers = self._killers
+        while len(killers) <= ply:
+            killers.append([None, None])
+        return killers[ply]
+
+    def history(self, player, holes):
+        """Returns the history score of the move of the player"""
+        return self._history.get((player, holes[0]), 0)
+
+    def order(self, neighbors, player, ply):
+        """Returns the neighbors sorted for the search
+
+        Args:
+            neighbors: list of the neighbors (KalahMove records); it is not
+                changed
+            player: number of player who moves
+            ply: depth of the position in the searching tree
+
+        Returns:
+            A new list: killers of the ply first, then the rest by the
+            history scores
+        """
+        killers = self.killers(ply)
+        history = self._history
+        def priority(neighbor):
+            holes = neighbor.holes
+            if holes == killers[0]:
+                return -1 << 62
+            if holes == killers[1]:
+                return -1 << 61
+            return -history.get((player, holes[0]), 0)
+        return sorted(neighbors, key=priority)
+
+    def cutoff(self, player, ply, holes, index, draft):
+        """Remembers the move that caused a cutoff
+
+        Args:
+            player: number of player who made the move
+            ply: depth of the position in the searching tree
+            holes: tuple of holes of the move
+            index: number of the move in the order of the search (0 for
+                the first tried move)
+            draft: depth of the search below the position
+        """
+        self.cutoffs += 1
+        if not index:
+            self.first_cutoffs += 1
+        killers = self.killers(ply)
+        if killers[0] != holes:
+            killers[1], killers[0] = killers[0], holes
+        key = (player, holes[0])
+        self._history[key] = self._history.get(key, 0) + draft * draft
+
+    def first_cutoff_rate(self):
+        """Returns a part of the cutoffs made by the first move (0 to 1)"""
+        return float(self.first_cutoffs) / self.cutoffs if self.cutoffs else 0.0
+
+    def stats(self):
+        """Returns a short human readable report of the cutoffs"""
+        return "ordering: %d cutoffs, %.0f%% on the first move" % \
+            (self.cutoffs, self.first_cutoff_rate() * 100)
+
+#
+# Checks the order of the moves after some cutoffs
+#
+if __name__ == "__main__":
+    from state import KalahState
+
+    state = KalahState(4)
+    neighbors = state.get_all_neighbors(0)
+    ordering = MoveOrdering()
+    assert ordering.order(neighbors, 0, 3) == neighbors
+
+    # history: the first hole of the later moves gets a bigger score
+    ordering.cutoff(0, 5, neighbors[-1].holes, 2, 3)
+    ordering.cutoff(0, 5, neighbors[-2].holes, 0, 2)
+    ordered = ordering.order(neighbors, 0, 3)
+    assert ordered[0].holes[0] == neighbors[-1].holes[0]
+    assert len(ordered) == len(neighbors)
+    assert ordering.order(neighbors, 1, 3) == neighbors
+
+    # killers of the ply go before the history
+    ordering.cutoff(0, 3, neighbors[1].holes, 1, 1)
+    ordering.cutoff(0, 3, neighbors[0].holes, 0, 1)
+    ordered = ordering.order(neighbors, 0, 3)
+    assert ordered[0] is neighbors[0] and ordered[1] is neighbors[1]
+    assert ordering.killers(3) == [neighbors[0].holes, neighbors[1].holes]
+    assert ordering.first_cutoffs == 2 and ordering.cutoffs == 4
+    print ordering.stats()
+
+    ordering.new_search()
+    assert ordering.killers(3) == [None, None]
+    assert ordering.history(0, neighbors[-1].holes) == 4
+    assert ordering.history(0, neighbors[1].holes) == 0
+    print "Move ordering: OK"
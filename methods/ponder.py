@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""Pondering: searching the replies to the opponent's moves in advance.
+
+When an AI player has made its move, its engine waits for the opponent,
+who can think for a long time. The Ponderer uses that time: it makes all
+the opponent's possible moves (extra moves chains) from the position after
+the AI's move, and searches the player's move for each of the positions
+as if it was already on the board. The searches run one by one in one
+thread of the engine process with the engine's own method object, so what
+they put into the method's tables and caches is kept for the real search
+even if the opponent's move was not searched. The replies are not searched
+on several cores at once: a method that searches in parallel (e.g.
+CleverBot with its workers) already uses the idle cores in each search,
+and the searches of a method object can not run at the same time. The replies are kept in a
+reply cache, keyed by the packed positions (see encoding.pack).
+
+When the opponent's move is known, there are three cases:
+    hit: the reply is searched already, it is returned at once
+    warm hit: the position is being searched, its search is finished and
+        the time that it has already spent is saved
+    miss: the position is not searched yet (or the opponent's move was not
+        expected at all, or its search failed), the method searches it as
+        usual with the tables warmed by the pondering
+In any case the other searches are stopped (see Method.stop_search), so
+they do not take the time of the real search. The hits, moves and saved
+time are counted until reset_stats (the engine reports them once per game).
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from threading import Lock, Thread
+from time import time
+
+import methods.state as st
+from methods.encoding import pack, unpack
+
+class Ponderer(object):
+    """Searches the replies to the opponent's moves in a background thread
+
+    Attributes:
+        hits: amount of the opponent's moves whose reply was searched (or
+            was being searched) in advance
+        moves: amount of the opponent's moves made while pondering
+        saved: seconds of the searches that were made in advance
+        _method: the method object of the engine
+        _thread: the pondering thread (None if the pondering is stopped)
+        _replies: dictionary from the packed positions to (hole, seconds
+            of the search) of the finished searches
+        _current, _started: the position that is being searched and the
+            start time of its search
+        _finishing: if the thread has to stop after the current search
+        _lock: guards _current and _finishing
+    """
+
+    def __init__(self, method):
+        """Inits a ponderer for the method object of the engine"""
+        self._method = method
+        self._thread = None
+        self._replies = {}
+        self._current = None
+        self._started = 0.0
+        self._finishing = False
+        self._lock = Lock()
+        self.reset_stats()
+
+    def start(self, state, hole, time_limit):
+        """Starts the pondering after the player's move
+
+        Nothing is done if the player moves again after the move (it ends
+        in the player's kalah) or the game is finished.
+
+        Args:
+            state: position before the move
+            hole: the player's move
+            time_limit: running time limit of each search
+        """
+        self.stop()
+        state = state.copy()
+        player, opponent = self._method._player, (self._method._player + 1) % 2
+        if state.move(player, hole) == st.MoveEndsInPlayersKalah:
+            return
+        if state.is_finished(opponent):
+            return
+        # the moves that look strong are searched first
+        replies = sorted(state.iter_all_neighbors(opponent),
+                         key=lambda reply: (-reply.depth, -reply.captured))
+        positions = [pack(reply.state, player) for reply in replies
+                     if not reply.state.is_finished(player)]
+        if not positions:
+            return
+        self._finishing = False
+        self._thread = Thread(target=self._search_replies,
+                              args=(positions, time_limit))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _search_replies(self, positions, time_limit):
+        # the body of the pondering thread; the reports of the speculative
+        # searches would mix with the real ones, so the method is quiet
+        # until the thread is joined (the real search waits for it)
+        method = self._method
+        method.set_quiet(True)
+        try:
+            for position in positions:
+                with self._lock:
+                    if self._finishing:
+                        break
+                    self._current, self._started = position, time()
+                try:
+                    method.set_run_time_limit(time_limit)
+                    hole = method.make_move(unpack(position, method._player))
+                except Exception:
+                    # a failed search is a miss
+                    continue
+                if method._stop_requested:
+                    break # the search was cut, its move is not complete
+                self._replies[position] = hole, time() - self._started
+        finally:
+            method.set_quiet(False)
+            with self._lock:
+                self._current = None
+
+    def take(self, position):
+        """Returns the reply to the position if it is searched in advance
+
+        The pondering is stopped in any case. A search of the position that
+        is already running is waited for.
+
+        Args:
+            position: the position packed for the player
+
+        Returns:
+            The hole of the reply or None if the position was not searched
+        """
+        if self._thread is None:
+            return None
+        self.moves += 1
+        with self._lock:
+            self._finishing = True
+            current = self._current
+        start = time()
+        if position not in self._replies and current == position:
+            # a warm hit: the search of the position is finished
+            self._thread.join()
+        found = self._replies.get(position)
+        self.stop()
+        if found is None:
+            return None
+        hole, elapsed = found
+        self.hits += 1
+        self.saved += max(0.0, elapsed - (time() - start))
+        return hole
+
+    def stop(self):
+        """Stops the searches and drops the reply cache"""
+        if self._thread is not None:
+            with self._lock:
+                self._finishing = True
+            self._method.stop_search()
+            self._thread.join()
+            self._method.stop_search(False)
+            self._thread = None
+        self._replies = {}
+
+    def reset_stats(self):
+        """Resets the counters"""
+        self.hits = self.moves = 0
+        self.saved = 0.0
+
+    def stats(self):
+        """Returns a short human readable report of the pondering"""
+        rate = 100.0 * self.hits / self.moves if self.moves else 0.0
+        return "ponder: %d hits of %d moves (%.0f%%), %.1fs saved" % \
+            (self.hits, self.moves, rate, self.saved)
+
+#
+# Checks with a method that plays the first possible hole after a delay
+#
+if __name__ == "__main__":
+    from time import sleep
+    from methods.method import Method
+
+    class FirstHoleMethod(Method):
+        searches = 0
+        def make_move(self, state):
+            self.start_timer()
+            self.searches += 1
+            while not self.is_deadline_reached():
+                sleep(0.001)
+            holes = state.player_holes(self._player)
+            return min(hole for hole, stones in enumerate(holes) if stones)
+
+    class BrokenMethod(FirstHoleMethod):
+        def make_move(self, state):
+            raise ValueError("no move")
+
+    state = st.KalahState(4)
+    method = FirstHoleMethod(0, 1)
+    ponderer = Ponderer(method)
+    assert ponderer.take(pack(state, 0)) is None and ponderer.moves == 0
+
+    # player 0 plays the hole 5, player 1 answers with the hole 2
+    ponderer.start(state, 5, 0.2)
+    sleep(1.5)
+    state.move(0, 5)
+    state.move(1, 2)
+    start = time()
+    assert ponderer.take(pack(state, 0)) == 0
+    assert time() - start < 0.1
+    assert ponderer.hits == 1 and ponderer.saved > 0.1
+    assert not method._quiet
+
+    # a position that was not expected; the running search is cut
+    ponderer.start(state, 0, 10.0)
+    sleep(0.1)
+    assert method._quiet
+    start = time()
+    assert ponderer.take(pack(st.KalahState(4), 0)) is None
+    assert time() - start < 0.1
+    assert ponderer.moves == 2 and ponderer.hits == 1
+    assert not method._stop_requested
+
+    # a move that ends in the own kalah is not pondered
+    state = st.KalahState(4)
+    searches = method.searches
+    ponderer.start(state, 2, 0.2)
+    assert ponderer.take(pack(state, 0)) is None and ponderer.moves == 2
+    assert method.searches == searches
+
+    # a failed search is a miss
+    state = st.KalahState(4)
+    broken = Ponderer(BrokenMethod(0, 1))
+    broken.start(state, 5, 0.2)
+    sleep(0.1)
+    state.move(0, 5)
+    state.move(1, 2)
+    assert broken.take(pack(state, 0)) is None and broken.moves == 1
+    print ponderer.stats()
+    print "Pondering: OK"
@@ -19,8 +19,6 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from copy import deepcopy
-
 #
 # Constans that are used to return turn results up to the calling program
 #
@@ -36,43 +34,206 @@ MoveEndsInPlayersEmptyHole = 3
 # Current move is wrong (we've got some error)
 WrongMove = 4
 
+from operator import attrgetter
+
+# Sowing tables for each amount of holes (see _sowing_tables function)
+_sowing_tables_cache = {}
+
+def _sowing_tables(holes_num):
+    """Returns sowing tables for a board with holes_num holes
+    
+    The tables are built only once for each board size. For each player and
+    each hole there is a tuple (ring, prefixes):
+        ring: board cells in the order of sowing from the hole; these are 
+            2*holes_num+1 cells (all except opponent's kalah) and the hole
+            itself is the last one
+        prefixes: for each amount of stones r less than the ring length
+            a tuple (cells, own, other): cells that get one stone when r 
+            stones are sown, amount of the player's holes and amount of 
+            opponent's holes among them
+    So sowing of n stones is made with divmod(n, len(ring)): each cell of the
+    ring gets the quotient and the cells of the prefix for the remainder get
+    one stone more. The last stone is put to ring[(n-1) % len(ring)].
+    """
+    tables = _sowing_tables_cache.get(holes_num)
+    if tables is None:
+        size = 2*holes_num + 2
+        tables = []
+        for player in [0,1]:
+            other_kalah = ((player+1) % 2)*(holes_num+1) + holes_num
+            player_tables = []
+            for hole in range(holes_num):
+                ring, pit = [], player*(holes_num+1) + hole
+                while len(ring)<size-1:
+                    pit = (pit+1) % size
+                    if pit!=other_kalah:
+                        ring.append(pit)
+                prefixes = []
+                own = other = 0
+                for rest in range(len(ring)):
+                    prefixes.append((tuple(ring[:rest]), own, other))
+                    pit = ring[rest]
+                    if pit//(holes_num+1)!=player:
+                        other += 1
+                    elif pit%(holes_num+1)!=holes_num:
+                        own += 1
+                player_tables.append((tuple(ring), tuple(prefixes)))
+            tables.append(tuple(player_tables))
+        tables = _sowing_tables_cache[holes_num] = tuple(tables)
+    return tables
+
+# Zobrist keys for each amount of board cells (see _zobrist_tables function)
+_zobrist_tables_cache = {}
+
+def _zobrist_key(pit, stones):
+    """Returns a pseudorandom 64-bit key for the board cell with stones
+    
+    Keys are made with the splitmix64 mixing function, so they are the same
+    in all processes. They are returned as signed numbers to stay in the 
+    machine integers range.
+    """
+    mask = (1<<64) - 1
+    z = ((pit<<16 | stones) * 0x9E3779B97F4A7C15 + 0x632BE59BD9B4E019) & mask
+    z = ((z ^ (z>>30)) * 0xBF58476D1CE4E5B9) & mask
+    z = ((z ^ (z>>27)) * 0x94D049BB133111EB) & mask
+    z ^= z>>31
+    if z>=1<<63:
+        z -= 1<<64
+    return int(z)
+
+# Zobrist key of the side to move (it is added for player 1)
+ZobristPlayerKey = _zobrist_key(0xFFFF, 0)
+
+def _zobrist_tables(cells, stones):
+    """Returns Zobrist keys for a board with the number of cells
+    
+    The result is a list of keys for each cell: tables[pit][stones] is a key
+    of the cell with the amount of stones. Hash of a board is XOR of keys of
+    all its cells. Tables are shared by all boards of the size and are 
+    extended when a board with more stones is used.
+    """
+    tables = _zobrist_tables_cache.get(cells)
+    if tables is None:
+        tables = _zobrist_tables_cache[cells] = [[] for pit in range(cells)]
+    for pit, keys in enumerate(tables):
+        for count in range(len(keys), stones+1):
+            keys.append(_zobrist_key(pit, count))
+    return tables
+
 class KalahStateList(object):
-    """Class that stores a list of the Kalah states
+    """Class that stores a trace of the move
     
     Purpose of this class is to provide the main program with a list of 
-    interimediate states for the moves' animation
+    interimediate steps for the moves' animation. Each step is stored as 
+    an event (pit, delta): a board cell (see KalahState) and amount of stones
+    that were added to it (negative when stones were taken). Applying the 
+    events one by one (see KalahState.apply_event) to the state before the 
+    move gives all the intermediate states.
     
     Attributes:
-        _list: a list of states
+        _list: a list of events
     """
     _list = []
     def __init__(self):
         """Inits an empty list"""
         self._list = []
-    def add_state(self, state, active_player, active_hole=-1, active_kalah=False):
-        """Adds a state to list"""
-        self._list.append({'state':state.copy(), 'player':active_player, 'hole':active_hole, 'kalah':active_kalah})
+    def add_event(self, pit, delta):
+        """Adds an event to list"""
+        self._list.append((pit, delta))
     def get_list(self):
         """Returns a reference to list""" 
         return self._list
 
+class KalahMove(object):
+    """A move and its result: a neighbor state of some state
+    
+    It is an immutable record. Fields can be read as attributes or, for 
+    compatibility with methods written for the old dictionaries, as 
+    dictionary items: move['state'], move['result'], move['hole'] (a list), 
+    move['player'] and move['depth'].
+    
+    Attributes:
+        state: a neighbor state
+        result: a result of the move that lead to this neighbor
+        holes: a tuple of holes from which we should pickup the stones to 
+            make this particular move (several holes for extra moves)
+        player: the number of a new player after that move
+        captured: amount of opponent's stones captured by the move (only 
+            the last move of a chain can capture)
+        depth: the length of the extra moves chain (len(holes))
+    """
+    __slots__ = ('_state', '_result', '_holes', '_player', '_captured')
+    
+    def __init__(self, state, result, holes, player, captured=0):
+        """Inits a move record (see the class description)"""
+        self._state = state
+        self._result = result
+        self._holes = holes
+        self._player = player
+        self._captured = captured
+        
+    state = property(attrgetter('_state'))
+    result = property(attrgetter('_result'))
+    holes = property(attrgetter('_holes'))
+    player = property(attrgetter('_player'))
+    captured = property(attrgetter('_captured'))
+    
+    @property
+    def depth(self):
+        return len(self._holes)
+        
+    def __reduce__(self):
+        """Makes the record picklable"""
+        return KalahMove, (self._state, self._result, self._holes, 
+                           self._player, self._captured)
+        
+    def __getitem__(self, key):
+        """Dictionary style access to the fields"""
+        if key=='hole':
+            return list(self._holes)
+        if key in ('state', 'result', 'player', 'depth'):
+            return getattr(self, key)
+        raise KeyError(key)
+        
+    def __contains__(self, key):
+        return key in ('state', 'result', 'hole', 'player', 'depth')
+        
+    def get(self, key, default=None):
+        """Dictionary style access to the fields"""
+        if key in self:
+            return self[key]
+        return default
+        
+    def keys(self):
+        """Returns names of the fields for the dictionary style access"""
+        return ['state', 'result', 'hole', 'player', 'depth']
+
 class KalahState(object):
     """Kalah game state
     
+    The whole board is kept in one flat list of 2*holes_num+2 cells: player 
+    0's holes, player 0's kalah, player 1's holes and player 1's kalah. So 
+    for the standard board the cells 0..5 are player 0's holes, 6 is his/her
+    kalah, 7..12 are player 1's holes and 13 is player 1's kalah. This makes
+    copying of a state as cheap as copying one short list, which matters a 
+    lot for the searching methods.
+    
     Attributes:
         _holes_num: amount of holes or pits (default: 6)
-        _holes: two lists of contents of each player's holes
-        _kalahs: amount of stones in each player's kalah
-        last_move: an object of KalahStateList that stores a sequence of 
-            interimediate states for the moves' animation
+        _board: flat list of contents of all holes and kalahs (see above)
+        _seeds: amount of stones in holes (kalahs are not counted) on each
+            player's side; it is updated incrementally by every move
+        _sowing: sowing tables for the board size (see _sowing_tables)
+        _zobrist: Zobrist keys for the board size (see _zobrist_tables)
+        _hash: Zobrist hash of the board; it is updated incrementally by 
+            every move (see key function)
+        last_move: an object of KalahStateList that stores a trace of the 
+            last move for the moves' animation (if it was requested)
         last_move_result: last made move (refer to constants' lists on the top 
             of file)
     """
-    _holes_num = 6
-    _holes = [[], []]
-    _kalahs = [0, 0]
-    last_moves = None
-    last_move_result = MoveEnds
+    __slots__ = ('_holes_num', '_board', '_seeds', '_sowing', '_zobrist', 
+                 '_hash', 'last_moves', 'last_move_result')
     
     def __init__(self, stones_per_hole, holes_num=6):
         """Inits a board
@@ -82,29 +243,117 @@ class KalahState(object):
             holes_num: number of hole (standard is 6)
         """
         self._holes_num = holes_num
-        self._holes = [[], []]
-        self._kalahs = [0, 0]
-        for hole in range(self._holes_num):
-            self._holes[0].append(stones_per_hole)
-            self._holes[1].append(stones_per_hole)
+        self._board = ([stones_per_hole]*holes_num + [0])*2
+        self._init_tables()
+        self.last_moves = None
+        self.last_move_result = MoveEnds
+        
+    def _init_tables(self):
+        """Calculates side amounts of stones and the hash of the board and 
+        gets the tables for its size"""
+        holes_num = self._holes_num
+        board = self._board
+        self._seeds = [sum(board[:holes_num]), sum(board[holes_num+1:-1])]
+        self._sowing = _sowing_tables(holes_num)
+        self._zobrist = _zobrist_tables(len(board), sum(board))
+        self._hash = 0
+        for pit, stones in enumerate(board):
+            self._hash ^= self._zobrist[pit][stones]
+        
+    def __getstate__(self):
+        """Returns a picklable representation (needed because of __slots__)"""
+        return (self._holes_num, self._board, self.last_move_result)
+    
+    def __setstate__(self, data):
+        """Restores a state from the result of __getstate__"""
+        self._holes_num, self._board, self.last_move_result = data
+        self._board = list(self._board)
+        self._init_tables()
+        self.last_moves = None
+            
+    def set_board(self, holes, kalahs):
+        """Sets a contents of the board
+        
+        Args:
+            holes: two lists of amount of stones in each player's holes
+            kalahs: amount of stones in each player's kalah
+        """
+        self._holes_num = len(holes[0])
+        self._board = list(holes[0]) + [kalahs[0]] + list(holes[1]) + [kalahs[1]]
+        self._init_tables()
+            
+    def cells(self, player=0):
+        """Returns a list of contents of all board cells as seen by the 
+        player: his/her holes and kalah, then opponent's holes and kalah"""
+        if player:
+            split = self._holes_num + 1
+            return self._board[split:] + self._board[:split]
+        return self._board[:]
+        
+    def set_cells(self, cells, player=0):
+        """Sets a contents of the board from the list returned by cells"""
+        self._holes_num = len(cells)//2 - 1
+        self._board = list(cells)
+        if player:
+            split = self._holes_num + 1
+            self._board = self._board[split:] + self._board[:split]
+        self._init_tables()
             
     def holes_num(self):
         """Returns number of holes"""
         return self._holes_num
     
     def player_holes(self, player):
-        """Returns a list of number of stones in player's holes"""
-        return self._holes[player]
+        """Returns a list of number of stones in player's holes
+        
+        The list is a copy, so changing it does not change the state.
+        """
+        start = player*(self._holes_num+1)
+        return self._board[start:start+self._holes_num]
         
     def player_kalah(self, player):
         """Returns amount of stones in player's kalah"""
-        return self._kalahs[player]
+        return self._board[player*(self._holes_num+1)+self._holes_num]
         
     def player_points(self, player):
         """Returns amount of stones in player's kalah"""
-        return self._kalahs[player]
+        return self._board[player*(self._holes_num+1)+self._holes_num]
+        
+    def key(self, player):
+        """Returns a 64-bit Zobrist hash of the position
+        
+        It is kept up to date by every move, so it costs nothing. Equal 
+        positions have equal keys; different ones have different keys with 
+        a very high probability.
+        
+        Args:
+            player: number of player who moves in the position (0 or 1)
+        """
+        if player:
+            return self._hash ^ ZobristPlayerKey
+        return self._hash
+        
+    def player_seeds(self, player):
+        """Returns amount of stones in player's holes (kalah is not counted)"""
+        return self._seeds[player]
+            
+    def pit_location(self, pit):
+        """Returns (player, hole) for the board cell; hole is -1 for kalahs"""
+        player, hole = divmod(pit, self._holes_num+1)
+        if hole==self._holes_num:
+            return player, -1
+        return player, hole
+        
+    def apply_event(self, pit, delta):
+        """Adds delta stones to the board cell (see KalahStateList)"""
+        keys = self._zobrist[pit]
+        self._hash ^= keys[self._board[pit]] ^ keys[self._board[pit]+delta]
+        self._board[pit] += delta
+        player, hole = divmod(pit, self._holes_num+1)
+        if hole!=self._holes_num:
+            self._seeds[player] += delta
             
-    def move(self, player, hole_num):
+    def move(self, player, hole_num, trace=False):
         """"Makes a move
         
         During this function a current player's stones are taken from hole with
@@ -118,81 +367,223 @@ class KalahState(object):
             last_move_result: result of the last move; see the list of 
                 constants on the top of the file
             last_moves: a list of consequent steps (when stones are put one
-                by one to corresponding pits)
+                by one to corresponding pits) if trace is True, else None
         
         Args:
             player: current player number (0 or 1)
             hole_num: number of hole or pit from which the move begins
+            trace: whether to store last_moves; it is needed only for the
+                moves' animation, so the searching methods do not use it
         """
         self.last_moves = None
-        last_moves = KalahStateList()
-        
-        def opposite_hole(hole_num):
-            return self._holes_num - hole_num - 1
-        
-        def make_turn(player, hole_num=-1, skip_kalah=False):
-            # place stones to player's holes
-            for hole in range(hole_num+1, self._holes_num):
-                self._holes[player][hole] += 1
-                last_moves.add_state(self, player, hole)
-                self.amount_of_stones -= 1
-                if not self.amount_of_stones:
-                    if not skip_kalah and self._holes[player][hole]==1:
-                        return MoveEndsInPlayersEmptyHole, hole
-                    return MoveEnds, hole
-            
-            # place stones to player's kalah
-            if not skip_kalah:
-                self._kalahs[player] += 1
-                last_moves.add_state(self, player, active_kalah=True)
-                self.amount_of_stones -= 1
-                if not self.amount_of_stones:
-                    return MoveEndsInPlayersKalah, -1
-
-            return MoveNotEnds, float('inf')
-            
         if hole_num<0 or hole_num>=self._holes_num or player<0 or player>1:
             return WrongMove
-        self.amount_of_stones = self._holes[player][hole_num]
-        if not self.amount_of_stones:
+        if not self._board[player*(self._holes_num+1)+hole_num]:
             return WrongMove
+        if trace:
+            self.last_moves = KalahStateList()
+        self._sow(player, hole_num, self.last_moves)
+        return self.last_move_result
+        
+    def _sow(self, player, hole_num, last_moves=None):
+        """Distributes stones of a (non-empty) hole according to the rules
         
+        Stones are not put one by one: the amount of full laps and the cell
+        of the last stone are calculated with the sowing tables. Sets 
+        last_move_result and, if last_moves list is given, stores there the 
+        trace of the move.
+        
+        Returns:
+            (pit, captured): board cell of the last stone and amount of 
+            opponent's stones that were captured (0 if there was no capture)
+        """
+        holes_num = self._holes_num
+        board = self._board
+        seeds = self._seeds
+        own = player*(holes_num+1)
+        kalah = own + holes_num
         other_player = (player+1) % 2
-        self._holes[player][hole_num] = 0
-        last_moves.add_state(self, player, hole_num)
-        while self.amount_of_stones:
-            turn_result, last_hole = make_turn(player, hole_num)
-            if turn_result==MoveEndsInPlayersKalah:
-                self.last_moves = last_moves
-                if self.is_finished(player):
-                    self.last_move_result = MoveEnds
-                else:
-                    self.last_move_result = MoveEndsInPlayersKalah
-                return self.last_move_result
-            elif turn_result==MoveEndsInPlayersEmptyHole:
-                if self._holes[other_player][opposite_hole(last_hole)]>0:
-                    self._holes[player][last_hole] = 0
-                    self._kalahs[player] += 1
-                    last_moves.add_state(self, player, last_hole, active_kalah=True)
-                    kalah_add = self._holes[other_player][opposite_hole(last_hole)]
-                    self._holes[other_player][opposite_hole(last_hole)] = 0
-                    last_moves.add_state(self, other_player, opposite_hole(last_hole))
-                    self._kalahs[player] += kalah_add
-                    last_moves.add_state(self, player, active_kalah=True)
-                self.last_moves = last_moves
-                self.last_move_result = MoveEnds
-                return self.last_move_result
-            elif turn_result==MoveEnds:
-                self.last_moves = last_moves
+        stones = board[own+hole_num]
+        ring, prefixes = self._sowing[player][hole_num]
+        if last_moves is not None:
+            self._trace_sowing(player, hole_num, last_moves)
+        
+        zobrist = self._zobrist
+        h = self._hash ^ zobrist[own+hole_num][stones] ^ zobrist[own+hole_num][0]
+        laps, rest = divmod(stones, len(ring))
+        board[own+hole_num] = 0
+        if laps:
+            for pit in ring:
+                count = board[pit]
+                h ^= zobrist[pit][count] ^ zobrist[pit][count+laps]
+                board[pit] = count + laps
+        pits, own_stones, other_stones = prefixes[rest]
+        for pit in pits:
+            count = board[pit]
+            h ^= zobrist[pit][count] ^ zobrist[pit][count+1]
+            board[pit] = count + 1
+        self._hash = h
+        seeds[player] += laps*holes_num + own_stones - stones
+        seeds[other_player] += laps*holes_num + other_stones
+        pit = ring[(stones-1) % len(ring)]
+        
+        if pit==kalah:
+            if not seeds[player]:
                 self.last_move_result = MoveEnds
-                return self.last_move_result
+            else:
+                self.last_move_result = MoveEndsInPlayersKalah
+            return pit, 0
+        
+        #
+        # Capture stones when the last one is put to the player's empty hole
+        #
+        self.last_move_result = MoveEnds
+        opposite = other_player*(holes_num+1) + holes_num - (pit-own) - 1
+        if own<=pit<kalah and board[pit]==1 and board[opposite]>0:
+            board[pit] = 0
+            kalah_add = board[opposite]
+            board[opposite] = 0
+            self._hash ^= (zobrist[pit][1] ^ zobrist[pit][0] ^ 
+                zobrist[opposite][kalah_add] ^ zobrist[opposite][0] ^ 
+                zobrist[kalah][board[kalah]] ^ zobrist[kalah][board[kalah]+kalah_add+1])
+            board[kalah] += kalah_add + 1
+            if last_moves is not None:
+                last_moves.add_event(pit, -1)
+                last_moves.add_event(kalah, 1)
+                last_moves.add_event(opposite, -kalah_add)
+                last_moves.add_event(kalah, kalah_add)
+            seeds[player] -= 1
+            seeds[other_player] -= kalah_add
+            return pit, kalah_add
+        return pit, 0
+        
+    def _trace_sowing(self, player, hole_num, last_moves):
+        """Stores to last_moves the events when stones of the hole are taken
+        and put one by one to corresponding pits (the state is not changed)"""
+        ring = self._sowing[player][hole_num][0]
+        pit = player*(self._holes_num+1) + hole_num
+        stones = self._board[pit]
+        last_moves.add_event(pit, -stones)
+        for i in xrange(stones):
+            last_moves.add_event(ring[i % len(ring)], 1)
+        
+    def do_move(self, player, hole_num, sweep=False):
+        """Makes a move in place and returns a record to take it back
+        
+        It is a version of move for the searching methods: the move can be 
+        exactly taken back with undo_move, so the searching tree can be walked
+        without copying states.
+        
+        Args:
+            player: current player number (0 or 1)
+            hole_num: number of hole or pit from which the move begins
+            sweep: if True and the game is finished after the move then all 
+                onboard stones are moved to the kalahs (like end_game does)
+            
+        Returns:
+            An undo record for undo_move or None if the move is wrong. The 
+            record is a tuple of (player, hole_num, amount of stones, cell of
+            the last stone, captured stones, previous last_move_result, 
+            previous amounts of stones on both sides, previous hash, board 
+            before the final sweep or None)
+        """
+        holes_num = self._holes_num
+        if hole_num<0 or hole_num>=holes_num or player<0 or player>1:
+            return None
+        stones = self._board[player*(holes_num+1)+hole_num]
+        if not stones:
+            return None
+        prev_result = self.last_move_result
+        seeds = self._seeds
+        prev_seeds = seeds[0], seeds[1]
+        prev_hash = self._hash
+        pit, captured = self._sow(player, hole_num)
+        swept = None
+        if sweep:
+            if self.last_move_result==MoveEndsInPlayersKalah:
+                next_player = player
+            else:
+                next_player = (player+1) % 2
+            if not seeds[next_player]:
+                swept = self._board[:]
+                self.end_game()
+        return (player, hole_num, stones, pit, captured, prev_result, 
+                prev_seeds, prev_hash, swept)
+        
+    def undo_move(self, undo):
+        """Takes back a move made by do_move
+        
+        Args:
+            undo: a record returned by do_move
+        """
+        (player, hole_num, stones, pit, captured, prev_result, prev_seeds, 
+            prev_hash, swept) = undo
+        holes_num = self._holes_num
+        board = self._board
+        if swept:
+            self._board = board = swept[:]
+        own = player*(holes_num+1)
+        if captured:
+            kalah = own + holes_num
+            board[pit] = 1
+            board[kalah] -= captured + 1
+            board[(holes_num+1)*((player+1) % 2) + holes_num - (pit-own) - 1] = captured
             
-            turn_result, last_hole = make_turn(other_player, skip_kalah=True)
-            hole_num = -1
+        #
+        # Take stones back from the cells where they were sown
+        #
+        ring, prefixes = self._sowing[player][hole_num]
+        laps, rest = divmod(stones, len(ring))
+        if laps:
+            for pit in ring:
+                board[pit] -= laps
+        for pit in prefixes[rest][0]:
+            board[pit] -= 1
+        board[own+hole_num] = stones
+        self._seeds[0], self._seeds[1] = prev_seeds
+        self._hash = prev_hash
+        self.last_move_result = prev_result
+        
+    def play_all_moves(self, player):
+        """Plays in place all possible moves of the player (like 
+        iter_all_neighbors does) one by one
+        
+        For every move the state is changed in place, the generator yields 
+        and then the move is taken back, so the state must not be changed 
+        by the caller between iterations. When the generator is closed 
+        earlier (e.g. on break) the current move is taken back too.
+        
+        Args:
+            player: active player's number (0 or 1)
             
-        self.last_moves = last_moves
-        self.last_move_result = MoveEnds
-        return self.last_move_result
+        Yields:
+            A tuple of holes from which we should pickup the stones to make
+            this particular move (several holes for extra moves; the length
+            of the tuple is the depth of the extra moves chain)
+        """
+        return self._play_chains(player, (), set())
+        
+    def _play_chains(self, player, holes, seen):
+        """Generator for play_all_moves
+        
+        Args:
+            player: active player's number (0 or 1)
+            holes: holes of the extra moves that lead to this state
+            seen: hashes of positions that were already yielded
+        """
+        own = player*(self._holes_num+1)
+        for hole in range(self._holes_num):
+            if self._board[own+hole]:
+                undo = self.do_move(player, hole)
+                try:
+                    if self.last_move_result==MoveEndsInPlayersKalah:
+                        for chain in self._play_chains(player, holes + (hole,), seen):
+                            yield chain
+                    elif self._hash not in seen:
+                        seen.add(self._hash)
+                        yield holes + (hole,)
+                finally:
+                    self.undo_move(undo)
         
     def get_last_moves(self):
         """Returns a list of last move consequent steps"""
@@ -209,10 +600,7 @@ class KalahState(object):
             i.e. when player has his/her turn but there are no any stones 
             on his/her board's side)
         """
-        for hole in self._holes[player]:
-            if hole:
-                return False
-        return True
+        return not self._seeds[player]
         
     def end_game(self):
         """Ends the game and moves all onboard stones to corresponding 
@@ -221,30 +609,46 @@ class KalahState(object):
         Returns:
             An array of result scores for each player
         """
+        holes_num = self._holes_num
+        board = self._board
         for player in [0,1]:
-            for hole in range(self._holes_num):
-                self._kalahs[player] += self._holes[player][hole]
-                self._holes[player][hole] = 0
-        return self._kalahs
+            own = player*(holes_num+1)
+            board[own+holes_num] += self._seeds[player]
+            board[own:own+holes_num] = [0]*holes_num
+            self._seeds[player] = 0
+        self._hash = 0
+        for pit, stones in enumerate(board):
+            self._hash ^= self._zobrist[pit][stones]
+        return [board[holes_num], board[2*holes_num+1]]
         
     def to_string(self):
         """Copies the state to string and returns it"""
-        return "(" + str(self._holes[0]) + ", " + str(self._kalahs[0]) + ") (" + str(self._holes[1]) + ", " + str(self._kalahs[1]) + ")"
+        return "(" + str(self.player_holes(0)) + ", " + str(self.player_kalah(0)) + ") (" + str(self.player_holes(1)) + ", " + str(self.player_kalah(1)) + ")"
         
     def __print__(self):
         """Prints the state in a text format"""
         print self.to_string()
         
     def copy(self):
-        """Returns a copy of the state"""
-        last_moves, self.last_moves = self.last_moves, None
-        state = deepcopy(self)
-        self.last_moves = last_moves
+        """Returns a copy of the state
+        
+        Only the board is copied (it takes O(2*holes_num+2) time), the
+        last_moves list is not copied.
+        """
+        state = object.__new__(self.__class__)
+        state._holes_num = self._holes_num
+        state._board = self._board[:]
+        state._seeds = self._seeds[:]
+        state._sowing = self._sowing
+        state._zobrist = self._zobrist
+        state._hash = self._hash
+        state.last_moves = None
+        state.last_move_result = self.last_move_result
         return state
         
     def is_temporary(self):
         """Not used"""
-        return self._temporary
+        return False
         
     def get_neighbors(self, player):
         """Returns a neighbor state of this state for the player's move
@@ -256,17 +660,62 @@ class KalahState(object):
             player: active player's number (0 or 1)
         """
         neighbors = []
+        own = player*(self._holes_num+1)
         for hole in range(self._holes_num):
-            if self._holes[player][hole]:
+            if self._board[own+hole]:
                 new_state = self.copy()
-                result = new_state.move(player, hole)
+                pit, captured = new_state._sow(player, hole)
+                result = new_state.last_move_result
                 if result==MoveEndsInPlayersKalah:
                     new_player = player
                 else:
                     new_player = (player+1) % 2
-                neighbors.append({'state':new_state, 'result':result, 'hole':[hole], 'player':new_player})
+                neighbors.append(KalahMove(new_state, result, (hole,), 
+                                           new_player, captured))
         return neighbors
         
+    def iter_all_neighbors(self, player):
+        """Yields neighbor states of this state for the player's move
+        
+        This function makes all possible moves including an extra moves. 
+        Neighbors are made lazily one by one in order of holes: for an extra
+        move the chain is continued before the next hole is tried. Chains 
+        that lead to the same position are merged (only the first one is 
+        yielded). So a searching method can stop before all chains are made
+        and only the states of the current chain are kept in memory.
+        
+        Args:
+            player: active player's number (0 or 1)
+            
+        Yields:
+            Possible moves and their results as KalahMove records (they can
+            be used like dictionaries {'state':new_state, 'result':result, 
+            'hole':[hole], 'player':new_player, 'depth':depth})
+        """
+        return self._iter_chains(player, (), set())
+        
+    def _iter_chains(self, player, holes, seen):
+        """Generator for iter_all_neighbors
+        
+        Args:
+            player: active player's number (0 or 1)
+            holes: holes of the extra moves that lead to this state
+            seen: hashes of positions that were already yielded
+        """
+        own = player*(self._holes_num+1)
+        for hole in range(self._holes_num):
+            if self._board[own+hole]:
+                new_state = self.copy()
+                pit, captured = new_state._sow(player, hole)
+                result = new_state.last_move_result
+                if result==MoveEndsInPlayersKalah:
+                    for neighbor in new_state._iter_chains(player, holes + (hole,), seen):
+                        yield neighbor
+                elif new_state._hash not in seen:
+                    seen.add(new_state._hash)
+                    yield KalahMove(new_state, result, holes + (hole,), 
+                                    (player+1) % 2, captured)
+        
     def get_all_neighbors(self, player):
         """Returns a neighbor state of this state for the player's move
         
@@ -276,34 +725,89 @@ class KalahState(object):
             player: active player's number (0 or 1)
             
         Returns:
-            A list of possible moves and their results in format of list of 
-            such dictionary:
-            {'state':new_state, 'result':result, 'hole':[hole], 'player':new_player}
-            Where:
-                @new_state is a neighbor state
-                @result is a result of the move that lead to this neighbot
-                @hole is a number of hole from which we should pickup the 
-                stones to make this particular move
-                @new_player the number of a new player after that move
+            A list of neighbors yielded by iter_all_neighbors
         """
-        neighbors = self.get_neighbors(player)
-        while True:
-            for i in range(len(neighbors)):
-                if neighbors[i]['result']==MoveEndsInPlayersKalah:
-                    new_state = neighbors.pop(i)
-                    new_neighbors = new_state['state'].get_neighbors(player)
-                    for new_new_state in new_neighbors:
-                        new_new_state['hole'] = new_state['hole'] + new_new_state['hole']
-                    neighbors = neighbors + new_neighbors
-            else:
-                break
-#        map(lambda x: x['state'].__print__(), neighbors) 
-        return neighbors
+        return list(self._iter_chains(player, (), set()))
         
 if __name__ == "__main__":
     state = KalahState(0)
-    state._kalahs = [6,4]
-    state._holes = [[0, 4, 8, 7, 2, 4], [0, 0, 0, 0, 0, 1]]
+    state.set_board([[0, 4, 8, 7, 2, 4], [0, 0, 0, 0, 0, 1]], [6,4])
     n = state.get_neighbors(1)
     for x in n:
-        print x['hole'], x['state'].to_string(), x['player']
\ No newline at end of file
+        print x['hole'], x['state'].to_string(), x['player']
+    
+    #
+    # Check that moves made in place are taken back exactly and give the 
+    # same states as the copying path
+    #
+    for game in range(200):
+        state = KalahState(game % 6 + 1)
+        player, step = 0, 0
+        while not state.is_finished(player):
+            step += 1
+            before = state.to_string()
+            neighbors = state.get_all_neighbors(player)
+            index = 0
+            for holes in state.play_all_moves(player):
+                assert holes==neighbors[index].holes and list(holes)==neighbors[index]['hole']
+                assert state.to_string()==neighbors[index]['state'].to_string()
+                index += 1
+            assert index==len(neighbors) and state.to_string()==before
+            
+            # all chains are expanded and ones with the same result are merged
+            finals, chains = set(), [state]
+            while chains:
+                for neighbor in chains.pop().get_neighbors(player):
+                    if neighbor['result']==MoveEndsInPlayersKalah:
+                        chains.append(neighbor['state'])
+                    else:
+                        finals.add(neighbor['state'].to_string())
+            assert finals==set(x['state'].to_string() for x in neighbors)
+            assert len(finals)==len(neighbors)
+            
+            holes = [x for x in range(6) if state.player_holes(player)[x]]
+            hole = holes[(game*31 + step*17) % len(holes)]
+            copied = state.copy()
+            result = copied.move(player, hole, trace=True)
+            replayed = state.copy()
+            for pit, delta in copied.get_last_moves().get_list():
+                replayed.apply_event(pit, delta)
+            assert replayed.to_string()==copied.to_string()
+            key = state.key(player)
+            undo = state.do_move(player, hole, sweep=True)
+            assert state.last_move_result==result
+            state.undo_move(undo)
+            assert state.to_string()==before and state.key(player)==key
+            state.do_move(player, hole)
+            assert state.to_string()==copied.to_string()
+            if result!=MoveEndsInPlayersKalah:
+                player = (player+1) % 2
+    print "do_move/undo_move and trace: OK"
+    
+    #
+    # Check that incrementally updated hash keys are correct and there are
+    # no collisions among positions of many random games
+    #
+    def full_key(state, player):
+        board = state._board
+        holes_num = state.holes_num()
+        test_state = KalahState(0, holes_num)
+        test_state.set_board([board[:holes_num], board[holes_num+1:-1]], [board[holes_num], board[-1]])
+        return test_state.key(player)
+    positions = {}
+    seed = 1
+    for game in range(10000):
+        state = KalahState(game % 6 + 1, [6, 6, 4, 5][game % 4])
+        player = 0
+        while not state.is_finished(player):
+            position = (tuple(state._board), player)
+            assert positions.setdefault(state.key(player), position)==position
+            if game % 10==0:
+                assert state.key(player)==full_key(state, player)
+            holes = [x for x in range(state.holes_num()) if state.player_holes(player)[x]]
+            seed = (seed*1103515245 + 12345) % (1<<31)
+            if state.do_move(player, holes[seed % len(holes)], sweep=True)[-1]:
+                assert state.key(player)==full_key(state, player)
+            if state.last_move_result!=MoveEndsInPlayersKalah:
+                player = (player+1) % 2
+    print "Zobrist hash: OK, %d positions without collisions" % len(positions)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""Time manager of the iterative deepening searches.
+
+The game clock gives a method the time limit of each move (see
+Method.set_run_time_limit). A search of iterative deepening that is stopped
+by the limit in the middle of a depth throws that depth away, so the time
+manager decides before each depth whether to start it at all:
+    StopTime: the budget of the move is spent
+    StopStable: the best move has not changed for several depths, a deeper
+        search is not likely to change it
+    StopPrediction: the next depth is not expected to finish in the budget;
+        its time is predicted from the nodes of the last depth, the
+        effective branching factor (the growth of the nodes from depth to
+        depth) and the measured nodes per second; only the depths that
+        searched at least _min_nodes nodes are measured (the depths that
+        come from the transposition table tell nothing about the next one)
+    StopTimeout: the deadline stopped a depth that was already started
+    StopDepth: the search reached its maximum depth
+    StopDecided: the value of the best move is a decided game, a deeper
+        search can not change it
+    StopKnown: the exact result of the position is already known (e.g.
+        from the table file) at least as deep as the AI level
+The budget is a usual move time (not more than the limit). When the score
+of a depth drops (the search has found a problem), the budget is extended,
+up to the limit, to find a way out. A depth that was started in the budget
+but goes on much longer than predicted is stopped at the deadline: a small
+multiple of the budget, not later than a share of the limit that is left
+for the reports and the GUI. The search then plays the best root move found
+so far.
+
+The report of each move is one line that starts with 'time:', so it gets
+to the game logs (see gamelog) and the constants can be tuned on real
+games.
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from time import time
+
+StopTime = 'budget spent'
+StopStable = 'stable move'
+StopPrediction = 'next depth predicted too long'
+StopTimeout = 'timeout'
+StopDepth = 'maximum depth'
+StopDecided = 'decided game'
+StopKnown = 'known move'
+
+class TimeManager(object):
+    """Budget of one move of iterative deepening
+
+    Attributes:
+        deadline: time (as time.time) when the search is stopped in any
+            case; it moves with the budget when the budget is extended
+        reason: why the search was stopped (one of the Stop* constants),
+            None while it goes on
+        extended: if the budget was extended after a drop of the score
+        _start: start time of the search
+        _limit: time limit of the move in seconds
+        _budget: seconds that the move can take now
+        _iterations: the finished depths as tuples (depth, nodes, seconds,
+            score, move); the nodes are of the depth itself
+        _nodes: amount of nodes of all the finished depths
+    """
+
+    # share of the time limit that the search can take (the hard deadline)
+    _safety = 0.9
+    # a started depth is stopped at this multiple of the budget
+    _overrun = 2.0
+    # the search is stopped when the best move is the same for this amount
+    # of depths...
+    _stable_iterations = 4
+    # ...and this share of the budget is spent
+    _stable_share = 0.3
+    # drop of the score that extends the budget...
+    _score_drop = 4
+    # ...this amount of times (up to the hard deadline)
+    _extension = 2.0
+    # a depth that comes mostly from the transposition table makes the
+    # growth of the next one look huge, so the branching factor is capped
+    # (the nodes of Kalah have six moves at most)
+    _max_branching = 6.0
+    # ...and it is not less than this (the depths of Kalah grow faster)
+    _min_branching = 2.0
+    # only the depths with this amount of nodes or more are measured
+    _min_nodes = 100
+
+    def __init__(self):
+        self.start(60)
+
+    def start(self, time_limit, move_time=None):
+        """Starts the budget of a new move
+
+        Args:
+            time_limit: seconds that are left for the move on the clock
+            move_time: seconds of a usual move; the whole limit by default
+        """
+        self._start = time()
+        self._limit = time_limit * self._safety
+        self._budget = min(move_time or self._limit, self._limit)
+        self._set_deadline()
+        self.reason = None
+        self.extended = False
+        self._iterations = []
+        self._nodes = 0
+
+    def _set_deadline(self):
+        self.deadline = self._start + min(self._budget * self._overrun, self._limit)
+
+    def elapsed(self):
+        """Returns seconds since the start of the move"""
+        return time() - self._start
+
+    def is_expired(self):
+        """Checks if the deadline has passed"""
+        return time() > self.deadline
+
+    def iteration(self, depth, nodes, score, move):
+        """Records a finished depth
+
+        Args:
+            depth: the depth
+            nodes: amount of nodes of the whole move so far
+            score: value of the best move
+            move: the best move (anything that can be compared)
+        """
+        previous = [iteration[3] for iteration in self._iterations[-2:]]
+        self._iterations.append((depth, nodes - self._nodes, self.elapsed(),
+                                 score, move))
+        self._nodes = nodes
+        # the leaves of the odd and even depths are positions of different
+        # players, so the score is compared with the same parity
+        if previous and score is not None and previous[0] is not None and \
+                score <= previous[0] - self._score_drop and not self.extended:
+            self.extended = True
+            self._budget = min(self._budget * self._extension, self._limit)
+            self._set_deadline()
+
+    def stop(self, reason):
+        """Records that the search was stopped by itself"""
+        self.reason = reason
+
+    def next_iteration(self):
+        """Checks if the next depth should be searched
+
+        Returns:
+            True to search it; otherwise False and the reason is set
+        """
+        elapsed = self.elapsed()
+        if elapsed >= self._budget:
+            self.reason = StopTime
+        elif self._is_stable() and elapsed >= self._budget * self._stable_share:
+            self.reason = StopStable
+        elif elapsed + self.predicted() > self._budget:
+            self.reason = StopPrediction
+        return self.reason is None
+
+    def _is_stable(self):
+        moves = [iteration[4] for iteration in self._iterations[-self._stable_iterations:]]
+        return (not self.extended and len(moves) == self._stable_iterations and
+                moves.count(moves[0]) == len(moves))
+
+    def _measured(self):
+        # the depths that searched enough nodes to predict the next one
+        return [iteration for iteration in self._iterations
+                if iteration[1] >= self._min_nodes]
+
+    def branching(self):
+        """Returns the effective branching factor of the last measured
+        depths or None if there are less than two of them
+
+        The extra moves make the odd and even depths grow differently, so
+        with three depths the factor is the mean growth of the last two.
+        """
+        nodes = [iteration[1] for iteration in self._measured()[-3:]]
+        if len(nodes) < 2:
+            return None
+        if len(nodes) == 3:
+            growth = (float(nodes[2]) / nodes[0]) ** 0.5
+        else:
+            growth = float(nodes[1]) / nodes[0]
+        return min(max(self._min_branching, growth), self._max_branching)
+
+    def speed(self):
+        """Returns the measured nodes per second"""
+        elapsed = self._iterations[-1][2] if self._iterations else 0
+        return self._nodes / elapsed if elapsed > 0 else 0.0
+
+    def predicted(self):
+        """Returns seconds that the next depth is expected to take (0 if
+        there is not enough data yet)"""
+        branching, speed = self.branching(), self.speed()
+        if branching is None or not speed:
+            return 0.0
+        return self._measured()[-1][1] * branching / speed
+
+    def report(self):
+        """Returns a short human readable report of the move"""
+        depth = self._iterations[-1][0] if self._iterations else 0
+        branching = self.branching()
+        return "time: depth %d in %.2fs of %.2fs%s (limit %.1fs), %s; " \
+            "EBF %s, %.0f nodes/s, next depth %.2fs" % \
+            (depth, self.elapsed(), self._budget, " extended" if self.extended else "",
+             self._limit, self.reason,
+             "-" if branching is None else "%.1f" % branching,
+             self.speed(), self.predicted())
+
+#
+# Checks with a search that is simulated by the recorded depths
+#
+if __name__ == "__main__":
+    timeman = TimeManager()
+    timeman.start(10, 5)
+    assert timeman._budget == 5 and abs(timeman.deadline - time() - 9) < 0.01
+    assert timeman.next_iteration() and timeman.branching() is None
+
+    # 100 nodes/s, the nodes grow 3 times each depth
+    timeman._start -= 1
+    timeman.iteration(2, 100, 10, 0)
+    timeman._start -= 3
+    timeman.iteration(3, 400, 12, 0)
+    assert timeman.branching() == 3.0 and abs(timeman.speed() - 100.0) < 0.1
+    assert abs(timeman.predicted() - 9.0) < 0.01
+    assert not timeman.next_iteration() and timeman.reason == StopPrediction
+
+    # a drop of the score extends the budget up to the limit
+    timeman.start(10, 5)
+    timeman.iteration(2, 10, 10, 0)
+    timeman.iteration(3, 20, 12, 0)
+    timeman.iteration(4, 30, 5, 1)
+    assert timeman.extended and timeman._budget == 9.0
+    timeman.start(10, 8)
+    timeman.iteration(2, 10, 10, 0)
+    timeman.iteration(3, 20, 12, 0)
+    timeman.iteration(4, 30, 5, 1)
+    assert timeman._budget == 9.0
+
+    # a started depth is stopped at twice the budget, later if it is extended
+    timeman.start(10, 2)
+    assert abs(timeman.deadline - time() - 4) < 0.01
+    timeman.iteration(2, 10, 10, 0)
+    timeman.iteration(3, 20, 12, 0)
+    timeman.iteration(4, 30, 5, 1)
+    assert timeman._budget == 4.0 and abs(timeman.deadline - time() - 8) < 0.01
+
+    # the depths from a warm table are not measured
+    timeman.start(10, 5)
+    for depth in range(2, 8):
+        timeman.iteration(depth, depth, 10, 0)
+    assert timeman.branching() is None and timeman.predicted() == 0.0
+    timeman._start -= 1
+    timeman.iteration(8, 1000, 10, 0)
+    timeman._start -= 1
+    timeman.iteration(9, 1500, 10, 0)
+    assert timeman.branching() == 2.0 and abs(timeman.predicted() - 1.33) < 0.01
+
+    # the same move for several depths stops the search
+    timeman.start(10, 5)
+    for depth in range(2, 6):
+        timeman.iteration(depth, depth * 10, 10, 3)
+    assert timeman.next_iteration()
+    timeman._start -= 2
+    assert not timeman.next_iteration() and timeman.reason == StopStable
+
+    # the budget is spent
+    timeman.start(10, 1)
+    timeman._start -= 1
+    assert not timeman.next_iteration() and timeman.reason == StopTime
+    assert not timeman.is_expired()
+    timeman._start -= 10
+    timeman.deadline -= 10
+    assert timeman.is_expired()
+    print timeman.report()
+    print "Time manager: OK"
@@ -0,0 +1,614 @@
+#!/usr/bin/env python
+"""Transposition table for the searching methods.
+
+Different orders of moves often lead to the same position, especially in
+Kalah where stones can reach the same holes by different sowings. The
+transposition table keeps the results of the searched positions, so a
+position is searched only once for each depth, and a deeper search of
+iterative deepening can try the best move of the previous one first.
+
+The table has a fixed size that is given in megabytes. Each position falls
+into one bucket (by its Zobrist key, see KalahState.key) with two entries:
+    depth-preferred: it is replaced only by a result of a search that is
+        not less deep (so the most expensive results are kept)
+    always-replace: it is replaced by every other result
+Fields of the entries are kept in flat arrays, so an entry takes 22 bytes.
+
+Every entry keeps:
+    key: the position key (with the side to move)
+    draft: depth of the search below the position
+    bound: whether the value is exact, or only a lower or upper bound of
+        the real value (see BoundExact, BoundLower and BoundUpper)
+    value: value of the position for the player who moves in it
+    move: the best move; it is the key of the position after the move
+        (extra moves chains are merged by their resulting positions, so a
+        resulting position defines the move), 0 if there is no move
+
+The deep results can be kept between games in a table file (see TableFile).
+The file is memory mapped and only looked up when the position is not in
+the table, so it can be much bigger than the table. The file starts with a
+header (see the FileMagic, FileVersion and _file_header below) that is
+followed by the entries sorted by key, so a position is found with a
+binary search.
+
+SharedTranspositionTable keeps the same buckets in an anonymous memory map,
+so the processes that are forked after it is made (e.g. the workers of a
+parallel search) share one table. Entries are written without locks: an
+entry keeps its key XORed with its other words (the lockless hashing of
+Hyatt and Mann), so an entry that is torn by two processes that write it
+at once does not match its key and it is just a miss.
+
+@author: Oleksii Molchanovskyi
+@organization: Kyiv Polytechnic Institute
+@country: Ukraine
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import mmap
+import struct
+import zlib
+from array import array
+
+# The value is exact
+BoundExact = 0
+# The real value is not less than the value (the search failed high)
+BoundLower = 1
+# The real value is not greater than the value (the search failed low)
+BoundUpper = 2
+
+# Size of one entry in bytes: key, move, value, draft and bound
+EntrySize = 8 + 8 + 4 + 1 + 1
+
+# First bytes of a table file
+FileMagic = b'KALAHTT\0'
+# Version of the table file format; files of other versions are ignored
+FileVersion = 1
+
+# Header of a table file: magic, version, size of an entry, tag (the name
+# of the method whose values are kept), amount of entries, the smallest
+# draft of the entries and CRC-32 checksum of the entries
+_file_header = struct.Struct('<8sHH16sIiI')
+# Entry of a table file: key, move, value, draft and bound
+_file_entry = struct.Struct('<qqibb')
+
+class _Int64Array(object):
+    """Array of 64-bit signed integers kept in a bytearray
+
+    It is used for the keys and moves of TranspositionTable where the array
+    module has no 64-bit type (Python 2 on Windows: 'l' has 32 bits there
+    and 'q' does not exist).
+    """
+
+    _item = struct.Struct('<q')
+
+    def __init__(self, size):
+        self._data = bytearray(size * self._item.size)
+
+    def __len__(self):
+        return len(self._data) // self._item.size
+
+    def __getitem__(self, index):
+        return self._item.unpack_from(self._data, index * self._item.size)[0]
+
+    def __setitem__(self, index, value):
+        self._item.pack_into(self._data, index * self._item.size, value)
+
+def _int64_array(size):
+    """Returns an array of size zero 64-bit signed integers; a plain array
+    if the platform has a 64-bit type for it, _Int64Array otherwise"""
+    for typecode in ('q', 'l'):
+        try:
+            if array(typecode).itemsize==8:
+                return array(typecode, [0]) * size
+        except ValueError:
+            pass # no such type code (Python 2 has no 'q')
+    return _Int64Array(size)
+
+class TableFile(object):
+    """Read only memory mapped table file
+
+    Attributes:
+        min_draft: the smallest draft of the entries in the file
+        _count: amount of entries
+        _file, _map: the open file and its memory map
+    """
+
+    def __init__(self, path, tag=''):
+        """Opens a table file and checks its header and checksum
+
+        Args:
+            path: name of the file
+            tag: name of the method; the file must have the same tag
+
+        Raises:
+            IOError if the file can not be read, ValueError if it is not a
+            valid table file for the tag
+        """
+        self._file = open(path, 'rb')
+        self._map = None
+        try:
+            header = self._file.read(_file_header.size)
+            if len(header)<_file_header.size:
+                raise ValueError("Table file is too short: %s" % path)
+            (magic, version, entry_size, file_tag, count, min_draft,
+                checksum) = _file_header.unpack(header)
+            if magic!=FileMagic or version!=FileVersion or \
+                    entry_size!=_file_entry.size:
+                raise ValueError("Unknown table file format: %s" % path)
+            if file_tag.rstrip(b'\0')!=tag.encode('utf-8')[:16]:
+                raise ValueError("Table file of another method: %s" % path)
+            size = _file_header.size + count*_file_entry.size
+            if os.fstat(self._file.fileno()).st_size!=size:
+                raise ValueError("Table file has a wrong size: %s" % path)
+            if count:
+                self._map = mmap.mmap(self._file.fileno(), size,
+                                      access=mmap.ACCESS_READ)
+                if zlib.crc32(self._map[_file_header.size:]) & 0xFFFFFFFF!=checksum:
+                    raise ValueError("Table file is damaged: %s" % path)
+        except:
+            self.close()
+            raise
+        self._count = count
+        self.min_draft = min_draft
+
+    def __len__(self):
+        """Returns amount of entries in the file"""
+        return self._count
+
+    def close(self):
+        """Closes the file"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._count = 0
+
+    def probe(self, key):
+        """Looks up the position with a binary search
+
+        Returns:
+            A tuple (draft, bound, value, move) or None if the position is
+            not in the file
+        """
+        unpack_from, data = _file_entry.unpack_from, self._map
+        offset, size = _file_header.size, _file_entry.size
+        low, high = 0, self._count
+        while low<high:
+            middle = (low+high) // 2
+            entry = unpack_from(data, offset + middle*size)
+            if entry[0]<key:
+                low = middle + 1
+            elif entry[0]>key:
+                high = middle
+            else:
+                return entry[3], entry[4], entry[2], entry[1]
+        return None
+
+    def entries(self):
+        """Yields all entries as tuples (key, draft, bound, value, move)"""
+        offset, size = _file_header.size, _file_entry.size
+        for index in xrange(self._count):
+            key, move, value, draft, bound = _file_entry.unpack_from(
+                self._map, offset + index*size)
+            yield key, draft, bound, value, move
+
+def write_table_file(path, entries, tag=''):
+    """Writes a table file
+
+    The file is written to a temporary file first and then renamed, so the
+    old file is replaced only by a complete new one.
+
+    Args:
+        path: name of the file
+        entries: list of tuples (key, draft, bound, value, move) with
+            different keys
+        tag: name of the method whose values are in the entries
+    """
+    entries = sorted(entries)
+    data = b''.join(_file_entry.pack(key, move, value, draft, bound)
+                    for key, draft, bound, value, move in entries)
+    min_draft = min(entry[1] for entry in entries) if entries else 0
+    header = _file_header.pack(FileMagic, FileVersion, _file_entry.size,
+                               tag.encode('utf-8')[:16], len(entries),
+                               min_draft, zlib.crc32(data) & 0xFFFFFFFF)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as output:
+        output.write(header)
+        output.write(data)
+    if os.name=='nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+class TranspositionTable(object):
+    """Fixed size transposition table with two entries in a bucket
+
+    Attributes:
+        probes: amount of lookups
+        hits: amount of lookups that found the position (in the table or in
+            the table file)
+        file_hits: amount of lookups that found the position in the file
+        stores: amount of stored results
+        _file: TableFile that is looked up for the positions that are not
+            in the table or None
+        _buckets: amount of buckets; entries 2*i and 2*i+1 are the
+            depth-preferred and the always-replace entries of bucket i
+        _keys, _moves, _values, _drafts, _bounds: arrays with the fields
+            of the entries; draft -1 marks an empty entry
+    """
+
+    def __init__(self, size_mb=16):
+        """Inits an empty table
+
+        Args:
+            size_mb: size of the table in megabytes
+        """
+        self._buckets = max(1, int(size_mb * 1024 * 1024) // (2 * EntrySize))
+        self._file = None
+        self.clear()
+
+    def clear(self):
+        """Removes all the entries and resets the counters (the table file
+        stays attached)"""
+        entries = 2 * self._buckets
+        self._keys = _int64_array(entries)
+        self._moves = _int64_array(entries)
+        self._values = array('i', [0]) * entries
+        self._drafts = array('b', [-1]) * entries
+        self._bounds = array('b', [0]) * entries
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Resets the counters"""
+        self.probes = self.hits = self.file_hits = self.stores = 0
+
+    def size(self):
+        """Returns size of the table in bytes"""
+        return 2 * self._buckets * EntrySize
+
+    def probe(self, key, draft=None):
+        """Looks up the position
+
+        Args:
+            key: the position key (see KalahState.key)
+            draft: depth of the search that needs the result; the table
+                file is looked up only if it is None or not less than the
+                smallest draft in the file (there are much more shallow
+                positions and a lookup in the file is slower)
+
+        Returns:
+            A tuple (draft, bound, value, move) or None if the position is
+            not in the table
+        """
+        self.probes += 1
+        index = 2 * (key % self._buckets)
+        keys, drafts = self._keys, self._drafts
+        if keys[index]!=key or drafts[index]<0:
+            index += 1
+            if keys[index]!=key or drafts[index]<0:
+                if self._file is None or draft is not None and draft<self._file.min_draft:
+                    return None
+                entry = self._file.probe(key)
+                if entry is None:
+                    return None
+                self.hits += 1
+                self.file_hits += 1
+                self.store(key, *entry)
+                self.stores -= 1
+                return entry
+        self.hits += 1
+        return (drafts[index], self._bounds[index], self._values[index],
+                self._moves[index])
+
+    def store(self, key, draft, bound, value, move=0):
+        """Stores a result of the search of a position
+
+        Args:
+            key: the position key (see KalahState.key)
+            draft: depth of the search below the position
+            bound: BoundExact, BoundLower or BoundUpper
+            value: value of the position for the player who moves in it
+            move: key of the position after the best move or 0
+        """
+        self.stores += 1
+        index = 2 * (key % self._buckets)
+        drafts = self._drafts
+        if draft<drafts[index] and self._keys[index]!=key:
+            index += 1
+        elif self._keys[index+1]==key:
+            # the depth-preferred entry gets the position, so do not keep
+            # its older result in the always-replace entry
+            drafts[index+1] = -1
+        self._keys[index] = key
+        self._moves[index] = move
+        self._values[index] = value
+        drafts[index] = min(draft, 127)
+        self._bounds[index] = bound
+
+    def entries(self, min_draft=0):
+        """Yields the entries with draft not less than min_draft as tuples
+        (key, draft, bound, value, move)"""
+        keys, drafts = self._keys, self._drafts
+        for index in xrange(len(keys)):
+            if drafts[index]>=min_draft:
+                yield (keys[index], drafts[index], self._bounds[index],
+                       self._values[index], self._moves[index])
+
+    def load(self, path, tag=''):
+        """Attaches a table file
+
+        If the file does not exist or it is not valid then the table works
+        without a file (a message is printed for a bad file).
+
+        Args:
+            path: name of the file
+            tag: name of the method whose values are kept in the file
+
+        Returns:
+            True if the file is attached
+        """
+        self.close()
+        if not os.path.exists(path):
+            return False
+        try:
+            self._file = TableFile(path, tag)
+        except (IOError, ValueError) as error:
+            print "Transposition table file is not used:", error
+            return False
+        return True
+
+    def save(self, path, tag='', min_draft=4, max_entries=1<<20):
+        """Merges the deep entries of the table into the table file
+
+        Entries of the attached file are kept unless the table has the
+        same position with a deeper (or equally deep) result. If there are
+        more than max_entries entries then the deepest ones are kept. The
+        new file is attached to the table.
+
+        Args:
+            path: name of the file
+            tag: name of the method whose values are kept in the file
+            min_draft: entries with a smaller draft are not saved
+            max_entries: maximum amount of entries in the file
+        """
+        merged = {}
+        if self._file is None and os.path.exists(path):
+            self.load(path, tag)
+        if self._file is not None:
+            for entry in self._file.entries():
+                merged[entry[0]] = entry
+        for entry in self.entries(min_draft):
+            old = merged.get(entry[0])
+            if old is None or old[1]<=entry[1]:
+                merged[entry[0]] = entry
+        entries = merged.values()
+        if len(entries)>max_entries:
+            entries.sort(key=lambda entry: entry[1], reverse=True)
+            del entries[max_entries:]
+        self.close()
+        write_table_file(path, entries, tag)
+        self.load(path, tag)
+
+    def close(self):
+        """Detaches the table file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def hit_rate(self):
+        """Returns a part of lookups that found the position (from 0 to 1)"""
+        return float(self.hits) / self.probes if self.probes else 0.0
+
+    def stats(self):
+        """Returns a short human readable report of the table usage"""
+        report = "tt: %d probes, %.0f%% hits, %d stores" % \
+            (self.probes, self.hit_rate() * 100, self.stores)
+        if self._file is not None:
+            report += ", %d hits of %d in the file" % (self.file_hits,
+                                                       len(self._file))
+        return report
+
+# Entry of the shared table: key XOR move XOR data, move and data (value,
+# draft + 1 and bound packed to one word; draft + 1 is 0 in an empty entry)
+_shared_entry = struct.Struct('<qqq')
+
+class SharedTranspositionTable(TranspositionTable):
+    """Transposition table in a memory map shared by forked processes
+
+    It has the same interface and replacement policy as
+    TranspositionTable; the counters are kept by each process.
+
+    Attributes:
+        _map: anonymous memory map with the entries (see _shared_entry)
+    """
+
+    def __init__(self, size_mb=16):
+        """Inits an empty table
+
+        Args:
+            size_mb: size of the table in megabytes
+        """
+        self._buckets = max(1, int(size_mb * 1024 * 1024) // (2 * _shared_entry.size))
+        self._map = mmap.mmap(-1, 2 * self._buckets * _shared_entry.size)
+        self._file = None
+        self.clear()
+
+    def clear(self):
+        """Removes all the entries for all processes and resets the
+        counters of this process"""
+        self._map[:] = b'\0' * len(self._map)
+        self.reset_stats()
+
+    def size(self):
+        """Returns size of the table in bytes"""
+        return len(self._map)
+
+    def _read(self, index, key):
+        # Returns the entry if it keeps the key, None otherwise
+        check, move, data = _shared_entry.unpack_from(self._map, index * _shared_entry.size)
+        if check ^ move ^ data != key or not data & 0xFF00:
+            return None
+        return ((data >> 8) & 0xFF) - 1, data & 0xFF, data >> 16, move
+
+    def _write(self, index, key, draft, bound, value, move):
+        data = (value << 16) | ((draft + 1) << 8) | bound
+        _shared_entry.pack_into(self._map, index * _shared_entry.size,
+                                key ^ move ^ data, move, data)
+
+    def probe(self, key, draft=None):
+        """Looks up the position (see TranspositionTable.probe)"""
+        self.probes += 1
+        index = 2 * (key % self._buckets)
+        entry = self._read(index, key) or self._read(index + 1, key)
+        if entry is None:
+            if self._file is None or draft is not None and draft<self._file.min_draft:
+                return None
+            entry = self._file.probe(key)
+            if entry is None:
+                return None
+            self.file_hits += 1
+            self.store(key, *entry)
+            self.stores -= 1
+        self.hits += 1
+        return entry
+
+    def store(self, key, draft, bound, value, move=0):
+        """Stores a result of the search of a position (see
+        TranspositionTable.store)"""
+        self.stores += 1
+        index = 2 * (key % self._buckets)
+        data = _shared_entry.unpack_from(self._map, index * _shared_entry.size)[2]
+        if data & 0xFF00 and draft < ((data >> 8) & 0xFF) - 1 and \
+                self._read(index, key) is None:
+            index += 1
+        elif self._read(index + 1, key) is not None:
+            # the depth-preferred entry gets the position, so do not keep
+            # its older result in the always-replace entry
+            self._map[(index + 1) * _shared_entry.size:
+                      (index + 2) * _shared_entry.size] = b'\0' * _shared_entry.size
+        self._write(index, key, min(draft, 127), bound, value, move)
+
+    def entries(self, min_draft=0):
+        """Yields the entries with draft not less than min_draft as tuples
+        (key, draft, bound, value, move)"""
+        for index in xrange(2 * self._buckets):
+            check, move, data = _shared_entry.unpack_from(self._map, index * _shared_entry.size)
+            if data & 0xFF00 and ((data >> 8) & 0xFF) - 1 >= min_draft:
+                yield (check ^ move ^ data, ((data >> 8) & 0xFF) - 1, data & 0xFF,
+                       data >> 16, move)
+
+#
+# Checks of the replacement policy
+#
+if __name__ == "__main__":
+    from multiprocessing import Process
+
+    def check_replacement(table):
+        buckets = table._buckets
+        assert table.size() <= 0.001 * 1024 * 1024
+        assert table.probe(5) is None
+
+        table.store(5, 4, BoundExact, 10, 77)
+        assert table.probe(5) == (4, BoundExact, 10, 77)
+        # a shallower result of another position goes to the always-replace entry
+        table.store(5 + buckets, 2, BoundLower, -3)
+        assert table.probe(5) == (4, BoundExact, 10, 77)
+        assert table.probe(5 + buckets) == (2, BoundLower, -3, 0)
+        # and it is replaced by the next one
+        table.store(5 + 2*buckets, 1, BoundUpper, 1)
+        assert table.probe(5 + buckets) is None
+        # a deeper result takes the depth-preferred entry
+        table.store(5 + 3*buckets, 6, BoundExact, 0, 1)
+        assert table.probe(5) is None
+        assert table.probe(5 + 3*buckets) == (6, BoundExact, 0, 1)
+        # a shallower result of the same position replaces it too
+        table.store(5 + 3*buckets, 3, BoundLower, 2, 1)
+        assert table.probe(5 + 3*buckets) == (3, BoundLower, 2, 1)
+        # negative keys
+        table.store(-(1<<63), 1, BoundExact, 1)
+        assert table.probe(-(1<<63)) == (1, BoundExact, 1, 0)
+        print table.stats()
+
+    check_replacement(TranspositionTable(0.001))
+    # the keys and moves on a platform without a 64-bit array type
+    table = TranspositionTable(0.001)
+    table._keys = _Int64Array(len(table._keys))
+    table._moves = _Int64Array(len(table._moves))
+    check_replacement(table)
+    table.store((1<<63) - 1, 2, BoundExact, 3, -(1<<63))
+    assert table.probe((1<<63) - 1) == (2, BoundExact, 3, -(1<<63))
+    print "Transposition table: OK"
+
+    #
+    # Shared table: the same policy, entries of other processes and torn
+    # entries
+    #
+    table = SharedTranspositionTable(0.001)
+    check_replacement(table)
+    assert table.probe(-(1<<63) + 1) is None
+    assert sorted(table.entries(2)) == [(5 + 3*table._buckets, 3, BoundLower, 2, 1)]
+    def store_values(table):
+        for key in range(1, 100):
+            table.store(key, 5, BoundExact, -key, key + 1)
+    table = SharedTranspositionTable(1)
+    process = Process(target=store_values, args=(table,))
+    process.start()
+    process.join()
+    assert table.probe(42) == (5, BoundExact, -42, 43)
+    # a half written entry does not match its key
+    offset = 2 * (42 % table._buckets) * _shared_entry.size
+    table._map[offset + 8:offset + 16] = struct.pack('<q', 1234)
+    assert table.probe(42) is None
+    table.clear()
+    assert table.probe(43) is None
+    print "Shared transposition table: OK"
+
+    #
+    # Table file: save, load, merge and damaged files
+    #
+    path = 'test_table.tt'
+    table = TranspositionTable(1)
+    for key in range(-50, 50):
+        table.store(key * 7919, abs(key) % 10, BoundLower, key, key + 1)
+    table.save(path, 'Test')
+    assert len(table._file) == len([key for key in range(-50, 50) if abs(key) % 10 >= 4])
+    other = TranspositionTable(1)
+    assert other.load(path, 'Test') and not other.load(path, 'Other')
+    assert other.load(path, 'Test')
+    assert other.probe(7 * 7919) == (7, BoundLower, 7, 8)
+    assert other.probe(-49 * 7919, 8) == (9, BoundLower, -49, -48)
+    assert other.probe(-49 * 7919, 8) == (9, BoundLower, -49, -48)
+    assert other.file_hits == 2 and other.hits == 3
+    assert other.probe(7 * 7919 + 1) is None
+    assert other.probe(2 * 7919, 2) is None
+    # merge: a deeper result replaces the one from the file
+    other.store(7 * 7919, 20, BoundExact, 100, 5)
+    other.store(123, 5, BoundUpper, 1, 0)
+    other.save(path, 'Test')
+    third = TranspositionTable(1)
+    third.load(path, 'Test')
+    assert third.probe(7 * 7919) == (20, BoundExact, 100, 5)
+    assert third.probe(123) == (5, BoundUpper, 1, 0)
+    assert third.probe(-49 * 7919) == (9, BoundLower, -49, -48)
+    third.close()
+    # a damaged file is not used
+    with open(path, 'r+b') as damaged:
+        damaged.seek(-3, 2)
+        damaged.write(b'xyz')
+    assert not third.load(path, 'Test')
+    os.remove(path)
+    print "Transposition table file: OK"
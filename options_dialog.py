@@ -17,10 +17,10 @@ except AttributeError:
 class Ui_kalah_options(object):
     def setupUi(self, kalah_options):
         kalah_options.setObjectName(_fromUtf8("kalah_options"))
-        kalah_options.resize(238, 362)
+        kalah_options.resize(238, 388)
         kalah_options.setModal(True)
         self.buttonBox = QtGui.QDialogButtonBox(kalah_options)
-        self.buttonBox.setGeometry(QtCore.QRect(-140, 320, 341, 32))
+        self.buttonBox.setGeometry(QtCore.QRect(-140, 346, 341, 32))
         self.buttonBox.setOrientation(QtCore.Qt.Horizontal)
         self.buttonBox.setStandardButtons(QtGui.QDialogButtonBox.Cancel|QtGui.QDialogButtonBox.Ok)
         self.buttonBox.setObjectName(_fromUtf8("buttonBox"))
@@ -75,7 +75,7 @@ class Ui_kalah_options(object):
         self.stones.setObjectName(_fromUtf8("stones"))
         self.gridLayout_3.addWidget(self.stones, 0, 2, 1, 1)
         self.timing_box = QtGui.QGroupBox(kalah_options)
-        self.timing_box.setGeometry(QtCore.QRect(10, 170, 221, 79))
+        self.timing_box.setGeometry(QtCore.QRect(10, 170, 221, 105))
         self.timing_box.setObjectName(_fromUtf8("timing_box"))
         self.gridLayout_2 = QtGui.QGridLayout(self.timing_box)
         self.gridLayout_2.setObjectName(_fromUtf8("gridLayout_2"))
@@ -87,10 +87,14 @@ class Ui_kalah_options(object):
         self.gridLayout_2.addWidget(self.time_per_move_label, 1, 0, 1, 1)
         self.time_per_move = QtGui.QSpinBox(self.timing_box)
         self.time_per_move.setMinimumSize(QtCore.QSize(50, 0))
+        self.time_per_move.setMinimum(2)
         self.time_per_move.setObjectName(_fromUtf8("time_per_move"))
         self.gridLayout_2.addWidget(self.time_per_move, 1, 1, 1, 1)
+        self.ponder = QtGui.QCheckBox(self.timing_box)
+        self.ponder.setObjectName(_fromUtf8("ponder"))
+        self.gridLayout_2.addWidget(self.ponder, 2, 0, 1, 2)
         self.visualization_box = QtGui.QGroupBox(kalah_options)
-        self.visualization_box.setGeometry(QtCore.QRect(10, 260, 221, 53))
+        self.visualization_box.setGeometry(QtCore.QRect(10, 286, 221, 53))
         self.visualization_box.setObjectName(_fromUtf8("visualization_box"))
         self.gridLayout = QtGui.QGridLayout(self.visualization_box)
         self.gridLayout.setObjectName(_fromUtf8("gridLayout"))
@@ -114,6 +118,7 @@ class Ui_kalah_options(object):
         self.timing_box.setTitle(QtGui.QApplication.translate("kalah_options", "Timing", None, QtGui.QApplication.UnicodeUTF8))
         self.timer_on.setText(QtGui.QApplication.translate("kalah_options", "Timer ON", None, QtGui.QApplication.UnicodeUTF8))
         self.time_per_move_label.setText(QtGui.QApplication.translate("kalah_options", "Timer per move, sec:", None, QtGui.QApplication.UnicodeUTF8))
+        self.ponder.setText(QtGui.QApplication.translate("kalah_options", "AI thinks on opponent\'s time", None, QtGui.QApplication.UnicodeUTF8))
         self.visualization_box.setTitle(QtGui.QApplication.translate("kalah_options", "Visualization", None, QtGui.QApplication.UnicodeUTF8))
         self.show_moves.setText(QtGui.QApplication.translate("kalah_options", "Show moves", None, QtGui.QApplication.UnicodeUTF8))
 